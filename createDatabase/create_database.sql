@@ -31,12 +31,14 @@ CREATE TABLE "grafana_ml_model_correlation" (
   "id_feature1" INTEGER,
   "id_feature2" INTEGER,
   "value" DOUBLE PRECISION,
+  "p_value" DOUBLE PRECISION,
   "type" TEXT
 );
 
 CREATE TABLE "grafana_ml_model_regression" (
   "index" INTEGER,
   "id" SERIAL PRIMARY KEY,
+  "id_target" INTEGER,
   "id_feature" INTEGER,
   "coeff" DOUBLE PRECISION,
   "std_err" DOUBLE PRECISION,
@@ -45,6 +47,18 @@ CREATE TABLE "grafana_ml_model_regression" (
   "type" TEXT
 );
 
+CREATE TABLE "grafana_ml_model_regression_point" (
+  "index" INTEGER,
+  "type" TEXT,
+  "id_point" INTEGER,
+  "target" DOUBLE PRECISION,
+  "fitted" DOUBLE PRECISION,
+  "residual" DOUBLE PRECISION,
+  "is_sample" BOOLEAN
+);
+
+CREATE INDEX ON "grafana_ml_model_regression_point" ("index", "type");
+
 CREATE TABLE "grafana_ml_model_point_kmeans" (
   "index" INTEGER,
   "id" SERIAL PRIMARY KEY,
@@ -82,6 +96,19 @@ CREATE TABLE "grafana_ml_model_metrics_clustering" (
   "type" TEXT,
   "inertia" DOUBLE PRECISION,
   "silhoutte_coefficient" DOUBLE PRECISION,
+  "silhouette_ci_lower" DOUBLE PRECISION,
+  "silhouette_ci_upper" DOUBLE PRECISION,
+  "silhouette_sample_size" INTEGER,
+  "davies_bouldin_index" DOUBLE PRECISION
+);
+
+CREATE TABLE "grafana_ml_model_clustering_sweep" (
+  "index" INTEGER,
+  "id" SERIAL PRIMARY KEY,
+  "type" TEXT,
+  "k" INTEGER,
+  "inertia" DOUBLE PRECISION,
+  "silhoutte_coefficient" DOUBLE PRECISION,
   "davies_bouldin_index" DOUBLE PRECISION
 );
 
@@ -95,6 +122,57 @@ CREATE TABLE "grafana_ml_model_hierarchical_clustering" (
 );
 
 
+CREATE TABLE "grafana_ml_model_hierarchical_cut" (
+  "index" INTEGER,
+  "k" INTEGER,
+  "id_point" INTEGER,
+  "number_cluster" INTEGER
+);
+
+CREATE INDEX ON "grafana_ml_model_hierarchical_cut" ("index", "k");
+
+CREATE TABLE "grafana_ml_model_dendrogram" (
+  "index" INTEGER,
+  "id" SERIAL PRIMARY KEY,
+  "truncate_level" INTEGER,
+  "id_node" INTEGER,
+  "x" DOUBLE PRECISION,
+  "height" DOUBLE PRECISION,
+  "x_left" DOUBLE PRECISION,
+  "x_right" DOUBLE PRECISION,
+  "height_left" DOUBLE PRECISION,
+  "height_right" DOUBLE PRECISION,
+  "leaf_order" INTEGER,
+  "count" INTEGER
+);
+
+CREATE INDEX ON "grafana_ml_model_dendrogram" ("index", "truncate_level");
+
+
+CREATE TABLE "grafana_ml_model_moments" (
+  "index" INTEGER,
+  "id" SERIAL PRIMARY KEY,
+  "type" TEXT,
+  "n" BIGINT,
+  "last_id_point" INTEGER
+);
+
+CREATE TABLE "grafana_ml_model_moments_mean" (
+  "id_moments" INTEGER,
+  "id_feature" INTEGER,
+  "value" DOUBLE PRECISION
+);
+
+CREATE INDEX ON "grafana_ml_model_moments_mean" ("id_moments");
+
+CREATE TABLE "grafana_ml_model_moments_comoment" (
+  "id_moments" INTEGER,
+  "id_feature1" INTEGER,
+  "id_feature2" INTEGER,
+  "value" DOUBLE PRECISION
+);
+
+CREATE INDEX ON "grafana_ml_model_moments_comoment" ("id_moments");
 
 ALTER TABLE "grafana_ml_model_feature" ADD FOREIGN KEY ("index") REFERENCES "grafana_ml_model_index" ("id");
 
@@ -106,6 +184,10 @@ ALTER TABLE "grafana_ml_model_correlation" ADD FOREIGN KEY ("index") REFERENCES
 
 ALTER TABLE "grafana_ml_model_regression" ADD FOREIGN KEY ("index") REFERENCES "grafana_ml_model_index" ("id");
 
+ALTER TABLE "grafana_ml_model_regression_point" ADD FOREIGN KEY ("index") REFERENCES "grafana_ml_model_index" ("id");
+
+ALTER TABLE "grafana_ml_model_regression_point" ADD FOREIGN KEY ("id_point") REFERENCES "grafana_ml_model_point" ("id");
+
 ALTER TABLE "grafana_ml_model_point_kmeans" ADD FOREIGN KEY ("index") REFERENCES "grafana_ml_model_index" ("id");
 
 ALTER TABLE "grafana_ml_model_point_kmedoids" ADD FOREIGN KEY ("index") REFERENCES "grafana_ml_model_index" ("id");
@@ -116,12 +198,24 @@ ALTER TABLE "grafana_ml_model_cluster" ADD FOREIGN KEY ("index") REFERENCES "gra
 
 ALTER TABLE "grafana_ml_model_metrics_clustering" ADD FOREIGN KEY ("index") REFERENCES "grafana_ml_model_index" ("id");
 
+ALTER TABLE "grafana_ml_model_clustering_sweep" ADD FOREIGN KEY ("index") REFERENCES "grafana_ml_model_index" ("id");
+
+ALTER TABLE "grafana_ml_model_hierarchical_cut" ADD FOREIGN KEY ("index") REFERENCES "grafana_ml_model_index" ("id");
+
+ALTER TABLE "grafana_ml_model_hierarchical_cut" ADD FOREIGN KEY ("id_point") REFERENCES "grafana_ml_model_point" ("id");
+
+ALTER TABLE "grafana_ml_model_dendrogram" ADD FOREIGN KEY ("index") REFERENCES "grafana_ml_model_index" ("id");
+
+ALTER TABLE "grafana_ml_model_dendrogram" ADD FOREIGN KEY ("id_node") REFERENCES "grafana_ml_model_hierarchical_clustering" ("id");
+
 ALTER TABLE "grafana_ml_model_hierarchical_clustering" ADD FOREIGN KEY ("index") REFERENCES "grafana_ml_model_index" ("id");
 
 
 
 ALTER TABLE "grafana_ml_model_regression" ADD FOREIGN KEY ("id_feature") REFERENCES "grafana_ml_model_feature" ("id");
 
+ALTER TABLE "grafana_ml_model_regression" ADD FOREIGN KEY ("id_target") REFERENCES "grafana_ml_model_feature" ("id");
+
 ALTER TABLE "grafana_ml_model_correlation" ADD FOREIGN KEY ("id_feature1") REFERENCES "grafana_ml_model_feature" ("id");
 
 ALTER TABLE "grafana_ml_model_correlation" ADD FOREIGN KEY ("id_feature2") REFERENCES "grafana_ml_model_feature" ("id");
@@ -146,5 +240,14 @@ ALTER TABLE "grafana_ml_model_centroid" ADD FOREIGN KEY ("id_cluster") REFERENCE
 
 ALTER TABLE "grafana_ml_model_centroid" ADD FOREIGN KEY ("id_feature") REFERENCES "grafana_ml_model_feature" ("id");
 
+ALTER TABLE "grafana_ml_model_moments" ADD FOREIGN KEY ("index") REFERENCES "grafana_ml_model_index" ("id");
+
+ALTER TABLE "grafana_ml_model_moments_mean" ADD FOREIGN KEY ("id_moments") REFERENCES "grafana_ml_model_moments" ("id");
+
+ALTER TABLE "grafana_ml_model_moments_mean" ADD FOREIGN KEY ("id_feature") REFERENCES "grafana_ml_model_feature" ("id");
+
+ALTER TABLE "grafana_ml_model_moments_comoment" ADD FOREIGN KEY ("id_moments") REFERENCES "grafana_ml_model_moments" ("id");
 
+ALTER TABLE "grafana_ml_model_moments_comoment" ADD FOREIGN KEY ("id_feature1") REFERENCES "grafana_ml_model_feature" ("id");
 
+ALTER TABLE "grafana_ml_model_moments_comoment" ADD FOREIGN KEY ("id_feature2") REFERENCES "grafana_ml_model_feature" ("id");
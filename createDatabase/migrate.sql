@@ -0,0 +1,86 @@
+-- Actualiza una base de datos ya existente (por ejemplo, la restaurada desde
+-- backupDatabase/grafana_ml_model_db) al esquema de create_database.sql.
+-- Se puede ejecutar varias veces: solo añade lo que falta.
+
+ALTER TABLE "grafana_ml_model_metrics_clustering" ADD COLUMN IF NOT EXISTS "silhouette_ci_lower" DOUBLE PRECISION;
+
+ALTER TABLE "grafana_ml_model_metrics_clustering" ADD COLUMN IF NOT EXISTS "silhouette_ci_upper" DOUBLE PRECISION;
+
+ALTER TABLE "grafana_ml_model_metrics_clustering" ADD COLUMN IF NOT EXISTS "silhouette_sample_size" INTEGER;
+
+ALTER TABLE "grafana_ml_model_correlation" ADD COLUMN IF NOT EXISTS "p_value" DOUBLE PRECISION;
+
+CREATE TABLE IF NOT EXISTS "grafana_ml_model_clustering_sweep" (
+  "index" INTEGER REFERENCES "grafana_ml_model_index" ("id"),
+  "id" SERIAL PRIMARY KEY,
+  "type" TEXT,
+  "k" INTEGER,
+  "inertia" DOUBLE PRECISION,
+  "silhoutte_coefficient" DOUBLE PRECISION,
+  "davies_bouldin_index" DOUBLE PRECISION
+);
+
+CREATE TABLE IF NOT EXISTS "grafana_ml_model_hierarchical_cut" (
+  "index" INTEGER REFERENCES "grafana_ml_model_index" ("id"),
+  "k" INTEGER,
+  "id_point" INTEGER REFERENCES "grafana_ml_model_point" ("id"),
+  "number_cluster" INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS "grafana_ml_model_hierarchical_cut_index_k_idx" ON "grafana_ml_model_hierarchical_cut" ("index", "k");
+
+CREATE TABLE IF NOT EXISTS "grafana_ml_model_dendrogram" (
+  "index" INTEGER REFERENCES "grafana_ml_model_index" ("id"),
+  "id" SERIAL PRIMARY KEY,
+  "truncate_level" INTEGER,
+  "id_node" INTEGER REFERENCES "grafana_ml_model_hierarchical_clustering" ("id"),
+  "x" DOUBLE PRECISION,
+  "height" DOUBLE PRECISION,
+  "x_left" DOUBLE PRECISION,
+  "x_right" DOUBLE PRECISION,
+  "height_left" DOUBLE PRECISION,
+  "height_right" DOUBLE PRECISION,
+  "leaf_order" INTEGER,
+  "count" INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS "grafana_ml_model_dendrogram_index_truncate_level_idx" ON "grafana_ml_model_dendrogram" ("index", "truncate_level");
+
+CREATE TABLE IF NOT EXISTS "grafana_ml_model_moments" (
+  "index" INTEGER REFERENCES "grafana_ml_model_index" ("id"),
+  "id" SERIAL PRIMARY KEY,
+  "type" TEXT,
+  "n" BIGINT,
+  "last_id_point" INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS "grafana_ml_model_moments_mean" (
+  "id_moments" INTEGER REFERENCES "grafana_ml_model_moments" ("id"),
+  "id_feature" INTEGER REFERENCES "grafana_ml_model_feature" ("id"),
+  "value" DOUBLE PRECISION
+);
+
+CREATE INDEX IF NOT EXISTS "grafana_ml_model_moments_mean_id_moments_idx" ON "grafana_ml_model_moments_mean" ("id_moments");
+
+CREATE TABLE IF NOT EXISTS "grafana_ml_model_moments_comoment" (
+  "id_moments" INTEGER REFERENCES "grafana_ml_model_moments" ("id"),
+  "id_feature1" INTEGER REFERENCES "grafana_ml_model_feature" ("id"),
+  "id_feature2" INTEGER REFERENCES "grafana_ml_model_feature" ("id"),
+  "value" DOUBLE PRECISION
+);
+
+CREATE INDEX IF NOT EXISTS "grafana_ml_model_moments_comoment_id_moments_idx" ON "grafana_ml_model_moments_comoment" ("id_moments");
+
+ALTER TABLE "grafana_ml_model_regression" ADD COLUMN IF NOT EXISTS "id_target" INTEGER REFERENCES "grafana_ml_model_feature" ("id");
+
+CREATE TABLE IF NOT EXISTS "grafana_ml_model_regression_point" (
+  "index" INTEGER REFERENCES "grafana_ml_model_index" ("id"),
+  "type" TEXT,
+  "id_point" INTEGER REFERENCES "grafana_ml_model_point" ("id"),
+  "target" DOUBLE PRECISION,
+  "fitted" DOUBLE PRECISION,
+  "residual" DOUBLE PRECISION,
+  "is_sample" BOOLEAN
+);
+
+CREATE INDEX IF NOT EXISTS "grafana_ml_model_regression_point_index_type_idx" ON "grafana_ml_model_regression_point" ("index", "type");
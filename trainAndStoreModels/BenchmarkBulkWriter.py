@@ -0,0 +1,86 @@
+import time
+import numpy as np
+import psycopg2
+from BulkWriter import write_rows
+
+# Benchmark de escritura de resultados: un INSERT por fila (método anterior) frente a
+# execute_values por lotes y COPY ... FROM STDIN. Escribe en una tabla temporal con la misma
+# estructura que grafana_ml_model_point_kmeans, así que no modifica los datos existentes.
+
+
+# Función para conectar a la base de datos
+def connect_to_db(dbname, user='postgres', password='postgres', host='localhost', port='5432'):
+    try:
+        conn = psycopg2.connect(
+            dbname=dbname,
+            user=user,
+            password=password,
+            host=host,
+            port=port
+        )
+        conn.autocommit = True
+        return conn
+    except Exception as e:
+        print(f"Ocurrió un error: {e}")
+        return None
+
+
+# Función para crear (o vaciar) la tabla temporal del benchmark
+def create_benchmark_table(conn):
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS benchmark_point_kmeans (
+            "index" INTEGER,
+            "id" SERIAL PRIMARY KEY,
+            "id_point" INTEGER,
+            "id_cluster" INTEGER
+        )
+    """)
+    cur.execute("TRUNCATE benchmark_point_kmeans")
+    cur.close()
+
+
+# Método anterior: un INSERT por fila
+def insert_row_by_row(conn, rows):
+    cur = conn.cursor()
+    for row in rows:
+        cur.execute("""
+            INSERT INTO benchmark_point_kmeans (index, id_point, id_cluster)
+            VALUES (%s, %s, %s)
+        """, row)
+    conn.commit()
+    cur.close()
+
+
+# Función para medir las filas por segundo de un método de escritura
+def rows_per_second(conn, function, rows):
+    create_benchmark_table(conn)
+    start = time.perf_counter()
+    function(rows)
+    elapsed = time.perf_counter() - start
+    return len(rows) / elapsed
+
+
+if __name__ == "__main__":
+    conn = connect_to_db('grafana_ml_model')
+    columns = ('index', 'id_point', 'id_cluster')
+
+    rng = np.random.default_rng(42)
+    num_rows = 200000
+    rows = list(zip([1] * num_rows, range(1, num_rows + 1), rng.integers(1, 4, num_rows).tolist()))
+    row_by_row_rows = rows[:20000]  # El método anterior es demasiado lento para el tamaño completo
+
+    results = [
+        ('INSERT por fila', rows_per_second(conn, lambda r: insert_row_by_row(conn, r), row_by_row_rows)),
+        ('execute_values', rows_per_second(
+            conn, lambda r: write_rows(conn, 'benchmark_point_kmeans', columns, r, method='values'), rows)),
+        ('COPY FROM STDIN', rows_per_second(
+            conn, lambda r: write_rows(conn, 'benchmark_point_kmeans', columns, r, method='copy'), rows)),
+    ]
+
+    baseline = results[0][1]
+    print(f"{'método':<18} {'filas/s':>12} {'mejora':>8}")
+    for name, speed in results:
+        print(f"{name:<18} {speed:>12,.0f} {speed / baseline:>7.1f}x")
+
+    conn.close()
@@ -0,0 +1,63 @@
+import time
+import numpy as np
+from DataLoader import pivot_point_values
+
+# Benchmark del pivotado EAV -> matriz densa de DataLoader.
+# No necesita base de datos: genera filas (id_point, id_feature, value) sintéticas y
+# mide el tiempo de pivotado para distintos tamaños. Si el tiempo por valor se mantiene
+# constante al crecer el número de puntos, la carga escala linealmente.
+
+
+# Función para generar los valores sintéticos de un índice en orden aleatorio
+def generate_point_values(num_points, num_features, seed=42):
+    rng = np.random.default_rng(seed)
+    point_ids = np.arange(1, num_points + 1, dtype=np.int64) * 3  # Ids no consecutivos
+    feature_ids = np.arange(1, num_features + 1, dtype=np.int64) + 1000
+
+    id_points = np.repeat(point_ids, num_features)
+    id_features = np.tile(feature_ids, num_points)
+    values = rng.random(num_points * num_features)
+
+    order = rng.permutation(len(values))  # La base de datos no garantiza ningún orden
+    return id_points[order], id_features[order], values[order]
+
+
+# Función con el algoritmo anterior (búsqueda lineal del punto para cada valor)
+def legacy_pivot(points, values):
+    data = np.zeros((len(points), len(set([v[1] for v in values]))))
+    for v in values:
+        point_index = next(i for i, point in enumerate(points) if point[0] == v[0])
+        feature_index = v[1] - values[0][1]
+        data[point_index, feature_index] = v[2]
+    return data
+
+
+# Función para medir el mejor tiempo de varias repeticiones
+def best_time(function, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == "__main__":
+    num_features = 50
+    sizes = [25000, 50000, 100000, 200000]
+
+    print(f"{'puntos':>10} {'valores':>12} {'tiempo (s)':>12} {'ns/valor':>10}")
+    for num_points in sizes:
+        id_points, id_features, values = generate_point_values(num_points, num_features)
+        elapsed = best_time(lambda: pivot_point_values(id_points, id_features, values))
+        print(f"{num_points:>10} {len(values):>12} {elapsed:>12.3f} {elapsed / len(values) * 1e9:>10.1f}")
+
+    # Comparación con el algoritmo anterior en un tamaño pequeño
+    num_points = 2000
+    id_points, id_features, values = generate_point_values(num_points, num_features)
+    points = [(int(point_id),) for point_id in np.unique(id_points)]
+    rows = [(int(p), int(f), float(v)) for p, f, v in zip(id_points, id_features, values)]
+    legacy = best_time(lambda: legacy_pivot(points, rows), repeat=1)
+    vectorized = best_time(lambda: pivot_point_values(id_points, id_features, values))
+    print(f"\n{num_points} puntos x {num_features} características: "
+          f"anterior {legacy:.3f} s, vectorizado {vectorized:.4f} s ({legacy / vectorized:.0f}x)")
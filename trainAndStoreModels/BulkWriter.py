@@ -0,0 +1,192 @@
+import math
+import os
+import numpy as np
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+# Módulo compartido para escribir resultados en bloque.
+# En lugar de un INSERT por fila, las filas se envían en streaming con COPY ... FROM STDIN
+# (método 'copy') o en lotes de INSERT ... VALUES con execute_values (método 'values').
+# El método por defecto se puede cambiar con la variable de entorno GRAFANA_ML_MODEL_WRITE_METHOD.
+
+DEFAULT_WRITE_METHOD = os.environ.get('GRAFANA_ML_MODEL_WRITE_METHOD', 'copy')
+
+
+# Función para formatear un valor en el formato de texto de COPY
+def format_copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, (bool, np.bool_)):
+        return 't' if value else 'f'
+    if isinstance(value, (int, np.integer)):
+        return str(int(value))
+    if isinstance(value, (float, np.floating)):
+        value = float(value)
+        if math.isnan(value):
+            return 'NaN'
+        if math.isinf(value):
+            return 'Infinity' if value > 0 else '-Infinity'
+        return repr(value)
+    # Texto: escapar los caracteres especiales de COPY
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+# Objeto tipo fichero que genera el contenido de COPY a partir de un iterable de filas.
+# copy_expert lo lee por trozos, así que nunca se construye el texto completo en memoria.
+class CopyRowStream:
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = b''
+        self.count = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = 1 << 20
+        lines = [self.buffer]
+        length = len(self.buffer)
+        while length < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            line = ('\t'.join([format_copy_value(value) for value in row]) + '\n').encode()
+            lines.append(line)
+            length += len(line)
+            self.count += 1
+        data = b''.join(lines)
+        self.buffer = data[size:]
+        return data[:size]
+
+
+# Función para escribir filas con COPY ... FROM STDIN. Devuelve el número de filas escritas.
+def copy_rows(conn, table, columns, rows):
+    cur = conn.cursor()
+    query = sql.SQL("COPY {} ({}) FROM STDIN").format(
+        sql.Identifier(table), sql.SQL(', ').join(map(sql.Identifier, columns)))
+    stream = CopyRowStream(rows)
+    cur.copy_expert(query.as_string(conn), stream, size=1 << 20)
+    cur.close()
+    return stream.count
+
+
+# Formato binario de COPY: tipos de PostgreSQL admitidos y su representación big-endian
+COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+BINARY_TYPES = {
+    'int4': np.dtype('>i4'),
+    'int8': np.dtype('>i8'),
+    'float8': np.dtype('>f8'),
+    'bool': np.dtype('?'),
+}
+
+
+# Función para deducir el tipo de PostgreSQL de un array (INTEGER, DOUBLE PRECISION, BOOLEAN o TEXT)
+def binary_type(array):
+    if array.dtype == np.bool_:
+        return 'bool'
+    if array.dtype.kind in 'SU':
+        return 'text'
+    if np.issubdtype(array.dtype, np.integer):
+        return 'int4'
+    return 'float8'
+
+
+# Objeto tipo fichero que genera COPY en formato binario a partir de columnas de NumPy.
+# Cada bloque de chunk_rows filas se codifica de una vez con un dtype estructurado,
+# sin pasar por objetos de Python por valor. No admite valores NULL. Las columnas de texto deben
+# ser arrays de bytes de la misma longitud (por ejemplo, una columna constante como el tipo).
+class BinaryCopyStream:
+    def __init__(self, arrays, types, chunk_rows=65536):
+        self.arrays = arrays
+        self.num_rows = len(arrays[0]) if arrays else 0
+        fields = [('num_fields', '>i2')]
+        for i, pg_type in enumerate(types):
+            value_type = arrays[i].dtype if pg_type == 'text' else BINARY_TYPES[pg_type]
+            fields += [(f'len_{i}', '>i4'), (f'value_{i}', value_type)]
+        self.row_dtype = np.dtype(fields)
+        self.chunk_rows = chunk_rows
+        self.position = 0
+        self.buffer = COPY_SIGNATURE + b'\x00\x00\x00\x00' + b'\x00\x00\x00\x00'
+        self.finished = False
+
+    def encode_chunk(self):
+        end = min(self.position + self.chunk_rows, self.num_rows)
+        rows = np.empty(end - self.position, dtype=self.row_dtype)
+        rows['num_fields'] = len(self.arrays)
+        for i, array in enumerate(self.arrays):
+            rows[f'len_{i}'] = self.row_dtype[f'value_{i}'].itemsize
+            rows[f'value_{i}'] = array[self.position:end]
+        self.position = end
+        return rows.tobytes()
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = 1 << 20
+        while len(self.buffer) < size and not self.finished:
+            if self.position < self.num_rows:
+                self.buffer += self.encode_chunk()
+            else:
+                self.buffer += b'\xff\xff'  # Terminador
+                self.finished = True
+        data = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return data
+
+
+# Función para escribir columnas de NumPy con COPY binario (la vía más rápida para datos
+# numéricos). Si no se indican los tipos se deducen de cada array. Devuelve las filas escritas.
+def copy_arrays(conn, table, columns, arrays, types=None, chunk_rows=65536):
+    arrays = [np.asarray(array) for array in arrays]
+    if types is None:
+        types = [binary_type(array) for array in arrays]
+    for i, pg_type in enumerate(types):
+        if pg_type == 'text':
+            arrays[i] = np.char.encode(arrays[i].astype(str), 'utf-8')
+            if np.any(np.char.str_len(arrays[i]) != arrays[i].dtype.itemsize):
+                raise ValueError(f"Los textos de la columna {columns[i]} deben tener la misma longitud")
+    cur = conn.cursor()
+    query = sql.SQL("COPY {} ({}) FROM STDIN (FORMAT binary)").format(
+        sql.Identifier(table), sql.SQL(', ').join(map(sql.Identifier, columns)))
+    stream = BinaryCopyStream(arrays, types, chunk_rows)
+    cur.copy_expert(query.as_string(conn), stream, size=1 << 20)
+    cur.close()
+    return stream.num_rows
+
+
+# Función para escribir filas en lotes de INSERT ... VALUES (alternativa a COPY, por ejemplo
+# con poolers de conexiones que no admiten COPY). Devuelve el número de filas escritas.
+def insert_rows_values(conn, table, columns, rows, page_size=10000):
+    cur = conn.cursor()
+    query = sql.SQL("INSERT INTO {} ({}) VALUES %s").format(
+        sql.Identifier(table), sql.SQL(', ').join(map(sql.Identifier, columns)))
+    count = 0
+
+    # Se convierten las filas a medida que execute_values las consume, lote a lote
+    def python_rows():
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield tuple(to_python(value) for value in row)
+
+    execute_values(cur, query.as_string(conn), python_rows(), page_size=page_size)
+    cur.close()
+    return count
+
+
+# Función para convertir escalares de NumPy a tipos de Python que psycopg2 sabe adaptar
+def to_python(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+# Función principal para escribir filas en bloque en una tabla de resultados
+def write_rows(conn, table, columns, rows, method=None, page_size=10000):
+    method = method or DEFAULT_WRITE_METHOD
+    if method == 'copy':
+        count = copy_rows(conn, table, columns, rows)
+    elif method == 'values':
+        count = insert_rows_values(conn, table, columns, rows, page_size)
+    else:
+        raise ValueError(f"Método de escritura desconocido: {method}")
+    conn.commit()
+    return count
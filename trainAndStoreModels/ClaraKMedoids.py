@@ -0,0 +1,71 @@
+import numpy as np
+from sklearn.metrics import pairwise_distances_argmin_min
+from sklearn_extra.cluster import KMedoids
+from SharedMatrix import map_shared, get_worker_matrix
+
+# K-Medoids para índices grandes con CLARA (Clustering LARge Applications).
+# KMedoids de sklearn_extra necesita la matriz de distancias n x n completa. CLARA resuelve PAM
+# sobre varias submuestras de sample_size puntos (en paralelo, con la matriz en memoria
+# compartida) y evalúa los medoides de cada submuestra sobre todos los puntos; las distancias
+# punto-medoide se calculan por bloques con pairwise_distances_argmin_min, así que la memoria
+# es O(n x k). Se quedan los medoides con menor coste total.
+
+
+# Función para resolver una submuestra: PAM sobre sample_size puntos elegidos con la semilla seed
+# y coste de los medoides resultantes sobre todos los puntos de data.
+def clara_subsample(data, task):
+    seed, k, sample_size, metric = task
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(len(data), min(sample_size, len(data)), replace=False))
+
+    model = KMedoids(n_clusters=k, metric=metric, method='pam', init='k-medoids++', random_state=seed)
+    model.fit(data[sample])
+    medoid_indices = sample[model.medoid_indices_]
+
+    labels, distances = pairwise_distances_argmin_min(data, data[medoid_indices], metric=metric)
+    return medoid_indices, labels, float(distances.sum())
+
+
+# Tarea del pool de SharedMatrix: resolver una submuestra sobre la matriz compartida
+def clara_subsample_task(task):
+    return clara_subsample(get_worker_matrix(), task)
+
+
+# K-Medoids con CLARA y la misma interfaz que KMedoids (medoid_indices_, labels_, inertia_).
+# n_samples submuestras de sample_size puntos (por defecto, 40 + 2k como propone CLARA, con un
+# mínimo de 1000); processes procesos con threads hilos de BLAS/OpenMP cada uno.
+class ClaraKMedoids:
+    def __init__(self, n_clusters=8, n_samples=5, sample_size=None, metric='euclidean', random_state=42,
+                 processes=None, threads=1):
+        self.n_clusters = n_clusters
+        self.n_samples = n_samples
+        self.sample_size = sample_size
+        self.metric = metric
+        self.random_state = random_state
+        self.processes = processes
+        self.threads = threads
+
+    def fit(self, data):
+        sample_size = self.sample_size or max(40 + 2 * self.n_clusters, 1000)
+        seeds = np.random.default_rng(self.random_state).integers(0, 2 ** 31 - 1, self.n_samples)
+        tasks = [(int(seed), self.n_clusters, sample_size, self.metric) for seed in seeds]
+
+        # Con un solo proceso (o una sola submuestra) no hace falta el pool
+        if self.processes == 1 or len(tasks) == 1:
+            results = [clara_subsample(data, task) for task in tasks]
+        else:
+            results = map_shared(data, clara_subsample_task, tasks, self.processes, self.threads)
+
+        medoid_indices, labels, inertia = min(results, key=lambda result: result[2])
+        self.medoid_indices_ = medoid_indices
+        self.cluster_centers_ = np.asarray(data)[medoid_indices]
+        self.labels_ = labels
+        self.inertia_ = inertia
+        return self
+
+    def fit_predict(self, data):
+        return self.fit(data).labels_
+
+    def predict(self, data):
+        labels, _ = pairwise_distances_argmin_min(data, self.cluster_centers_, metric=self.metric)
+        return labels
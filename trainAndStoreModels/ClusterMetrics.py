@@ -0,0 +1,179 @@
+import numpy as np
+from scipy.stats import norm
+from sklearn.metrics import silhouette_samples, pairwise_distances_chunked
+
+# Métricas de agrupamiento por clúster y globales calculadas en una sola pasada.
+# La silueta de cada punto se obtiene una única vez con silhouette_samples, que recorre las
+# distancias entre puntos por bloques (pairwise_distances_chunked) sin construir la matriz n x n.
+# La silueta de cada clúster y la global son medias de esos valores. La inercia y Davies-Bouldin
+# solo necesitan la distancia de cada punto a su centro.
+#
+# Para índices grandes la silueta se puede estimar con una muestra estratificada por clúster
+# (modo 'sampled'): la silueta de cada punto de la muestra se calcula contra todos los puntos,
+# por bloques, y se devuelve un intervalo de confianza de la media. El modo 'auto' usa el cálculo
+# exacto si el índice no supera el tamaño de muestra.
+
+METRICS_MODES = ('exact', 'sampled', 'auto')
+
+
+# Función para calcular la media de los puntos de cada clúster (centroides de Davies-Bouldin)
+def cluster_means(data, labels, k):
+    counts = np.bincount(labels, minlength=k)
+    sums = np.stack([np.bincount(labels, weights=data[:, j], minlength=k) for j in range(data.shape[1])], axis=1)
+    return sums / np.maximum(counts, 1)[:, None]
+
+
+# Función para calcular la silueta media de cada clúster y la global a partir de la de cada punto.
+# Devuelve NaN si la silueta no está definida (menos de 2 clústeres o uno por punto).
+def silhouette_per_cluster(data, labels, k, metric='euclidean'):
+    counts = np.bincount(labels, minlength=k)
+    num_labels = np.count_nonzero(counts)
+    if num_labels < 2 or num_labels > len(labels) - 1:
+        return np.full(k, np.nan), float('nan')
+
+    samples = silhouette_samples(data, labels, metric=metric)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        per_cluster = np.bincount(labels, weights=samples, minlength=k) / counts
+    return per_cluster, float(samples.mean())
+
+
+# Función para elegir una muestra estratificada: de cada clúster se toma una parte proporcional
+# a su tamaño (al menos un punto). Devuelve las posiciones de la muestra ordenadas.
+def stratified_sample(labels, k, sample_size, random_state=42):
+    rng = np.random.default_rng(random_state)
+    counts = np.bincount(labels, minlength=k)
+    sizes = np.minimum(counts, np.maximum(np.round(counts * sample_size / len(labels)).astype(np.int64), 1))
+    order = np.argsort(labels, kind='stable')
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    sample = [rng.choice(order[starts[i]:starts[i] + counts[i]], sizes[i], replace=False)
+              for i in range(k) if counts[i] > 0]
+    return np.sort(np.concatenate(sample))
+
+
+# Función para calcular la silueta de algunos puntos (positions) contra todos los puntos.
+# Las distancias se calculan por bloques de filas de la muestra y se reducen enseguida a la suma
+# de distancias a cada clúster, así que la memoria no depende de n x tamaño de muestra.
+def silhouette_of_points(data, labels, k, positions, metric='euclidean', working_memory=None):
+    counts = np.bincount(labels, minlength=k)
+    one_hot = np.zeros((len(labels), k))
+    one_hot[np.arange(len(labels)), labels] = 1.0
+
+    sums = [chunk for chunk in pairwise_distances_chunked(
+        data[positions], data, reduce_func=lambda D, start: D @ one_hot,
+        metric=metric, working_memory=working_memory)]
+    sums = np.vstack(sums)
+
+    own = labels[positions]
+    own_counts = counts[own]
+    rows = np.arange(len(positions))
+    a = sums[rows, own] / np.maximum(own_counts - 1, 1)  # Distancia media al propio clúster (sin el punto)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = sums / counts
+    means[rows, own] = np.inf
+    means[:, counts == 0] = np.inf
+    b = means.min(axis=1)  # Distancia media al clúster vecino más cercano
+    with np.errstate(divide='ignore', invalid='ignore'):
+        samples = np.nan_to_num((b - a) / np.maximum(a, b))
+    samples[own_counts == 1] = 0.0  # Misma convención que scikit-learn para clústeres de un punto
+    return samples
+
+
+# Función para estimar la silueta con una muestra estratificada. Devuelve la silueta estimada
+# de cada clúster, la global y su intervalo de confianza (estimador estratificado de la media).
+def sampled_silhouette(data, labels, k, sample_size, metric='euclidean', confidence=0.95, random_state=42):
+    positions = stratified_sample(labels, k, sample_size, random_state)
+    samples = silhouette_of_points(data, labels, k, positions, metric)
+
+    sample_labels = labels[positions]
+    counts = np.bincount(labels, minlength=k)
+    sample_counts = np.bincount(sample_labels, minlength=k)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        per_cluster = np.bincount(sample_labels, weights=samples, minlength=k) / sample_counts
+        squares = np.bincount(sample_labels, weights=samples ** 2, minlength=k)
+        variance = (squares - sample_counts * per_cluster ** 2) / (sample_counts - 1)
+
+    # Media estratificada y su varianza con corrección por población finita
+    present = sample_counts > 0
+    weights = counts[present] / len(labels)
+    estimate = float(np.sum(weights * per_cluster[present]))
+    finite = 1 - sample_counts[present] / counts[present]
+    strata_variance = np.nan_to_num(variance[present]) * finite / sample_counts[present]
+    margin = norm.ppf(0.5 + confidence / 2) * np.sqrt(np.sum(weights ** 2 * strata_variance))
+    return per_cluster, estimate, (estimate - margin, estimate + margin), len(positions)
+
+
+# Función para estimar la silueta a partir de una submuestra aleatoria de los puntos (distancias
+# solo entre los puntos de la submuestra), con un intervalo de confianza normal de la media.
+def subsample_silhouette(sample, labels, k, metric='euclidean', confidence=0.95):
+    labels = np.asarray(labels, dtype=np.int64)
+    num_labels = np.count_nonzero(np.bincount(labels, minlength=k))
+    if num_labels < 2 or num_labels > len(labels) - 1:
+        return np.full(k, np.nan), None, (None, None)
+
+    samples = silhouette_samples(sample, labels, metric=metric)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        per_cluster = np.bincount(labels, weights=samples, minlength=k) / np.bincount(labels, minlength=k)
+    estimate = float(samples.mean())
+    margin = norm.ppf(0.5 + confidence / 2) * float(samples.std(ddof=1)) / np.sqrt(len(samples))
+    return per_cluster, estimate, (estimate - margin, estimate + margin)
+
+
+# Calcular el índice de Davies-Bouldin de cada clúster a partir de la dispersión media y los centroides.
+# La media de estos valores es el índice global (como davies_bouldin_score).
+# Devuelve NaN si hay menos de 2 clústeres (scatter y centers son solo los clústeres no vacíos),
+# igual que silhouette_per_cluster.
+def davies_bouldin_per_cluster(scatter, centers):
+    if len(centers) < 2:
+        return np.full(len(centers), np.nan)
+    separation = np.linalg.norm(centers[:, None, :] - centers[None, :, :], axis=2)
+    separation[separation == 0] = np.inf  # Centroides coincidentes: misma convención que scikit-learn
+    ratios = (scatter[:, None] + scatter[None, :]) / separation
+    np.fill_diagonal(ratios, -np.inf)
+    return np.max(ratios, axis=1)
+
+
+# Función principal: calcula la inercia, la silueta y Davies-Bouldin de cada clúster y globales.
+# centers son los centros del modelo (centroides de K-Means o medoides de K-Medoids); la inercia
+# es la suma de distancias al cuadrado (squared=True, K-Means) o sin elevar (K-Medoids).
+# mode elige el cálculo de la silueta: 'exact', 'sampled' (muestra de sample_size puntos) o 'auto'.
+# Devuelve dos diccionarios: métricas por clúster (arrays de longitud k) y métricas globales.
+def clustering_metrics(data, labels, centers, squared=True, metric='euclidean', mode='exact', sample_size=10000):
+    if mode not in METRICS_MODES:
+        raise ValueError(f"Modo de métricas desconocido: {mode}")
+    data = np.asarray(data, dtype=np.float64)
+    labels = np.asarray(labels, dtype=np.int64)
+    k = len(centers)
+
+    # Inercia: distancia de cada punto al centro de su clúster
+    distances = np.linalg.norm(data - np.asarray(centers)[labels], axis=1)
+    inertia = np.bincount(labels, weights=distances ** 2 if squared else distances, minlength=k)
+
+    # Davies-Bouldin: dispersión media de cada clúster respecto a su media
+    means = cluster_means(data, labels, k)
+    counts = np.bincount(labels, minlength=k)
+    mean_distances = np.linalg.norm(data - means[labels], axis=1)
+    scatter = np.bincount(labels, weights=mean_distances, minlength=k) / np.maximum(counts, 1)
+    present = counts > 0
+    davies_bouldin = np.full(k, np.nan)
+    davies_bouldin[present] = davies_bouldin_per_cluster(scatter[present], means[present])
+
+    # Silueta exacta (el intervalo de confianza es el propio valor) o estimada con una muestra
+    if mode == 'auto':
+        mode = 'exact' if len(labels) <= sample_size else 'sampled'
+    num_labels = np.count_nonzero(present)
+    if mode == 'sampled' and 2 <= num_labels <= len(labels) - 1:
+        silhouette, global_silhouette, interval, num_sampled = sampled_silhouette(
+            data, labels, k, sample_size, metric)
+    else:
+        silhouette, global_silhouette = silhouette_per_cluster(data, labels, k, metric)
+        interval, num_sampled = (global_silhouette, global_silhouette), len(labels)
+
+    per_cluster = {'inertia': inertia, 'silhouette': silhouette, 'davies_bouldin': davies_bouldin}
+    overall = {
+        'inertia': float(inertia.sum()),
+        'silhouette': global_silhouette,
+        'silhouette_ci': (float(interval[0]), float(interval[1])),
+        'silhouette_sample_size': int(num_sampled),
+        'davies_bouldin': float(np.mean(davies_bouldin[present])),
+    }
+    return per_cluster, overall
@@ -1,7 +1,11 @@
 import numpy as np
 import psycopg2
-from scipy.cluster.hierarchy import linkage, fcluster, dendrogram
-import matplotlib.pyplot as plt
+from DataLoader import load_index_matrix, load_points, load_features
+from MatrixCache import load_index_matrix_cached
+from DatasetIngest import reserve_ids
+from BulkWriter import write_rows, copy_arrays
+from MicroClusters import micro_cluster_linkage
+from scipy.cluster.hierarchy import linkage, fcluster, dendrogram, is_monotonic, leaves_list
 from psycopg2 import sql
 
 # Función para conectar a la base de datos
@@ -22,125 +26,273 @@ def connect_to_db(dbname, user='postgres', password='postgres', host='localhost'
 
 
 # Función para cargar los datos de la base de datos
-def load_data_from_db(conn, index):
-    cur = conn.cursor()
+def load_data_from_db(conn, index, method='fetch', cache=False):
+    # Cargar los puntos y las características ordenados por id
+    points = load_points(conn, index)
+    features = load_features(conn, index)
+    feature_names = [feature[1] for feature in features]
 
-    # Cargar las características de los puntos (iris)
-    cur.execute("""
-        SELECT id, name
-        FROM grafana_ml_model_point
-        WHERE index = %s
-    """, (index,))
-    points = cur.fetchall()  # Los IDs y nombres de los puntos
-
-    # Cargar los valores de las características de los puntos
-    cur.execute("""
-        SELECT id_point, id_feature, value
-        FROM grafana_ml_model_point_value
-        WHERE index = %s
-    """, (index,))
-    values = cur.fetchall()  # Los valores de características (id_point, id_feature, value)
-
-    # Organizar los datos en un formato adecuado
-    num_points = len(points)
-    num_features = len(set([v[1] for v in values]))
-    data = np.zeros((num_points, num_features))  # Matriz de datos de características
-
-    # Mapear el ID de los puntos a índices en la matriz de datos
-    point_id_to_index = {point[0]: i for i, point in enumerate(points)}  # Crear un mapeo de IDs reales a índices
-
-    # Llenar la matriz de datos con los valores
-    for v in values:
-        point_index = point_id_to_index.get(v[0])  # Mapear el ID real al índice
-        feature_index = v[1] - values[0][1]  # Índice de las características
-        if feature_index >= 0 and feature_index < data.shape[1]:
-            data[point_index, feature_index] = v[2]  # Asignar el valor al lugar adecuado
-
-    # Cargar los nombres de las características
-    cur.execute("""
-        SELECT name
-        FROM grafana_ml_model_feature
-        WHERE index = %s
-    """, (index,))
-    feature_names = [row[0] for row in cur.fetchall()]
+    # Cargar la matriz de datos (filas en el orden de los puntos, columnas en el de las características)
+    load_matrix = load_index_matrix_cached if cache else load_index_matrix  # Caché local opcional
+    data, point_ids, feature_ids = load_matrix(conn, index, points=points, features=features, method=method)
 
-    cur.close()
     return data, feature_names, points, [point[0] for point in points]  # Devuelve también los IDs originales
 
 
-# Insertar los puntos iniciales en la base de datos
-def insert_point_data(conn, data, index, original_ids):
+# Construir las filas del árbol jerárquico a partir de la matriz de enlace Z.
+# Los nodos 0..n-1 son las hojas (los puntos) y el nodo n+i es la fusión de la fila i de Z,
+# así que los ids y el padre de cada nodo se calculan aquí sin consultar la base de datos.
+def build_tree_rows(Z, index, original_ids, node_ids):
+    n = len(original_ids)
+    num_nodes = 2 * n - 1
+
+    # El padre de los dos nodos fusionados en la fila i es el nodo n+i (la raíz no tiene padre)
+    parents = np.full(num_nodes, -1, dtype=np.int64)
+    merged = np.arange(n, num_nodes)
+    parents[Z[:, 0].astype(np.int64)] = merged
+    parents[Z[:, 1].astype(np.int64)] = merged
+    heights = np.concatenate([np.zeros(n), Z[:, 2]])
+
+    node_ids = node_ids.tolist()
+    parent_ids = [node_ids[parent] if parent >= 0 else None for parent in parents.tolist()]
+    point_ids = list(original_ids) + [None] * (n - 1)
+    names = [f'Point {i+1}' for i in range(n)] + [f'Cluster {i+1}' for i in range(n, num_nodes)]
+
+    # Filas en orden inverso (de la raíz a las hojas): cada padre se escribe antes que sus hijos
+    return [(index, node_ids[i], parent_ids[i], point_ids[i], names[i], heights[i])
+            for i in range(num_nodes - 1, -1, -1)]
+
+
+# Insertar el árbol jerárquico completo (hojas y nodos) en una sola escritura en bloque
+def insert_tree_data(conn, Z, index, original_ids):
+    # Reservar de una vez los 2n-1 ids de la secuencia: primero las hojas y después los nodos
+    node_ids = reserve_ids(conn, 'grafana_ml_model_hierarchical_clustering', 2 * len(original_ids) - 1)
+    rows = build_tree_rows(Z, index, original_ids, node_ids)
+    write_rows(conn, 'grafana_ml_model_hierarchical_clustering',
+               ('index', 'id', 'id_parent', 'id_point', 'name', 'height'), rows)
+    return node_ids
+
+
+# Calcular los cortes planos del árbol para varios k a la vez. Devuelve una matriz n x len(k_values)
+# con el número de clúster (de 0 a k-1) de cada punto en cada corte.
+# Con Z monótona, cortar en k clústeres equivale a aplicar solo las n-k primeras fusiones: el
+# clúster de cada punto es su antecesor más alto con id <= 2n-k-1. Ese antecesor se encuentra
+# para todos los nodos y todos los k con saltos de punteros (O(n log n)), sin recorrer el árbol.
+def flat_cuts(Z, k_values):
+    n = len(Z) + 1
+    k_values = np.asarray(k_values, dtype=np.int64)
+    if not is_monotonic(Z):
+        # Los métodos 'centroid' y 'median' pueden dar alturas no monótonas: se usa fcluster
+        return np.column_stack([np.unique(fcluster(Z, k, 'maxclust'), return_inverse=True)[1] for k in k_values])
+
+    nodes = np.arange(2 * n - 1)
+    parents = np.full(2 * n - 1, 2 * n - 1)  # La raíz no tiene padre (id mayor que cualquier corte)
+    parents[Z[:, 0].astype(np.int64)] = nodes[n:]
+    parents[Z[:, 1].astype(np.int64)] = nodes[n:]
+
+    # Un nodo es raíz de su clúster si su padre queda por encima del corte (id > 2n-k-1)
+    cut = 2 * n - k_values - 1
+    roots = np.where((parents[:, None] > cut) | (nodes[:, None] > cut), nodes[:, None], parents[:, None])
+    while True:
+        jumped = np.take_along_axis(roots, roots, axis=0)
+        if np.array_equal(jumped, roots):
+            break
+        roots = jumped
+
+    return np.column_stack([np.unique(roots[:n, j], return_inverse=True)[1] for j in range(len(k_values))])
+
+
+# Función para convertir umbrales de distancia en número de clústeres: con Z monótona, cortar a
+# altura t deja n menos el número de fusiones con altura <= t (como fcluster con 'distance')
+def k_for_thresholds(Z, thresholds):
+    n = len(Z) + 1
+    if not is_monotonic(Z):
+        return np.array([len(np.unique(fcluster(Z, t, 'distance'))) for t in thresholds], dtype=np.int64)
+    heights = np.sort(Z[:, 2])
+    return n - np.searchsorted(heights, np.asarray(thresholds, dtype=np.float64), side='right')
+
+
+# Insertar los cortes planos en grafana_ml_model_hierarchical_cut: una fila por punto y por k.
+# Se reemplazan los cortes anteriores del índice.
+def insert_flat_cuts(conn, index, original_ids, k_values, labels):
     cur = conn.cursor()
-    node_id_map = {}
-    
-    # Iterar sobre los puntos usando sus IDs reales
-    for i, point_id in enumerate(original_ids):
-        cur.execute("""
-            INSERT INTO grafana_ml_model_hierarchical_clustering ("index", id_parent, id_point, name, height)
-            VALUES (%s, NULL, %s, %s, 0) RETURNING id
-        """, (index, point_id, f'Point {i+1}'))  # Aquí utilizamos el ID real del punto de la base de datos
-        
-        node_id_map[i] = cur.fetchone()[0]  # Mapear el índice al nuevo nodo
-    conn.commit()
+    cur.execute("DELETE FROM grafana_ml_model_hierarchical_cut WHERE index = %s", (index,))
     cur.close()
-    
-    return node_id_map
 
+    n = len(original_ids)
+    copy_arrays(conn, 'grafana_ml_model_hierarchical_cut', ('index', 'k', 'id_point', 'number_cluster'),
+                [np.full(n * len(k_values), index), np.repeat(k_values, n),
+                 np.tile(np.asarray(original_ids, dtype=np.int64), len(k_values)), labels.T.ravel()],
+                types=['int4', 'int4', 'int4', 'int4'])
+    conn.commit()
 
-# Insertar los nodos del árbol jerárquico (sin `number_cluster` en los nodos)
-def insert_cluster_data(conn, Z, node_id_map, k, index):
-    cur = conn.cursor()
-    for i, (left, right, dist, _) in enumerate(Z):
-        left_id = node_id_map[int(left)]
-        right_id = node_id_map[int(right)]
 
-        # Calcular la altura como la distancia de fusión
-        height = dist
+# Calcular la disposición del dendrograma sin dibujarlo, con las mismas coordenadas que
+# dendrogram(Z, no_plot=True) de scipy: la hoja en la posición r del orden de hojas está en
+# x = 5 + 10r y cada fusión es una U entre las x de sus hijos a la altura de la fusión.
+# Con truncate_level=p solo se muestran las fusiones hasta p niveles por debajo de la raíz
+# (como truncate_mode='level'); sus hijos no mostrados se dibujan como hojas agrupadas a altura 0.
+# Devuelve, para cada nodo mostrado (índice de nodo de Z), su x, su altura y, en las fusiones,
+# las x y alturas de sus hijos; en las hojas, su posición en el orden de hojas.
+def dendrogram_layout(Z, truncate_level=None):
+    n = len(Z) + 1
+    children = Z[:, :2].astype(np.int64)
+    heights = np.concatenate([np.zeros(n), Z[:, 2]])
 
-        # Insertar el nuevo nodo que es el padre de los nodos fusionados
-        cur.execute("""
-        INSERT INTO grafana_ml_model_hierarchical_clustering ("index", id_parent, name, height)
-        VALUES (%s, %s, %s, %s) RETURNING id
-        """, (index, None, f'Cluster {len(node_id_map) + 1}', height))
-        parent_id = cur.fetchone()[0]
-        node_id_map[len(node_id_map)] = parent_id  # Agregar al mapa
+    # Profundidad de cada nodo contando desde la raíz (de arriba abajo)
+    depth = np.zeros(2 * n - 1, dtype=np.int64)
+    for i in range(n - 2, -1, -1):
+        depth[children[i]] = depth[n + i] + 1
 
-        # Actualizar los nodos hijos con el nuevo padre
-        cur.execute(f"UPDATE grafana_ml_model_hierarchical_clustering SET id_parent = %s WHERE id = %s", (parent_id, left_id))
-        cur.execute(f"UPDATE grafana_ml_model_hierarchical_clustering SET id_parent = %s WHERE id = %s", (parent_id, right_id))
+    # Fusiones mostradas y hojas (puntos o nodos agrupados) en el orden de hojas de scipy
+    if truncate_level is None:
+        links = np.arange(n, 2 * n - 1)
+        leaves = leaves_list(Z)
+    else:
+        links = np.arange(n, 2 * n - 1)[depth[n:] <= truncate_level]
+        shown = np.zeros(2 * n - 1, dtype=bool)
+        shown[links] = True
+        hidden = children[links - n].ravel()
+        hidden = hidden[~shown[hidden]]
 
-    conn.commit()
+        # Cada hoja agrupada ocupa la posición de la primera hoja original de su subárbol
+        first = np.empty(2 * n - 1, dtype=np.int64)
+        first[leaves_list(Z)] = np.arange(n)
+        for i in range(n - 1):
+            first[n + i] = min(first[children[i, 0]], first[children[i, 1]])
+        leaves = hidden[np.argsort(first[hidden])]
+        heights[leaves] = 0.0
+
+    x = np.full(2 * n - 1, np.nan)
+    x[leaves] = 5.0 + 10.0 * np.arange(len(leaves))
+    for node in links:
+        left, right = children[node - n]
+        x[node] = (x[left] + x[right]) / 2
+
+    left, right = children[links - n, 0], children[links - n, 1]
+    return {
+        'leaves': leaves,
+        'leaf_x': x[leaves],
+        'links': links,
+        'x': x[links],
+        'height': heights[links],
+        'x_left': x[left],
+        'x_right': x[right],
+        'height_left': heights[left],
+        'height_right': heights[right],
+    }
+
+
+# Insertar la disposición del dendrograma en grafana_ml_model_dendrogram: una fila por fusión
+# (con las coordenadas de la U) y una por hoja (con su posición en el orden de hojas).
+# truncate_level es NULL en la disposición completa. Se reemplaza la disposición anterior.
+def insert_dendrogram_layout(conn, index, Z, node_ids, truncate_level=None):
+    layout = dendrogram_layout(Z, truncate_level)
+    counts = np.concatenate([np.ones(len(Z) + 1), Z[:, 3]])
+    node_ids = np.asarray(node_ids)
+
+    rows = []
+    for order, (leaf, x) in enumerate(zip(layout['leaves'].tolist(), layout['leaf_x'].tolist())):
+        rows.append((index, truncate_level, int(node_ids[leaf]), x, 0.0, None, None, None, None, order,
+                     int(counts[leaf])))
+    for i, link in enumerate(layout['links'].tolist()):
+        rows.append((index, truncate_level, int(node_ids[link]), layout['x'][i], layout['height'][i],
+                     layout['x_left'][i], layout['x_right'][i], layout['height_left'][i],
+                     layout['height_right'][i], None, int(counts[link])))
+
+    cur = conn.cursor()
+    if truncate_level is None:
+        cur.execute("DELETE FROM grafana_ml_model_dendrogram WHERE index = %s AND truncate_level IS NULL", (index,))
+    else:
+        cur.execute("DELETE FROM grafana_ml_model_dendrogram WHERE index = %s AND truncate_level = %s",
+                    (index, truncate_level))
     cur.close()
+    write_rows(conn, 'grafana_ml_model_dendrogram',
+               ('index', 'truncate_level', 'id_node', 'x', 'height', 'x_left', 'x_right', 'height_left',
+                'height_right', 'leaf_order', 'count'), rows)
+
+
+# Guardar el dendrograma en un fichero PNG sin abrir ninguna ventana (matplotlib solo se
+# importa aquí, así que no es necesario para el resto del script). El árbol se dibuja truncado a
+# truncate_level niveles y sin una etiqueta por punto: con miles de hojas dibujar el árbol
+# completo tarda minutos, mucho más que el propio agrupamiento.
+def save_dendrogram_plot(Z, path, truncate_level=10):
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(10, 7))
+    axes = figure.subplots()
+    if truncate_level is None:
+        dendrogram(Z, no_labels=True, ax=axes)
+    else:
+        dendrogram(Z, truncate_mode='level', p=truncate_level, no_labels=True, ax=axes)
+    axes.set_title('Dendrograma del Agrupamiento Jerárquico')
+    axes.set_xlabel('Puntos')
+    axes.set_ylabel('Distancia')
+    figure.savefig(path)
+
+
+# Función para realizar el agrupamiento jerárquico sobre una matriz ya cargada (la de
+# load_data_from_db) y almacenar el árbol, la disposición del dendrograma y los cortes planos.
+# No modifica data. Devuelve la matriz de enlace Z.
+def hierarchical_clustering_on_data(conn, index, data, original_ids, k=3, method='ward', linkage_metric='euclidean',
+                                    mode='exact', micro_clusters=1000, micro_method='kmeans', birch_threshold=0.5,
+                                    cut_k_values=None, cut_thresholds=None, layout_truncate_level=10):
+    # Realizar el agrupamiento jerárquico
+    if mode == 'micro':
+        Z = micro_cluster_linkage(data, method, linkage_metric, micro_clusters, micro_method, birch_threshold)
+    elif mode == 'exact':
+        Z = linkage(data, method=method, metric=linkage_metric)
+    else:
+        raise ValueError(f"Modo de agrupamiento jerárquico desconocido: {mode}")
+
+    # Insertar los puntos y los nodos del árbol jerárquico
+    node_ids = insert_tree_data(conn, Z, index, original_ids)
+
+    # Guardar la disposición del dendrograma completa y truncada a layout_truncate_level niveles
+    insert_dendrogram_layout(conn, index, Z, node_ids)
+    if layout_truncate_level is not None:
+        insert_dendrogram_layout(conn, index, Z, node_ids, layout_truncate_level)
+
+    # Calcular y guardar los cortes planos para los k pedidos y los umbrales de distancia
+    k_values = list(cut_k_values) if cut_k_values is not None else list(range(1, max(8, k) + 1))
+    if cut_thresholds is not None:
+        k_values += k_for_thresholds(Z, cut_thresholds).tolist()
+    k_values = np.unique(np.clip(k_values, 1, len(original_ids)))
+    insert_flat_cuts(conn, index, original_ids, k_values, flat_cuts(Z, k_values))
+    return Z
 
 
 # Realizar el agrupamiento jerárquico y guardar los resultados en la base de datos
+# mode='exact' usa linkage de scipy sobre todos los puntos (matriz de distancias O(n²));
+# mode='micro' agrupa antes los puntos en micro_clusters micro-clústeres con micro_method
+# ('kmeans' o 'birch', con umbral birch_threshold) y calcula el enlace sobre ellos.
+# Además se guardan los cortes planos del árbol para cada k de cut_k_values (por defecto, de 1 a
+# max(8, k)) y para cada umbral de distancia de cut_thresholds, y la disposición del dendrograma
+# (completa y truncada a layout_truncate_level niveles). Con visualize=True el dendrograma,
+# truncado también a layout_truncate_level niveles, se guarda como imagen en plot_path.
 def hierarchical_clustering_to_db(index, dbname, user='postgres', password='postgres', host='localhost', port='5432', 
-                                  k=3, method='ward', linkage_metric='euclidean', visualize=True):
+                                  k=3, method='ward', linkage_metric='euclidean', visualize=True, load_method='fetch', use_cache=False,
+                                  mode='exact', micro_clusters=1000, micro_method='kmeans', birch_threshold=0.5,
+                                  cut_k_values=None, cut_thresholds=None, layout_truncate_level=10, plot_path=None):
+    if mode not in ('exact', 'micro'):
+        raise ValueError(f"Modo de agrupamiento jerárquico desconocido: {mode}")
+
     conn = connect_to_db(dbname, user, password, host, port)
 
     # Cargar los datos desde la base de datos
-    data, feature_names, points, original_ids = load_data_from_db(conn, index)
-
-    # Realizar el agrupamiento jerárquico
-    Z = linkage(data, method=method, metric=linkage_metric)
-
-    # Insertar los puntos en la base de datos
-    node_id_map = insert_point_data(conn, data, index, original_ids)
+    data, feature_names, points, original_ids = load_data_from_db(conn, index, load_method, use_cache)
 
-    # Insertar los nodos del árbol jerárquico
-    insert_cluster_data(conn, Z, node_id_map, k, index)
+    # Agrupar y guardar los resultados
+    Z = hierarchical_clustering_on_data(conn, index, data, original_ids, k, method, linkage_metric, mode,
+                                        micro_clusters, micro_method, birch_threshold, cut_k_values, cut_thresholds,
+                                        layout_truncate_level)
 
     conn.close()
     print(f"Datos de agrupamiento jerárquico insertados en la base de datos: '{dbname}'")
 
-    # Visualizar el dendrograma
+    # Guardar una imagen del dendrograma (sin ventana, el script no se bloquea)
     if visualize:
-        plt.figure(figsize=(10, 7))
-        dendrogram(Z, labels=[f'Point {i+1}' for i in range(len(data))], leaf_rotation=0)
-        plt.title('Dendrograma del Agrupamiento Jerárquico')
-        plt.xlabel('Puntos')
-        plt.ylabel('Distancia')
-        plt.show()
+        save_dendrogram_plot(Z, plot_path or f'dendrogram_index_{index}.png', layout_truncate_level)
 
 # Ejemplo de uso
 if __name__ == "__main__":
@@ -1,7 +1,12 @@
 import numpy as np
 import psycopg2
-from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score, davies_bouldin_score, pairwise_distances, silhouette_samples
+from DataLoader import load_index_matrix, load_points, load_features, iter_index_blocks
+from MatrixCache import load_index_matrix_cached
+from BulkWriter import write_rows, copy_rows
+from DatasetIngest import run_in_transaction
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from ClusterMetrics import clustering_metrics, davies_bouldin_per_cluster, subsample_silhouette
+from ClusteringSweep import sweep_k_values, select_results, insert_sweep_metrics
 
 # Función para conectar a la base de datos
 def connect_to_db(dbname, user='postgres', password='postgres', host='localhost', port='5432'):
@@ -20,73 +25,31 @@ def connect_to_db(dbname, user='postgres', password='postgres', host='localhost'
         return None
 
 # Función para cargar los datos de la base de datos
-def load_data_from_db(conn, index):
-    cur = conn.cursor()
+def load_data_from_db(conn, index, method='fetch', cache=False):
+    # Cargar los puntos y las características ordenados por id
+    points = load_points(conn, index)
+    features = load_features(conn, index)
+    feature_names = [feature[1] for feature in features]
 
-    # Cargar las características de los puntos (iris)
-    cur.execute("""
-        SELECT id, name
-        FROM grafana_ml_model_point
-        WHERE index = %s
-    """, (index,))
-    points = cur.fetchall()  # Los IDs y nombres de los puntos
+    # Cargar la matriz de datos (filas en el orden de los puntos, columnas en el de las características)
+    load_matrix = load_index_matrix_cached if cache else load_index_matrix  # Caché local opcional
+    data, point_ids, feature_ids = load_matrix(conn, index, points=points, features=features, method=method)
 
-    # Cargar los valores de las características de los puntos
-    cur.execute("""
-        SELECT id_point, id_feature, value
-        FROM grafana_ml_model_point_value
-        WHERE index = %s
-    """, (index,))
-    values = cur.fetchall()  # Los valores de características (id_point, id_feature, value)
-
-    # Organizar los datos en un formato adecuado
-    num_points = len(points)
-    num_features = len(set([v[1] for v in values]))  # Identificar el número de características
-    data = np.zeros((num_points, num_features))  # Matriz de datos de características
-
-    # Llenar la matriz de datos con los valores
-    for v in values:
-        # v[0] -> id_point
-        # v[1] -> id_feature
-        # v[2] -> value
-        point_index = next(i for i, point in enumerate(points) if point[0] == v[0])  # Buscar el índice del punto
-        feature_index = v[1] - values[0][1]  # Asegurarse de que el índice de las características sea correcto
-        data[point_index, feature_index] = v[2]  # Asignar el valor al lugar adecuado
-
-    # Cargar los nombres de las características
-    cur.execute("""
-        SELECT name
-        FROM grafana_ml_model_feature
-        WHERE index = %s
-    """, (index,))
-    feature_names = [row[0] for row in cur.fetchall()]
-
-    cur.close()
     return data, feature_names, points
 
 # Insertar los clústeres en la tabla grafana_ml_model_cluster con sus métricas
-def insert_cluster_data(conn, index, clusters, data, kmeans):
+# (calculadas de una vez para todos los clústeres con clustering_metrics)
+def insert_cluster_data(conn, index, clusters, metrics):
     cur = conn.cursor()
     cluster_ids = []
 
-    for i in set(clusters):
-        # Convertir `i` a int para evitar el error
-        cluster_mask = clusters == i
-        cluster_points = data[cluster_mask]
- 
-        # Calcular métricas individuales
-        silhouette_cluster = silhouette_score(data, clusters == i)
-        davies_bouldin_cluster = davies_bouldin_score(data, clusters == i)
-
-        # Calcular inercia para el clúster
-        cluster_center = kmeans.cluster_centers_[i]
-        inertia_cluster = np.sum(np.linalg.norm(cluster_points - cluster_center, axis=1) ** 2)
-
+    for i in np.unique(clusters):
         # Insertar en la base de datos
         cur.execute("""
             INSERT INTO grafana_ml_model_cluster (index, number, inertia, silhoutte_coefficient, davies_bouldin_index)
             VALUES (%s, %s, %s, %s, %s) RETURNING id
-        """, (index, int(i), inertia_cluster, silhouette_cluster, davies_bouldin_cluster))  # Conversión aquí
+        """, (index, int(i), float(metrics['inertia'][i]), float(metrics['silhouette'][i]),
+              float(metrics['davies_bouldin'][i])))
 
         cluster_ids.append(cur.fetchone()[0])  # Obtener el id del cluster insertado
 
@@ -94,24 +57,20 @@ def insert_cluster_data(conn, index, clusters, data, kmeans):
     cur.close()
     return cluster_ids
 
+# Filas de grafana_ml_model_point_kmeans: cada punto con el id de su clúster
+def point_cluster_rows(index, points, clusters, cluster_ids):
+    point_ids = [int(point[0]) for point in points]
+    cluster_ids = np.asarray(cluster_ids)[clusters].tolist()  # Usar el ID del cluster insertado
+    return zip([index] * len(point_ids), point_ids, cluster_ids)
+
 # Insertar los puntos y los centroides en la tabla grafana_ml_model_point_cluster
 def insert_point_cluster_data(conn, index, points, clusters, cluster_ids):
-    cur = conn.cursor()
-
-    # Insertar los puntos en la tabla de puntos-clúster
-    for i, cluster in enumerate(clusters):
-        point_id = int(points[i][0])  # Convertimos a int para evitar el error de tipo
-        cluster_id = cluster_ids[cluster]  # Usar el ID del cluster insertado
-        cur.execute("""
-            INSERT INTO grafana_ml_model_point_kmeans (index, id_point, id_cluster)
-            VALUES (%s, %s, %s)
-        """, (index, point_id, cluster_id))  # Usamos False para is_center porque son puntos
-
-    conn.commit()
-    cur.close()
+    # Insertar los puntos en la tabla de puntos-clúster en bloque
+    write_rows(conn, 'grafana_ml_model_point_kmeans', ('index', 'id_point', 'id_cluster'),
+               point_cluster_rows(index, points, clusters, cluster_ids))
 
-# Insertar los centroides en la tabla grafana_ml_model_centroid
-def insert_centroids_to_db(conn, index, centroids, feature_names, cluster_ids):
+# Filas de grafana_ml_model_centroid: un valor por clúster y característica
+def centroid_rows(conn, index, centroids, feature_names, cluster_ids):
     cur = conn.cursor()
     
     # Obtener los IDs de las características en el orden correspondiente
@@ -122,46 +81,189 @@ def insert_centroids_to_db(conn, index, centroids, feature_names, cluster_ids):
         ORDER BY id
     """, (index,))
     features = {row[1]: row[0] for row in cur.fetchall()}  # Mapeamos name -> id
+    cur.close()
 
+    rows = []
     for i, centroid in enumerate(centroids):
         for j, value in enumerate(centroid):
             feature_name = feature_names[j]
             id_feature = features[feature_name]  # Buscar el ID correcto basado en el nombre
-            
-            cur.execute("""
-                INSERT INTO grafana_ml_model_centroid (index, id_cluster, id_feature, value)
-                VALUES (%s, %s, %s, %s)
-            """, (index, cluster_ids[i], id_feature, value))
+            rows.append((index, cluster_ids[i], id_feature, float(value)))
+    return rows
 
-    conn.commit()
-    cur.close()
-# Insertar las métricas generales del agrupamiento en la tabla grafana_ml_model_metrics_clustering
-def insert_clustering_metrics(conn, index, inertia, silhouette, davies_bouldin):
+# Insertar los centroides en la tabla grafana_ml_model_centroid
+def insert_centroids_to_db(conn, index, centroids, feature_names, cluster_ids):
+    write_rows(conn, 'grafana_ml_model_centroid', ('index', 'id_cluster', 'id_feature', 'value'),
+               centroid_rows(conn, index, centroids, feature_names, cluster_ids))
+
+# Insertar las métricas generales del agrupamiento en la tabla grafana_ml_model_metrics_clustering.
+# silhouette_ci es el intervalo de confianza de la silueta y sample_size los puntos usados para estimarla.
+# No hace commit: con autocommit cada sentencia se confirma sola y dentro de una transacción la
+# confirma quien la abrió.
+def insert_clustering_metrics(conn, index, inertia, silhouette, davies_bouldin, silhouette_ci=(None, None), sample_size=None):
     cur = conn.cursor()
 
     cur.execute("""
-        INSERT INTO grafana_ml_model_metrics_clustering (index, type, inertia, silhoutte_coefficient, davies_bouldin_index)
-        VALUES (%s, %s, %s, %s, %s)
-    """, (index, 'KMeans', inertia, silhouette, davies_bouldin))
+        INSERT INTO grafana_ml_model_metrics_clustering (index, type, inertia, silhoutte_coefficient, silhouette_ci_lower,
+                                                         silhouette_ci_upper, silhouette_sample_size, davies_bouldin_index)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """, (index, 'KMeans', inertia, silhouette, silhouette_ci[0], silhouette_ci[1], sample_size, davies_bouldin))
 
-    conn.commit()
     cur.close()
 
-# Función para realizar el agrupamiento K-Means y almacenar en la base de datos
-def kmeans_clustering_to_db(index, dbname, user='postgres', password='postgres', host='localhost', port='5432', k=3):
-    # Conectar a la base de datos
-    conn = connect_to_db(dbname, user, password, host, port)
-    
-    # Cargar los datos desde la base de datos
-    data, feature_names, points = load_data_from_db(conn, index)
-    
+# Actualizar una muestra de reservorio con las filas de un bloque: a cada fila se le asigna una
+# clave aleatoria y se conservan las size filas con las claves menores (muestra uniforme).
+def update_reservoir(reservoir, arrays, rng, size):
+    keys = rng.random(len(arrays[0]))
+    if reservoir is not None:
+        keys = np.concatenate([reservoir[0], keys])
+        arrays = [np.concatenate([old, new]) for old, new in zip(reservoir[1], arrays)]
+    if len(keys) > size:
+        keep = np.argpartition(keys, size)[:size]
+        keys, arrays = keys[keep], [array[keep] for array in arrays]
+    return keys, arrays
+
+
+# Entrenar K-Means por bloques (MiniBatchKMeans.partial_fit) sin cargar el índice en memoria.
+# Una primera pasada toma una muestra de init_size puntos para inicializar los centroides con
+# K-Means completo y calcula la varianza media de los datos. Después se recorre el índice hasta
+# max_epochs veces, parando antes si en una pasada los centroides se mueven menos que tol
+# (relativo a la varianza media).
+def fit_kmeans_minibatch(conn, index, k, features, block_size=10000, max_epochs=10, tol=1e-4, init_size=10000):
+    rng = np.random.default_rng(42)
+    reservoir = None
+    count, total, total_squares = 0, 0.0, 0.0
+    for point_ids, block in iter_index_blocks(conn, index, block_size=block_size, features=features):
+        reservoir = update_reservoir(reservoir, [block], rng, max(init_size, k))
+        count += len(block)
+        total = total + block.sum(axis=0)
+        total_squares = total_squares + (block ** 2).sum(axis=0)
+    mean = total / max(count, 1)
+    variance = float(np.mean(total_squares / max(count, 1) - mean ** 2))
+
+    init = KMeans(n_clusters=k, random_state=42, n_init='auto').fit(reservoir[1][0]).cluster_centers_
+    kmeans = MiniBatchKMeans(n_clusters=k, random_state=42, init=init, n_init=1, reassignment_ratio=0)
+    for epoch in range(max_epochs):
+        previous = kmeans.cluster_centers_.copy() if hasattr(kmeans, 'cluster_centers_') else init
+        for point_ids, block in iter_index_blocks(conn, index, block_size=block_size, features=features):
+            kmeans.partial_fit(block)
+        if np.sum((kmeans.cluster_centers_ - previous) ** 2) <= tol * variance:
+            break
+    return kmeans
+
+
+# Insertar los clústeres sin métricas (se completan al terminar la asignación por bloques)
+def insert_empty_clusters(conn, index, k):
+    cur = conn.cursor()
+    cluster_ids = []
+    for i in range(k):
+        cur.execute("""
+            INSERT INTO grafana_ml_model_cluster (index, number)
+            VALUES (%s, %s) RETURNING id
+        """, (index, i))
+        cluster_ids.append(cur.fetchone()[0])
+    cur.close()
+    return cluster_ids
+
+
+# Asignar los puntos por bloques, insertarlos en grafana_ml_model_point_kmeans (COPY, sin commit)
+# y acumular por clúster la inercia, el número de puntos y la suma de sus coordenadas (para las
+# medias de Davies-Bouldin).
+# También guarda una muestra aleatoria uniforme de sample_size puntos para estimar la silueta.
+def assign_points_minibatch(conn, index, kmeans, features, cluster_ids, block_size=10000, sample_size=10000):
+    k = len(kmeans.cluster_centers_)
+    inertia = np.zeros(k)
+    counts = np.zeros(k, dtype=np.int64)
+    sums = np.zeros((k, len(features)))
+    rng = np.random.default_rng(42)
+    reservoir = None
+
+    for point_ids, block in iter_index_blocks(conn, index, block_size=block_size, features=features):
+        clusters = kmeans.predict(block)
+        distances = np.linalg.norm(block - kmeans.cluster_centers_[clusters], axis=1)
+        inertia += np.bincount(clusters, weights=distances ** 2, minlength=k)
+        counts += np.bincount(clusters, minlength=k)
+        sums += np.stack([np.bincount(clusters, weights=block[:, j], minlength=k) for j in range(block.shape[1])],
+                         axis=1)
+
+        reservoir = update_reservoir(reservoir, [block, clusters], rng, sample_size)
+
+        copy_rows(conn, 'grafana_ml_model_point_kmeans', ('index', 'id_point', 'id_cluster'),
+                  point_cluster_rows(index, [(int(point_id),) for point_id in point_ids], clusters, cluster_ids))
+
+    sample, sample_labels = reservoir[1]
+    return inertia, counts, sums / np.maximum(counts, 1)[:, None], sample, sample_labels
+
+
+# Calcular por bloques la distancia media de los puntos de cada clúster a su media (la dispersión
+# de Davies-Bouldin, como en ClusterMetrics.clustering_metrics). Necesita una pasada más porque
+# las medias solo se conocen al terminar la asignación.
+def cluster_scatter_minibatch(conn, index, kmeans, features, means, counts, block_size=10000):
+    k = len(means)
+    distance_sum = np.zeros(k)
+    for point_ids, block in iter_index_blocks(conn, index, block_size=block_size, features=features):
+        clusters = kmeans.predict(block)
+        distance_sum += np.bincount(clusters, weights=np.linalg.norm(block - means[clusters], axis=1), minlength=k)
+    return distance_sum / np.maximum(counts, 1)
+
+
+# Actualizar las métricas de los clústeres insertados con insert_empty_clusters
+def update_cluster_metrics(conn, cluster_ids, inertia, silhouette, davies_bouldin):
+    cur = conn.cursor()
+    for i, cluster_id in enumerate(cluster_ids):
+        cur.execute("""
+            UPDATE grafana_ml_model_cluster
+            SET inertia = %s, silhoutte_coefficient = %s, davies_bouldin_index = %s
+            WHERE id = %s
+        """, (float(inertia[i]), float(silhouette[i]), float(davies_bouldin[i]), cluster_id))
+    cur.close()
+
+
+# Agrupamiento K-Means por bloques (mode='minibatch') para índices que no caben en memoria.
+# Escribe en las mismas tablas que el modo 'batch'. La silueta se estima con una muestra
+# uniforme de sample_size puntos, porque la exacta necesita todas las distancias entre puntos.
+# Toda la escritura se hace en una sola transacción: si falla, no queda ningún clúster a medias.
+def kmeans_clustering_minibatch(conn, index, k, block_size=10000, sample_size=10000, max_epochs=10, tol=1e-4):
+    features = load_features(conn, index)
+    feature_names = [feature[1] for feature in features]
+
+    # Primeras pasadas: inicializar y entrenar el modelo
+    kmeans = fit_kmeans_minibatch(conn, index, k, features, block_size, max_epochs, tol)
+
+    # Última pasada: asignar los puntos y acumular métricas (iter_index_blocks usa la transacción)
+    def write_results():
+        cluster_ids = insert_empty_clusters(conn, index, k)
+        inertia, counts, means, sample, sample_labels = assign_points_minibatch(
+            conn, index, kmeans, features, cluster_ids, block_size, sample_size)
+        scatter = cluster_scatter_minibatch(conn, index, kmeans, features, means, counts, block_size)
+        present = counts > 0
+        davies_bouldin = np.full(k, np.nan)
+        davies_bouldin[present] = davies_bouldin_per_cluster(scatter[present], means[present])
+        silhouette, global_silhouette, interval = subsample_silhouette(sample, sample_labels, k)
+
+        update_cluster_metrics(conn, cluster_ids, inertia, silhouette, davies_bouldin)
+        copy_rows(conn, 'grafana_ml_model_centroid', ('index', 'id_cluster', 'id_feature', 'value'),
+                  centroid_rows(conn, index, kmeans.cluster_centers_, feature_names, cluster_ids))
+        insert_clustering_metrics(conn, index, float(inertia.sum()), global_silhouette,
+                                  float(np.mean(davies_bouldin[present])), interval, len(sample_labels))
+
+    run_in_transaction(conn, write_results)
+
+
+# Función para realizar el agrupamiento K-Means sobre una matriz ya cargada (la de
+# load_data_from_db) y almacenar los resultados. No modifica data.
+def kmeans_clustering_on_data(conn, index, data, feature_names, points, k=3, metrics_mode='auto', sample_size=10000):
     # Realizar el agrupamiento K-Means
     kmeans = KMeans(n_clusters=k, random_state=42, n_init='auto')  # Usamos 'auto' para evitar el warning
     clusters = kmeans.fit_predict(data)
     centroids = kmeans.cluster_centers_  # Centroides de los clústeres
     
+    # Calcular las métricas por clúster y globales en una sola pasada
+    cluster_metrics, metrics = clustering_metrics(data, clusters, centroids, squared=True,
+                                                  mode=metrics_mode, sample_size=sample_size)
+
     # Insertar los clústeres en la tabla de clústeres con sus métricas
-    cluster_ids = insert_cluster_data(conn, index, clusters, data, kmeans)
+    cluster_ids = insert_cluster_data(conn, index, clusters, cluster_metrics)
     
     # Insertar los puntos en la tabla grafana_ml_model_point_cluster (sin centroides)
     insert_point_cluster_data(conn, index, points, clusters, cluster_ids)
@@ -170,17 +272,66 @@ def kmeans_clustering_to_db(index, dbname, user='postgres', password='postgres',
     insert_centroids_to_db(conn, index, centroids, feature_names, cluster_ids)
     
     # Insertar las métricas generales del agrupamiento
-    inertia = kmeans.inertia_
-    silhouette = silhouette_score(data, clusters)
-    davies_bouldin = davies_bouldin_score(data, clusters)
-    
-    insert_clustering_metrics(conn, index, inertia, silhouette, davies_bouldin)
-    
+    insert_clustering_metrics(conn, index, metrics['inertia'], metrics['silhouette'], metrics['davies_bouldin'],
+                              metrics['silhouette_ci'], metrics['silhouette_sample_size'])
+
+
+# Función para realizar el agrupamiento K-Means y almacenar en la base de datos
+# mode='batch' carga el índice en memoria; mode='minibatch' entrena y asigna por bloques de
+# block_size puntos (hasta max_epochs pasadas de entrenamiento, con parada temprana según tol).
+# metrics_mode ('exact', 'sampled' o 'auto') indica cómo se calcula la silueta; en los modos con
+# muestra se usan sample_size puntos elegidos por estratos de clúster.
+def kmeans_clustering_to_db(index, dbname, user='postgres', password='postgres', host='localhost', port='5432', k=3, load_method='fetch', use_cache=False,
+                            mode='batch', block_size=10000, max_epochs=10, tol=1e-4, metrics_mode='auto', sample_size=10000):
+    # Conectar a la base de datos
+    conn = connect_to_db(dbname, user, password, host, port)
+
+    if mode == 'minibatch':
+        kmeans_clustering_minibatch(conn, index, k, block_size, sample_size, max_epochs, tol)
+        conn.close()
+        print(f"Datos de agrupamiento K-Means insertados en la base de datos: '{dbname}'")
+        return
+
+    if mode != 'batch':
+        conn.close()
+        raise ValueError(f"Modo de K-Means desconocido: {mode}")
+
+    # Cargar los datos desde la base de datos
+    data, feature_names, points = load_data_from_db(conn, index, load_method, use_cache)
+
+    # Agrupar y guardar los resultados
+    kmeans_clustering_on_data(conn, index, data, feature_names, points, k, metrics_mode, sample_size)
+
     # Cerrar la conexión
     conn.close()
 
     print(f"Datos de agrupamiento K-Means insertados en la base de datos: '{dbname}'")
 
+# Función para entrenar K-Means para cada k de k_values en paralelo y almacenar en la base de datos
+# las métricas de todos los k. Las asignaciones, centroides y métricas completas solo se guardan
+# para los k de select (por defecto, el de mayor silueta). processes es el número de procesos
+# (por defecto, uno por núcleo) y threads los hilos de BLAS/OpenMP de cada proceso.
+def kmeans_sweep_to_db(index, dbname, user='postgres', password='postgres', host='localhost', port='5432', k_values=range(2, 11),
+                       select=None, processes=None, threads=1, load_method='fetch', use_cache=False, metrics_mode='auto', sample_size=10000):
+    conn = connect_to_db(dbname, user, password, host, port)
+    data, feature_names, points = load_data_from_db(conn, index, load_method, use_cache)
+
+    # Entrenar todos los k en paralelo sobre la matriz compartida
+    results = sweep_k_values(data, k_values, 'KMeans', processes, threads, metrics_mode, sample_size)
+    insert_sweep_metrics(conn, index, 'KMeans', results)
+
+    # Guardar las asignaciones completas de los k elegidos, igual que kmeans_clustering_to_db
+    for result in select_results(results, select):
+        metrics = result['metrics']
+        cluster_ids = insert_cluster_data(conn, index, result['labels'], result['cluster_metrics'])
+        insert_point_cluster_data(conn, index, points, result['labels'], cluster_ids)
+        insert_centroids_to_db(conn, index, result['centers'], feature_names, cluster_ids)
+        insert_clustering_metrics(conn, index, metrics['inertia'], metrics['silhouette'], metrics['davies_bouldin'],
+                                  metrics['silhouette_ci'], metrics['silhouette_sample_size'])
+
+    conn.close()
+    print(f"Barrido de K-Means ({len(results)} valores de k) insertado en la base de datos: '{dbname}'")
+
 # Ejemplo de uso
 if __name__ == "__main__":
     index = 4 # Índice de la base de datos a analizar
@@ -1,7 +1,12 @@
 import numpy as np
 import psycopg2
+from DataLoader import load_index_matrix
+from MatrixCache import load_index_matrix_cached
+from BulkWriter import write_rows
 from sklearn_extra.cluster import KMedoids
-from sklearn.metrics import silhouette_score, davies_bouldin_score
+from ClaraKMedoids import ClaraKMedoids
+from ClusterMetrics import clustering_metrics
+from ClusteringSweep import sweep_k_values, select_results, insert_sweep_metrics
 
 # Función para conectar a la base de datos
 def connect_to_db(dbname='grafana_ml_model', user='postgres', password='postgres', host='localhost', port='5432'):
@@ -21,61 +26,28 @@ def connect_to_db(dbname='grafana_ml_model', user='postgres', password='postgres
 
 
 # Función para cargar los datos de la base de datos
-def load_data_from_db(conn, index):
-    cur = conn.cursor()
-
-    # Cargar los puntos
-    cur.execute("""
-        SELECT id
-        FROM grafana_ml_model_point
-        WHERE index = %s
-    """, (index,))
-    points = cur.fetchall()
-
-    # Cargar las características de los puntos
-    cur.execute("""
-        SELECT id_point, id_feature, value
-        FROM grafana_ml_model_point_value
-        WHERE index = %s
-    """, (index,))
-    values = cur.fetchall()
-
-    # Organizar los datos en una matriz
-    num_points = len(points)
-    num_features = len(set([v[1] for v in values]))
-    data = np.zeros((num_points, num_features))
-
-    for v in values:
-        point_index = next(i for i, point in enumerate(points) if point[0] == v[0])
-        feature_index = v[1] - values[0][1]
-        data[point_index, feature_index] = v[2]
+def load_data_from_db(conn, index, method='fetch', cache=False):
+    # Cargar la matriz de datos (filas ordenadas por id de punto, columnas por id de característica)
+    load_matrix = load_index_matrix_cached if cache else load_index_matrix  # Caché local opcional
+    data, point_ids, feature_ids = load_matrix(conn, index, method=method)
+    points = [(int(point_id),) for point_id in point_ids]
 
-    cur.close()
     return data, points
 
 
 # Insertar los clústeres en la tabla grafana_ml_model_cluster con sus métricas
-def insert_cluster_data(conn, index, clusters, data, kmedoids):
+# (calculadas de una vez para todos los clústeres con clustering_metrics)
+def insert_cluster_data(conn, index, clusters, metrics):
     cur = conn.cursor()
     cluster_ids = []
 
-    for i in set(clusters):
-        # Crear máscara para identificar los puntos de este clúster
-        cluster_mask = clusters == i
-        cluster_points = data[cluster_mask]
-      
-        silhouette_cluster = silhouette_score(data, clusters == i)
-        davies_bouldin_cluster = davies_bouldin_score(data, clusters == i)
-
-        # Calcular inercia para el clúster
-        cluster_center = data[kmedoids.medoid_indices_[i]]
-        inertia_cluster = np.sum(np.abs(np.linalg.norm(cluster_points - cluster_center, axis=1)))
-
+    for i in np.unique(clusters):
         # Insertar en la base de datos
         cur.execute("""
             INSERT INTO grafana_ml_model_cluster (index, number, inertia, silhoutte_coefficient, davies_bouldin_index)
             VALUES (%s, %s, %s, %s, %s) RETURNING id
-        """, (index, int(i), inertia_cluster, silhouette_cluster, davies_bouldin_cluster))
+        """, (index, int(i), float(metrics['inertia'][i]), float(metrics['silhouette'][i]),
+              float(metrics['davies_bouldin'][i])))
 
         cluster_ids.append(cur.fetchone()[0])
 
@@ -85,64 +57,83 @@ def insert_cluster_data(conn, index, clusters, data, kmedoids):
 
 
 # Insertar los puntos en sus clústeres
-def insert_point_cluster_data(conn, index, points, clusters, cluster_ids, kmedoids):
-    cur = conn.cursor()
+def insert_point_cluster_data(conn, index, points, clusters, cluster_ids, medoid_indices):
+    # Insertar los puntos en la tabla de puntos-clúster en bloque
+    point_ids = [int(point[0]) for point in points]
+    cluster_ids = np.asarray(cluster_ids)[clusters].tolist()
 
-    # Insertar los puntos en la tabla de puntos-clúster
-    for i, cluster in enumerate(clusters):
-        point_id = int(points[i][0])
-        cluster_id = cluster_ids[cluster]
-        
-        # Determinar si el punto es un centro de clúster (medoide)
-        is_center = True if i in kmedoids.medoid_indices_ else False
-        
-        # Insertar los datos en la base de datos
-        cur.execute("""
-            INSERT INTO grafana_ml_model_point_kmedoids (index, id_point, id_cluster, is_medoid)
-            VALUES (%s, %s, %s, %s)
-        """, (index, point_id, cluster_id, is_center))
+    # Determinar si cada punto es un centro de clúster (medoide)
+    is_center = np.isin(np.arange(len(point_ids)), medoid_indices).tolist()
 
-    conn.commit()
-    cur.close()
+    rows = zip([index] * len(point_ids), point_ids, cluster_ids, is_center)
+    write_rows(conn, 'grafana_ml_model_point_kmedoids', ('index', 'id_point', 'id_cluster', 'is_medoid'), rows)
 
 
-# Insertar las métricas generales del agrupamiento en la tabla grafana_ml_model_metrics_clustering
-def insert_clustering_metrics(conn, index, inertia, silhouette, davies_bouldin):
+# Insertar las métricas generales del agrupamiento en la tabla grafana_ml_model_metrics_clustering.
+# silhouette_ci es el intervalo de confianza de la silueta y sample_size los puntos usados para estimarla.
+def insert_clustering_metrics(conn, index, inertia, silhouette, davies_bouldin, silhouette_ci=(None, None), sample_size=None):
     cur = conn.cursor()
 
     cur.execute("""
-        INSERT INTO grafana_ml_model_metrics_clustering (index, type, inertia, silhoutte_coefficient, davies_bouldin_index)
-        VALUES (%s, %s, %s, %s, %s)
-    """, (index, 'KMedoids', inertia, silhouette, davies_bouldin))
+        INSERT INTO grafana_ml_model_metrics_clustering (index, type, inertia, silhoutte_coefficient, silhouette_ci_lower,
+                                                         silhouette_ci_upper, silhouette_sample_size, davies_bouldin_index)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """, (index, 'KMedoids', inertia, silhouette, silhouette_ci[0], silhouette_ci[1], sample_size, davies_bouldin))
 
     conn.commit()
     cur.close()
 
 
-# Función para realizar el agrupamiento K-Medoids y almacenar en la base de datos
-def kmedoids_clustering_to_db(index, dbname, user='postgres', password='postgres', host='localhost', port='5432', k=3):
-    # Conectar a la base de datos
-    conn = connect_to_db(dbname, user, password, host, port)
-
-    # Cargar los datos desde la base de datos
-    data, points = load_data_from_db(conn, index)
-
+# Función para realizar el agrupamiento K-Medoids sobre una matriz ya cargada (la de
+# load_data_from_db) y almacenar los resultados. No modifica data.
+def kmedoids_clustering_on_data(conn, index, data, points, k=3, metrics_mode='auto', sample_size=10000, mode='pam',
+                                clara_samples=5, clara_sample_size=None, processes=None, threads=1):
     # Realizar el agrupamiento K-Medoids
-    kmedoids = KMedoids(n_clusters=k, random_state=42)
+    if mode == 'clara':
+        kmedoids = ClaraKMedoids(n_clusters=k, n_samples=clara_samples, sample_size=clara_sample_size,
+                                 random_state=42, processes=processes, threads=threads)
+    elif mode == 'pam':
+        kmedoids = KMedoids(n_clusters=k, random_state=42)
+    else:
+        raise ValueError(f"Modo de K-Medoids desconocido: {mode}")
     clusters = kmedoids.fit_predict(data)
 
+    # Calcular las métricas por clúster y globales en una sola pasada (inercia sin elevar al cuadrado)
+    cluster_metrics, metrics = clustering_metrics(data, clusters, data[kmedoids.medoid_indices_], squared=False,
+                                                  mode=metrics_mode, sample_size=sample_size)
+
     # Insertar los clústeres en la tabla de clústeres con sus métricas
-    cluster_ids = insert_cluster_data(conn, index, clusters, data, kmedoids)
+    cluster_ids = insert_cluster_data(conn, index, clusters, cluster_metrics)
 
     # Insertar los puntos en la tabla grafana_ml_model_point_kmedoid
-    insert_point_cluster_data(conn, index, points, clusters, cluster_ids, kmedoids)
+    insert_point_cluster_data(conn, index, points, clusters, cluster_ids, kmedoids.medoid_indices_)
 
     # Insertar las métricas generales del agrupamiento
-    inertia = kmedoids.inertia_
-    silhouette = silhouette_score(data, clusters)
-    davies_bouldin = davies_bouldin_score(data, clusters)
+    insert_clustering_metrics(conn, index, metrics['inertia'], metrics['silhouette'], metrics['davies_bouldin'],
+                              metrics['silhouette_ci'], metrics['silhouette_sample_size'])
+
+
+# Función para realizar el agrupamiento K-Medoids y almacenar en la base de datos
+# metrics_mode ('exact', 'sampled' o 'auto') indica cómo se calcula la silueta; en los modos con
+# muestra se usan sample_size puntos elegidos por estratos de clúster.
+# mode='pam' usa KMedoids de sklearn_extra (matriz de distancias n x n); mode='clara' usa
+# ClaraKMedoids para índices grandes, con clara_samples submuestras de clara_sample_size puntos
+# resueltas en processes procesos con threads hilos cada uno.
+def kmedoids_clustering_to_db(index, dbname, user='postgres', password='postgres', host='localhost', port='5432', k=3, load_method='fetch', use_cache=False,
+                              metrics_mode='auto', sample_size=10000, mode='pam', clara_samples=5, clara_sample_size=None,
+                              processes=None, threads=1):
+    if mode not in ('pam', 'clara'):
+        raise ValueError(f"Modo de K-Medoids desconocido: {mode}")
 
-    insert_clustering_metrics(conn, index, inertia, silhouette, davies_bouldin)
+    # Conectar a la base de datos
+    conn = connect_to_db(dbname, user, password, host, port)
+
+    # Cargar los datos desde la base de datos
+    data, points = load_data_from_db(conn, index, load_method, use_cache)
+
+    # Agrupar y guardar los resultados
+    kmedoids_clustering_on_data(conn, index, data, points, k, metrics_mode, sample_size, mode, clara_samples,
+                                clara_sample_size, processes, threads)
 
     # Cerrar la conexión
     conn.close()
@@ -150,6 +141,31 @@ def kmedoids_clustering_to_db(index, dbname, user='postgres', password='postgres
     print(f"Datos de agrupamiento K-Medoids insertados en la base de datos: '{dbname}'")
 
 
+# Función para entrenar K-Medoids para cada k de k_values en paralelo y almacenar en la base de datos
+# las métricas de todos los k. Las asignaciones y métricas completas solo se guardan para los k
+# de select (por defecto, el de mayor silueta). processes es el número de procesos (por defecto,
+# uno por núcleo) y threads los hilos de BLAS/OpenMP de cada proceso.
+def kmedoids_sweep_to_db(index, dbname, user='postgres', password='postgres', host='localhost', port='5432', k_values=range(2, 11),
+                         select=None, processes=None, threads=1, load_method='fetch', use_cache=False, metrics_mode='auto', sample_size=10000):
+    conn = connect_to_db(dbname, user, password, host, port)
+    data, points = load_data_from_db(conn, index, load_method, use_cache)
+
+    # Entrenar todos los k en paralelo sobre la matriz compartida
+    results = sweep_k_values(data, k_values, 'KMedoids', processes, threads, metrics_mode, sample_size)
+    insert_sweep_metrics(conn, index, 'KMedoids', results)
+
+    # Guardar las asignaciones completas de los k elegidos, igual que kmedoids_clustering_to_db
+    for result in select_results(results, select):
+        metrics = result['metrics']
+        cluster_ids = insert_cluster_data(conn, index, result['labels'], result['cluster_metrics'])
+        insert_point_cluster_data(conn, index, points, result['labels'], cluster_ids, result['medoid_indices'])
+        insert_clustering_metrics(conn, index, metrics['inertia'], metrics['silhouette'], metrics['davies_bouldin'],
+                                  metrics['silhouette_ci'], metrics['silhouette_sample_size'])
+
+    conn.close()
+    print(f"Barrido de K-Medoids ({len(results)} valores de k) insertado en la base de datos: '{dbname}'")
+
+
 # Ejemplo de uso
 if __name__ == "__main__":
     index = 4  # Índice de la base de datos a analizar
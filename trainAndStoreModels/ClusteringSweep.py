@@ -0,0 +1,71 @@
+import numpy as np
+from sklearn.cluster import KMeans
+from BulkWriter import write_rows
+from ClusterMetrics import clustering_metrics
+from SharedMatrix import map_shared, get_worker_matrix
+
+# Barrido de varios valores de k para K-Means y K-Medoids.
+# Cada k se entrena en un proceso distinto del pool de SharedMatrix, que comparte la matriz del
+# índice en memoria compartida. Las métricas de cada k (curva del codo, silueta y Davies-Bouldin)
+# se guardan en grafana_ml_model_clustering_sweep; las asignaciones completas solo se guardan
+# para los k elegidos (lo hace cada script de agrupamiento).
+
+ALGORITHMS = ('KMeans', 'KMedoids')
+
+
+# Tarea del pool: entrenar el modelo para un k sobre la matriz compartida y calcular sus métricas.
+# Devuelve un diccionario con k, las etiquetas, los centros y las métricas por clúster y globales.
+def fit_for_k(task):
+    algorithm, k, metrics_mode, sample_size = task
+    data = get_worker_matrix()
+
+    if algorithm == 'KMeans':
+        model = KMeans(n_clusters=k, random_state=42, n_init='auto')
+        labels = model.fit_predict(data)
+        centers = model.cluster_centers_
+        medoid_indices = None
+    else:
+        from sklearn_extra.cluster import KMedoids  # Solo necesario para K-Medoids
+        model = KMedoids(n_clusters=k, random_state=42)
+        labels = model.fit_predict(data)
+        medoid_indices = model.medoid_indices_
+        centers = data[medoid_indices]
+
+    cluster_metrics, metrics = clustering_metrics(data, labels, centers, squared=algorithm == 'KMeans',
+                                                  mode=metrics_mode, sample_size=sample_size)
+    return {
+        'k': k,
+        'labels': labels,
+        'centers': np.array(centers),
+        'medoid_indices': medoid_indices,
+        'cluster_metrics': cluster_metrics,
+        'metrics': metrics,
+    }
+
+
+# Función para entrenar todos los k de k_values en paralelo (processes procesos con threads hilos
+# de BLAS/OpenMP cada uno). Devuelve los resultados de fit_for_k en el orden de k_values.
+def sweep_k_values(data, k_values, algorithm='KMeans', processes=None, threads=1, metrics_mode='auto',
+                   sample_size=10000):
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Algoritmo desconocido: {algorithm}")
+    tasks = [(algorithm, int(k), metrics_mode, sample_size) for k in k_values]
+    return map_shared(data, fit_for_k, tasks, processes, threads)
+
+
+# Función para elegir los k cuyas asignaciones se guardan: los indicados en select o, si no se
+# indica ninguno, el de mayor silueta.
+def select_results(results, select=None):
+    if select is not None:
+        selected = set(select)
+        return [result for result in results if result['k'] in selected]
+    valid = [result for result in results if not np.isnan(result['metrics']['silhouette'])]
+    return [max(valid or results, key=lambda result: result['metrics']['silhouette'])]
+
+
+# Insertar las métricas de cada k en la tabla grafana_ml_model_clustering_sweep
+def insert_sweep_metrics(conn, index, algorithm, results):
+    rows = [(index, algorithm, result['k'], result['metrics']['inertia'], result['metrics']['silhouette'],
+             result['metrics']['davies_bouldin']) for result in results]
+    write_rows(conn, 'grafana_ml_model_clustering_sweep',
+               ('index', 'type', 'k', 'inertia', 'silhoutte_coefficient', 'davies_bouldin_index'), rows)
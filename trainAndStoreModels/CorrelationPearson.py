@@ -1,6 +1,12 @@
 import numpy as np
 import psycopg2
-import scipy.stats as stats  # Importamos la biblioteca scipy.stats
+from DataLoader import load_index_matrix, load_features, iter_index_blocks, presence_mask
+from MatrixCache import load_index_matrix_cached
+from BulkWriter import write_rows, copy_rows
+from DatasetIngest import run_in_transaction
+from MomentStore import save_moments, update_moments, moments_incremental
+from CorrelationTiles import tiled_correlation_pairs
+from CorrelationEngine import correlation_pairs, correlation_p_values, upper_triangle_pairs
 
 # Función para conectar a la base de datos
 def connect_to_db(dbname, user='postgres', password='postgres', host='localhost', port='5432'):
@@ -19,88 +25,126 @@ def connect_to_db(dbname, user='postgres', password='postgres', host='localhost'
         return None
 
 # Función para cargar los datos de la base de datos
-def load_data_from_db(conn, index):
-    cur = conn.cursor()
-
-    # Cargar los valores de las características de los puntos
-    cur.execute("""
-        SELECT id_point, id_feature, value
-        FROM grafana_ml_model_point_value
-        WHERE index = %s
-    """, (index,))
-    values = cur.fetchall()  # Los valores de características (id_point, id_feature, value)
-
-    # Organizar los datos en un formato adecuado
-    point_ids = set(v[0] for v in values)  # Extraer los id de los puntos
-    feature_ids = set(v[1] for v in values)  # Extraer los id de las características
-    
-    num_points = len(point_ids)  # El número de puntos únicos
-    num_features = len(feature_ids)  # El número de características únicas
-    
-    data = np.zeros((num_points, num_features))  # Matriz de datos de características
-    feature_ids_map = {}  # Diccionario para almacenar los ids de las características
-
-    # Crear un mapeo de id_point y id_feature a índices
-    point_index_map = {pid: idx for idx, pid in enumerate(sorted(point_ids))}
-    feature_index_map = {fid: idx for idx, fid in enumerate(sorted(feature_ids))}
-
-    # Llenar la matriz de datos con los valores
-    for v in values:
-        point_index = point_index_map[v[0]]  # Mapear el id_point a un índice
-        feature_index = feature_index_map[v[1]]  # Mapear el id_feature a un índice
-        data[point_index, feature_index] = v[2]  # Asignar el valor al lugar adecuado
-        feature_ids_map[feature_index] = v[1]  # Asociar el índice con el id de la característica
-
-    # Cargar los nombres de las características
-    cur.execute("""
-        SELECT id, name
-        FROM grafana_ml_model_feature
-        WHERE index = %s
-    """, (index,))
-    feature_names = {row[0]: row[1] for row in cur.fetchall()}  # Diccionario con id_feature y name
-
-    cur.close()
+def load_data_from_db(conn, index, method='fetch', cache=False):
+    # Cargar las características y la matriz de datos (columnas ordenadas por id de característica)
+    features = load_features(conn, index)
+    load_matrix = load_index_matrix_cached if cache else load_index_matrix  # Caché local opcional
+    # Las celdas sin valor quedan a NaN: cada par de características usa solo los puntos con ambas
+    data, point_ids, feature_ids = load_matrix(conn, index, features=features, method=method, fill_value=np.nan)
+    feature_ids_map = {i: int(feature_id) for i, feature_id in enumerate(feature_ids)}  # Índice de columna -> id
+    feature_names = {feature[0]: feature[1] for feature in features}  # Diccionario con id_feature y name
+
     return data, feature_names, feature_ids_map
 
-# Función para calcular la correlación de Pearson utilizando scipy
+# Función para calcular la correlación de Pearson (y su p-valor) de todos los pares de características
+# con un único producto de matrices sobre las columnas estandarizadas
 def pearson_correlation(data):
-    num_features = data.shape[1]
-    correlations = []
-    
-    for i in range(num_features):
-        for j in range(i + 1, num_features):  # No repetir correlaciones (i, j) y (j, i)
-            corr, _ = stats.pearsonr(data[:, i], data[:, j])  # Calcula la correlación de Pearson
-            correlations.append((i + 1, j + 1, corr))  # Almacenamos los índices y el valor de la correlación
-    
-    return correlations
+    return correlation_pairs(data, 'pearson')
+
+# Función para convertir la matriz de co-momentos de n puntos en pares de correlaciones de Pearson
+def pearson_from_moments(n, comoment):
+    # r_ij = C_ij / sqrt(C_ii * C_jj)
+    deviations = np.sqrt(np.diag(comoment))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        matrix = comoment / np.outer(deviations, deviations)
+
+    matrix = np.clip(matrix, -1.0, 1.0)
+    return upper_triangle_pairs(matrix, correlation_p_values(matrix, n))
+
+
+# Función para calcular la correlación de Pearson recorriendo el índice por bloques.
+# Solo guarda en memoria un bloque y la matriz de co-momentos (características x características).
+# Los co-momentos se acumulan sobre los puntos completos: los que no tienen valor para alguna
+# característica se descartan (listwise), en lugar de contar sus huecos como ceros.
+def pearson_correlation_streaming(conn, index, block_size=10000, features=None):
+    n, mean, comoment = 0, 0.0, 0.0
+    for point_ids, block in iter_index_blocks(conn, index, block_size=block_size, features=features,
+                                              fill_value=np.nan):
+        block = block[presence_mask(block).all(axis=1)]
+        if len(block) > 0:
+            n, mean, comoment = update_moments(n, mean, comoment, block)
+    return pearson_from_moments(n, comoment)
+
+
+# Función para refrescar las correlaciones de Pearson de un índice con sus estadísticos
+# suficientes: en una sola transacción se guardan los estadísticos actualizados y se sustituyen
+# las filas de tipo 'pearson' del índice por las nuevas
+def pearson_correlation_incremental(conn, index, block_size=10000, full_refresh=False):
+    features = load_features(conn, index)
+    feature_ids = [feature[0] for feature in features]
+    n, mean, comoment, last_id_point = moments_incremental(conn, index, 'pearson', features, block_size,
+                                                           full_refresh)
+    if n == 0:
+        return 0
+    correlations = pearson_from_moments(n, comoment)
+
+    def refresh():
+        save_moments(conn, index, 'pearson', feature_ids, n, mean, comoment, last_id_point)
+        cur = conn.cursor()
+        cur.execute("DELETE FROM grafana_ml_model_correlation WHERE index = %s AND type = 'pearson'", (index,))
+        cur.close()
+        copy_rows(conn, 'grafana_ml_model_correlation', ('index', 'id_feature1', 'id_feature2', 'value', 'p_value', 'type'),
+                  correlation_rows(index, correlations, feature_ids))
+
+    run_in_transaction(conn, refresh)
+    return n
+
+# Función para convertir los pares (columna1 + 1, columna2 + 1, correlación, p-valor) en filas de
+# grafana_ml_model_correlation. Las filas se generan a medida que COPY las consume
+# (correlations puede ser un generador).
+def correlation_rows(index, correlations, feature_ids):
+    return ((index, feature_ids[feature1 - 1], feature_ids[feature2 - 1], corr_value, p_value, 'pearson')
+            for feature1, feature2, corr_value, p_value in correlations)
 
 # Función para insertar la correlación de Pearson en la base de datos
 def insert_pearson_correlation(conn, index, correlations, feature_ids):
-    cur = conn.cursor()
-    for feature1, feature2, corr_value in correlations:
-        id_feature1 = feature_ids[feature1 - 1]  # Obtener el ID de la primera característica
-        id_feature2 = feature_ids[feature2 - 1]  # Obtener el ID de la segunda característica
-        cur.execute("""
-            INSERT INTO grafana_ml_model_correlation (index, id_feature1, id_feature2, value, type)
-            VALUES (%s, %s, %s, %s, 'pearson')
-        """, (index, id_feature1, id_feature2, corr_value))
-    
-    conn.commit()
-    cur.close()
+    write_rows(conn, 'grafana_ml_model_correlation', ('index', 'id_feature1', 'id_feature2', 'value', 'p_value', 'type'),
+               correlation_rows(index, correlations, feature_ids))
+
+# Función para calcular y almacenar las correlaciones de Pearson de una matriz ya cargada (la de
+# load_data_from_db, con NaN en las celdas sin valor). No modifica data.
+def pearson_correlation_on_data(conn, index, data, feature_ids, min_abs=None, top_k=None, tile_size=1000,
+                                processes=None, threads=1):
+    if min_abs is not None or top_k is not None:
+        correlations = tiled_correlation_pairs(data, 'pearson', min_abs, top_k, tile_size, processes, threads)
+    else:
+        correlations = pearson_correlation(data)
+    insert_pearson_correlation(conn, index, correlations, feature_ids)
 
 # Función para calcular y almacenar las correlaciones de Pearson en la base de datos
-def pearson_correlation_to_db(index, dbname, user='postgres', password='postgres', host='localhost', port='5432'):
+# Con streaming=True el índice se procesa por bloques sin cargarlo entero en memoria.
+# Con min_abs y/o top_k la matriz se calcula por bloques en paralelo (ver CorrelationTiles) y solo
+# se guardan los pares con |r| >= min_abs o los top_k de cada característica.
+# Con incremental=True se actualizan los estadísticos suficientes guardados del índice con los
+# puntos nuevos y se sustituyen sus correlaciones (full_refresh=True los recalcula desde cero).
+def pearson_correlation_to_db(index, dbname, user='postgres', password='postgres', host='localhost', port='5432', load_method='fetch', use_cache=False,
+                              streaming=False, block_size=10000, min_abs=None, top_k=None, tile_size=1000, processes=None, threads=1,
+                              incremental=False, full_refresh=False):
+    if (streaming or incremental) and (min_abs is not None or top_k is not None):
+        raise ValueError("El filtrado por min_abs o top_k no está disponible con streaming o incremental")
+
     # Conectar a la base de datos
     conn = connect_to_db(dbname, user, password, host, port)
-    
-    # Cargar los datos desde la base de datos
-    data, feature_names, feature_ids = load_data_from_db(conn, index)
-    
-    # Calcular las correlaciones de Pearson
-    correlations = pearson_correlation(data)
-    
-    # Insertar las correlaciones en la base de datos
-    insert_pearson_correlation(conn, index, correlations, feature_ids)
+
+    if incremental:
+        # Actualizar los estadísticos con los puntos nuevos y sustituir las correlaciones
+        n = pearson_correlation_incremental(conn, index, block_size, full_refresh)
+        conn.close()
+        print(f"Correlaciones de Pearson actualizadas con {n} puntos en la base de datos: '{dbname}'")
+        return
+
+    if streaming:
+        # Calcular las correlaciones de Pearson por bloques
+        features = load_features(conn, index)
+        feature_ids = {i: feature[0] for i, feature in enumerate(features)}  # Índice de columna -> id
+        correlations = pearson_correlation_streaming(conn, index, block_size, features)
+        insert_pearson_correlation(conn, index, correlations, feature_ids)
+    else:
+        # Cargar los datos desde la base de datos
+        data, feature_names, feature_ids = load_data_from_db(conn, index, load_method, use_cache)
+
+        # Calcular las correlaciones de Pearson e insertarlas en la base de datos
+        pearson_correlation_on_data(conn, index, data, feature_ids, min_abs, top_k, tile_size, processes, threads)
     
     # Cerrar la conexión
     conn.close()
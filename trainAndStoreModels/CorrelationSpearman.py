@@ -1,6 +1,10 @@
 import numpy as np
 import psycopg2
-import scipy.stats as stats  # Importamos la biblioteca scipy.stats
+from DataLoader import load_index_matrix, load_features
+from MatrixCache import load_index_matrix_cached
+from BulkWriter import write_rows
+from CorrelationTiles import tiled_correlation_pairs
+from CorrelationEngine import correlation_pairs
 
 # Función para conectar a la base de datos
 def connect_to_db(dbname, user='postgres', password='postgres', host='localhost', port='5432'):
@@ -19,87 +23,54 @@ def connect_to_db(dbname, user='postgres', password='postgres', host='localhost'
         return None
 
 # Función para cargar los datos de la base de datos
-def load_data_from_db(conn, index):
-    cur = conn.cursor()
+def load_data_from_db(conn, index, method='fetch', cache=False):
+    # Cargar las características y la matriz de datos (columnas ordenadas por id de característica)
+    features = load_features(conn, index)
+    load_matrix = load_index_matrix_cached if cache else load_index_matrix  # Caché local opcional
+    # Las celdas sin valor quedan a NaN: cada par de características usa solo los puntos con ambas,
+    # pero con los rangos de cada columna sobre todos sus valores (aproximado, ver CorrelationEngine)
+    data, point_ids, feature_ids = load_matrix(conn, index, features=features, method=method, fill_value=np.nan)
+    feature_ids_map = {i: int(feature_id) for i, feature_id in enumerate(feature_ids)}  # Índice de columna -> id
+    feature_names = {feature[0]: feature[1] for feature in features}  # Diccionario con id_feature y name
 
-    # Cargar los valores de las características de los puntos
-    cur.execute("""
-        SELECT id_point, id_feature, value
-        FROM grafana_ml_model_point_value
-        WHERE index = %s
-    """, (index,))
-    values = cur.fetchall()  # Los valores de características (id_point, id_feature, value)
-
-    # Organizar los datos en un formato adecuado
-    point_ids = set(v[0] for v in values)  # Extraer los id de los puntos
-    feature_ids = set(v[1] for v in values)  # Extraer los id de las características
-    
-    num_points = len(point_ids)  # El número de puntos únicos
-    num_features = len(feature_ids)  # El número de características únicas
-    
-    data = np.zeros((num_points, num_features))  # Matriz de datos de características
-    feature_ids_map = {}  # Diccionario para almacenar los ids de las características
-
-    # Crear un mapeo de id_point y id_feature a índices
-    point_index_map = {pid: idx for idx, pid in enumerate(sorted(point_ids))}
-    feature_index_map = {fid: idx for idx, fid in enumerate(sorted(feature_ids))}
-
-    # Llenar la matriz de datos con los valores
-    for v in values:
-        point_index = point_index_map[v[0]]  # Mapear el id_point a un índice
-        feature_index = feature_index_map[v[1]]  # Mapear el id_feature a un índice
-        data[point_index, feature_index] = v[2]  # Asignar el valor al lugar adecuado
-        feature_ids_map[feature_index] = v[1]  # Asociar el índice con el id de la característica
-
-    # Cargar los nombres de las características
-    cur.execute("""
-        SELECT id, name
-        FROM grafana_ml_model_feature
-        WHERE index = %s
-    """, (index,))
-    feature_names = {row[0]: row[1] for row in cur.fetchall()}  # Diccionario con id_feature y name
-
-    cur.close()
     return data, feature_names, feature_ids_map
-# Función para calcular la correlación de Spearman utilizando scipy
+
+# Función para calcular la correlación de Spearman (y su p-valor) de todos los pares de características:
+# cada columna se ordena por rangos una sola vez y la matriz sale de un único producto de matrices
 def spearman_correlation(data):
-    num_features = data.shape[1]
-    correlations = []
-    
-    for i in range(num_features):
-        for j in range(i + 1, num_features):  # No repetir correlaciones (i, j) y (j, i)
-            corr, _ = stats.spearmanr(data[:, i], data[:, j])  # Calcula la correlación de Spearman
-            correlations.append((i + 1, j + 1, corr))  # Almacenamos los índices y el valor de la correlación
-    
-    return correlations
+    return correlation_pairs(data, 'spearman')
 
 # Función para insertar la correlación de Spearman en la base de datos
 def insert_spearman_correlation(conn, index, correlations, feature_ids):
-    cur = conn.cursor()
-    for feature1, feature2, corr_value in correlations:
-        id_feature1 = feature_ids[feature1 - 1]  # Obtener el ID de la primera característica
-        id_feature2 = feature_ids[feature2 - 1]  # Obtener el ID de la segunda característica
-        cur.execute("""
-            INSERT INTO grafana_ml_model_correlation (index, id_feature1, id_feature2, value, type)
-            VALUES (%s, %s, %s, %s, 'spearman')
-        """, (index, id_feature1, id_feature2, corr_value))
-    
-    conn.commit()
-    cur.close()
+    # Las filas se generan a medida que COPY las consume (correlations puede ser un generador)
+    rows = ((index, feature_ids[feature1 - 1], feature_ids[feature2 - 1], corr_value, p_value, 'spearman')
+            for feature1, feature2, corr_value, p_value in correlations)
+
+    write_rows(conn, 'grafana_ml_model_correlation', ('index', 'id_feature1', 'id_feature2', 'value', 'p_value', 'type'), rows)
+
+# Función para calcular y almacenar las correlaciones de Spearman de una matriz ya cargada (la de
+# load_data_from_db, con NaN en las celdas sin valor). No modifica data.
+def spearman_correlation_on_data(conn, index, data, feature_ids, min_abs=None, top_k=None, tile_size=1000,
+                                 processes=None, threads=1):
+    if min_abs is not None or top_k is not None:
+        correlations = tiled_correlation_pairs(data, 'spearman', min_abs, top_k, tile_size, processes, threads)
+    else:
+        correlations = spearman_correlation(data)
+    insert_spearman_correlation(conn, index, correlations, feature_ids)
 
 # Función para calcular y almacenar las correlaciones de Spearman en la base de datos
-def spearman_correlation_to_db(index, dbname, user='postgres', password='postgres', host='localhost', port='5432'):
+# Con min_abs y/o top_k la matriz se calcula por bloques en paralelo (ver CorrelationTiles) y solo
+# se guardan los pares con |r| >= min_abs o los top_k de cada característica.
+def spearman_correlation_to_db(index, dbname, user='postgres', password='postgres', host='localhost', port='5432', load_method='fetch', use_cache=False,
+                               min_abs=None, top_k=None, tile_size=1000, processes=None, threads=1):
     # Conectar a la base de datos
     conn = connect_to_db(dbname, user, password, host, port)
     
     # Cargar los datos desde la base de datos
-    data, feature_names, feature_ids = load_data_from_db(conn, index)
+    data, feature_names, feature_ids = load_data_from_db(conn, index, load_method, use_cache)
     
-    # Calcular las correlaciones de Spearman
-    correlations = spearman_correlation(data)
-    
-    # Insertar las correlaciones en la base de datos
-    insert_spearman_correlation(conn, index, correlations, feature_ids)
+    # Calcular las correlaciones de Spearman e insertarlas en la base de datos
+    spearman_correlation_on_data(conn, index, data, feature_ids, min_abs, top_k, tile_size, processes, threads)
     
     # Cerrar la conexión
     conn.close()
@@ -0,0 +1,169 @@
+import numpy as np
+from scipy import stats
+from CorrelationEngine import (standardize_columns, correlation_p_values, masked_columns, masked_pearson_block,
+                               rank_columns)
+from SharedMatrix import imap_shared, get_worker_matrix
+
+# Correlación por bloques (tiles) para índices con miles de características.
+# Con F características la matriz completa tiene F²/2 pares, demasiados para guardarlos (y para
+# el heatmap de Grafana). Aquí las columnas se estandarizan una sola vez (sobre los rangos en
+# Spearman) y la matriz se copia a memoria compartida; cada proceso del pool de SharedMatrix
+# calcula un bloque tile_size x tile_size del triángulo superior con un producto de matrices y
+# devuelve solo los pares interesantes:
+#   - min_abs: pares con |r| >= min_abs, que se van escribiendo a medida que llegan los bloques;
+#   - top_k: los top_k pares de mayor |r| de cada característica (un par se guarda si está entre
+#     los top_k de cualquiera de sus dos características). Cada bloque devuelve sus candidatos
+#     por fila y por columna y se combinan en una tabla F x top_k, que se escribe al final.
+# Si se indican los dos, los top_k se eligen entre los pares con |r| >= min_abs.
+# Con valores ausentes (NaN) se comparten las columnas centradas junto a la máscara de presencia
+# y cada bloque calcula las correlaciones pairwise-complete (ver CorrelationEngine; en Spearman
+# son aproximadas porque los rangos son los de cada columna, no los de los puntos comunes).
+
+
+# Función para preparar la matriz que se comparte: columnas estandarizadas (Pearson) o rangos
+# estandarizados (Spearman), de forma que cada bloque de correlaciones es Z_i' Z_j. Si hay
+# valores ausentes se devuelven las columnas centradas seguidas de la máscara (2F columnas).
+# Devuelve la matriz y si tiene máscara.
+def prepare_matrix(data, method='pearson'):
+    if method not in ('pearson', 'spearman'):
+        raise ValueError(f"Tipo de correlación desconocido: {method}")
+    if np.isnan(data).any():
+        centered, mask = masked_columns(rank_columns(data) if method == 'spearman' else data)
+        return np.hstack([centered, mask]), True
+    if method == 'spearman':
+        data = stats.rankdata(data, axis=0)
+    return standardize_columns(data), False
+
+
+# Función para generar los bloques del triángulo superior como tareas
+# (inicio y fin de las filas, inicio y fin de las columnas, min_abs, top_k, con máscara)
+def tile_tasks(n_features, tile_size=1000, min_abs=None, top_k=None, masked=False):
+    starts = range(0, n_features, tile_size)
+    return [(i, min(i + tile_size, n_features), j, min(j + tile_size, n_features), min_abs, top_k, masked)
+            for i in starts for j in starts if j >= i]
+
+
+# Función para elegir los k candidatos de mayor |r| de cada fila de un bloque. Devuelve las
+# columnas elegidas, sus correlaciones (NaN en los huecos, si la fila tiene menos candidatos)
+# y el número de puntos de cada par.
+def top_candidates(scores, block, counts, k):
+    k = min(k, scores.shape[1])
+    columns = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    values = np.take_along_axis(block, columns, axis=1)
+    values[np.take_along_axis(scores, columns, axis=1) < 0] = np.nan
+    return columns, values, np.take_along_axis(counts, columns, axis=1)
+
+
+# Función para calcular un bloque de correlaciones y quedarse con los pares interesantes.
+# Con top_k devuelve ('top', candidatos por fila, candidatos por columna); si no, ('pairs', filas,
+# columnas, correlaciones, puntos de cada par) con los pares que superan min_abs.
+def correlation_tile(data, task):
+    i0, i1, j0, j1, min_abs, top_k, masked = task
+    diagonal = i0 == j0
+    if masked:
+        n_features = data.shape[1] // 2
+        block, counts = masked_pearson_block(data[:, i0:i1], data[:, n_features + i0:n_features + i1],
+                                             data[:, j0:j1], data[:, n_features + j0:n_features + j1])
+    else:
+        with np.errstate(invalid='ignore'):
+            block = np.clip(data[:, i0:i1].T @ data[:, j0:j1], -1.0, 1.0)
+        counts = np.full(block.shape, float(len(data)))
+    with np.errstate(invalid='ignore'):
+        scores = np.nan_to_num(np.abs(block), nan=-1.0)
+    if min_abs is not None:
+        scores[scores < min_abs] = -1.0
+
+    if top_k is None:
+        if diagonal:
+            scores[np.tril_indices(i1 - i0)] = -1.0  # Solo el triángulo superior, sin la diagonal
+        rows, columns = np.nonzero(scores >= 0)
+        return 'pairs', rows + i0, columns + j0, block[rows, columns], counts[rows, columns]
+
+    # En un bloque de la diagonal la matriz es simétrica: basta con los candidatos por fila
+    if diagonal:
+        np.fill_diagonal(scores, -1.0)
+    row_columns, row_values, row_counts = top_candidates(scores, block, counts, top_k)
+    by_row = (i0, row_columns + j0, row_values, row_counts)
+    by_column = None
+    if not diagonal:
+        column_rows, column_values, column_counts = top_candidates(scores.T, block.T, counts.T, top_k)
+        by_column = (j0, column_rows + i0, column_values, column_counts)
+    return 'top', by_row, by_column
+
+
+# Tarea del pool de SharedMatrix: calcular un bloque sobre la matriz compartida
+def correlation_tile_task(task):
+    return correlation_tile(get_worker_matrix(), task)
+
+
+# Función para combinar los candidatos de un bloque (features desde start) con los mejores
+# encontrados hasta ahora para esas características (tablas F x top_k de otras, valores y
+# número de puntos de cada par)
+def merge_top_k(best_others, best_values, best_counts, start, others, values, counts):
+    stop = start + len(others)
+    others = np.concatenate([best_others[start:stop], others], axis=1)
+    values = np.concatenate([best_values[start:stop], values], axis=1)
+    counts = np.concatenate([best_counts[start:stop], counts], axis=1)
+    order = np.argsort(-np.nan_to_num(np.abs(values), nan=-1.0), axis=1, kind='stable')
+    order = order[:, :best_others.shape[1]]
+    best_others[start:stop] = np.take_along_axis(others, order, axis=1)
+    best_values[start:stop] = np.take_along_axis(values, order, axis=1)
+    best_counts[start:stop] = np.take_along_axis(counts, order, axis=1)
+
+
+# Función para convertir la tabla de los top_k de cada característica en pares únicos
+# (columna1 < columna2), sin repetir los que están entre los top_k de las dos características
+def top_k_pairs(best_others, best_values, best_counts):
+    n_features = len(best_others)
+    features = np.repeat(np.arange(n_features), best_others.shape[1])
+    others = best_others.ravel()
+    values = best_values.ravel()
+    valid = ~np.isnan(values)
+    first = np.minimum(features, others)[valid]
+    second = np.maximum(features, others)[valid]
+    _, unique = np.unique(first * n_features + second, return_index=True)
+    return first[unique], second[unique], values[valid][unique], best_counts.ravel()[valid][unique]
+
+
+# Función para añadir los p-valores (con el número de puntos de cada par) a unos pares y
+# devolverlos como tuplas (columna1 + 1, columna2 + 1, correlación, p-valor)
+def format_pairs(first, second, values, counts):
+    p_values = correlation_p_values(values, counts)
+    return zip((first + 1).tolist(), (second + 1).tolist(), values.tolist(), p_values.tolist())
+
+
+# Función principal: correlaciones ('pearson' o 'spearman') filtradas por bloques en paralelo
+# (processes procesos con threads hilos de BLAS/OpenMP cada uno). Es un generador de tuplas
+# (columna1 + 1, columna2 + 1, correlación, p-valor), el formato de los scripts de correlación,
+# así que las filas se pueden escribir en la base de datos a medida que se calculan.
+def tiled_correlation_pairs(data, method='pearson', min_abs=None, top_k=None, tile_size=1000,
+                            processes=None, threads=1):
+    if min_abs is None and top_k is None:
+        raise ValueError("Hay que indicar min_abs, top_k o ambos")
+    n_features = np.shape(data)[1]
+    matrix, masked = prepare_matrix(data, method)
+    tasks = tile_tasks(n_features, tile_size, min_abs, top_k, masked)
+
+    # Con un solo proceso (o un solo bloque) no hace falta el pool
+    if processes == 1 or len(tasks) == 1:
+        results = (correlation_tile(matrix, task) for task in tasks)
+    else:
+        results = imap_shared(matrix, correlation_tile_task, tasks, processes, threads)
+
+    if top_k is not None:
+        best_others = np.zeros((n_features, top_k), dtype=np.int64)
+        best_values = np.full((n_features, top_k), np.nan)
+        best_counts = np.zeros((n_features, top_k))
+
+    # Los pares que superan min_abs se devuelven bloque a bloque; los candidatos de top_k se
+    # combinan y los pares se devuelven al terminar todos los bloques
+    for result in results:
+        if result[0] == 'pairs':
+            yield from format_pairs(*result[1:])
+        else:
+            for candidates in result[1:]:
+                if candidates is not None:
+                    merge_top_k(best_others, best_values, best_counts, *candidates)
+
+    if top_k is not None:
+        yield from format_pairs(*top_k_pairs(best_others, best_values, best_counts))
@@ -0,0 +1,296 @@
+import struct
+import numpy as np
+
+# Módulo compartido para cargar un índice desde la base de datos como matriz densa.
+# Los valores se guardan en formato EAV (id_point, id_feature, value) en la tabla
+# grafana_ml_model_point_value; aquí se pivotan a una matriz puntos x características
+# ordenada por id de punto (filas) y por id de característica (columnas).
+# Las celdas sin valor se rellenan con fill_value: 0.0 por defecto (agrupamiento) o NaN para
+# los análisis que tratan los valores ausentes (correlación y regresión); en ese caso
+# presence_mask da el mapa de presencia de cada celda.
+
+
+# Función para cargar los puntos de un índice ordenados por id
+def load_points(conn, index):
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT id, name
+        FROM grafana_ml_model_point
+        WHERE index = %s
+        ORDER BY id
+    """, (index,))
+    points = cur.fetchall()  # Los IDs y nombres de los puntos
+    cur.close()
+    return points
+
+
+# Función para cargar las características de un índice ordenadas por id
+def load_features(conn, index):
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT id, name
+        FROM grafana_ml_model_feature
+        WHERE index = %s
+        ORDER BY id
+    """, (index,))
+    features = cur.fetchall()  # Los IDs y nombres de las características
+    cur.close()
+    return features
+
+
+# Función para convertir ids a posiciones dentro de un vector ordenado de ids.
+# Devuelve las posiciones y una máscara con los ids que existen en el vector.
+def ids_to_positions(sorted_ids, ids):
+    # Los ids SERIAL de un índice suelen ser casi consecutivos: en ese caso una tabla
+    # de búsqueda directa es O(1) por valor y evita la búsqueda binaria
+    if len(sorted_ids) > 0 and sorted_ids[-1] - sorted_ids[0] < 4 * len(sorted_ids):
+        offset = sorted_ids[0]
+        lookup = np.full(sorted_ids[-1] - offset + 1, -1, dtype=np.int64)
+        lookup[sorted_ids - offset] = np.arange(len(sorted_ids))
+        inside = (ids >= offset) & (ids <= sorted_ids[-1])
+        positions = np.full(len(ids), -1, dtype=np.int64)
+        positions[inside] = lookup[ids[inside] - offset]
+        found = positions >= 0
+        return np.maximum(positions, 0), found
+
+    positions = np.searchsorted(sorted_ids, ids)
+    positions = np.minimum(positions, max(len(sorted_ids) - 1, 0))
+    if len(sorted_ids) == 0:
+        return positions, np.zeros(len(ids), dtype=bool)
+    found = sorted_ids[positions] == ids
+    return positions, found
+
+
+# Función para pivotar los valores (id_point, id_feature, value) a una matriz densa.
+# Las filas siguen el orden de point_ids y las columnas el de feature_ids (ambos ordenados).
+# Si no se indican, se usan los ids presentes en los valores. El coste es O(m log m).
+def pivot_point_values(id_points, id_features, values, point_ids=None, feature_ids=None, dtype=np.float64,
+                       fill_value=0.0):
+    id_points = np.asarray(id_points, dtype=np.int64)
+    id_features = np.asarray(id_features, dtype=np.int64)
+    values = np.asarray(values, dtype=dtype)
+
+    if point_ids is None:
+        point_ids = np.unique(id_points)
+    if feature_ids is None:
+        feature_ids = np.unique(id_features)
+    point_ids = np.asarray(point_ids, dtype=np.int64)
+    feature_ids = np.asarray(feature_ids, dtype=np.int64)
+
+    data = np.full((len(point_ids), len(feature_ids)), fill_value, dtype=dtype)
+
+    # Mapear los ids reales a filas y columnas con búsqueda binaria vectorizada
+    rows, rows_found = ids_to_positions(point_ids, id_points)
+    cols, cols_found = ids_to_positions(feature_ids, id_features)
+    valid = rows_found & cols_found  # Se descartan valores de puntos o características desconocidos
+
+    # Asignar todos los valores de una vez (scatter vectorizado)
+    data[rows[valid], cols[valid]] = values[valid]
+    return data, point_ids, feature_ids
+
+
+# Función para obtener el mapa de presencia de una matriz cargada con fill_value=NaN
+# (True donde el punto tiene valor para la característica)
+def presence_mask(data):
+    return ~np.isnan(data)
+
+
+# Función para cargar los valores de un índice como columnas de NumPy
+def fetch_point_values(conn, index):
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT id_point, id_feature, value
+        FROM grafana_ml_model_point_value
+        WHERE index = %s AND value IS NOT NULL
+    """, (index,))
+    values = np.array(cur.fetchall(), dtype=np.float64).reshape(-1, 3)
+    cur.close()
+    return values[:, 0], values[:, 1], values[:, 2]
+
+
+# Formato binario de COPY de PostgreSQL: cabecera fija, filas con el número de campos y
+# cada campo precedido de su longitud (todo en big-endian) y un terminador de 2 bytes.
+COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+COPY_ROW_DTYPE = np.dtype([
+    ('num_fields', '>i2'),
+    ('len_point', '>i4'), ('id_point', '>i4'),
+    ('len_feature', '>i4'), ('id_feature', '>i4'),
+    ('len_value', '>i4'), ('value', '>f8'),
+])
+
+
+# Destino de COPY ... TO STDOUT (FORMAT binary) que decodifica las filas a medida que llegan
+# y las escribe directamente en la matriz preasignada, sin crear tuplas de Python.
+# Solo se mantiene en memoria un búfer de como mucho buffer_size bytes.
+class BinaryCopyDecoder:
+    def __init__(self, data, point_ids, feature_ids, buffer_size=8 * 1024 * 1024):
+        self.data = data
+        self.point_ids = point_ids
+        self.feature_ids = feature_ids
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+        self.header_read = False
+        self.rows = 0
+
+    # psycopg2 llama a write una vez por mensaje CopyData (normalmente una fila)
+    def write(self, chunk):
+        self.buffer += chunk
+        if len(self.buffer) >= self.buffer_size:
+            self.decode()
+
+    def read_header(self):
+        header_size = len(COPY_SIGNATURE) + 8
+        if len(self.buffer) < header_size:
+            return False
+        if bytes(self.buffer[:len(COPY_SIGNATURE)]) != COPY_SIGNATURE:
+            raise ValueError("La salida de COPY no está en formato binario")
+        extension_size = struct.unpack('>i', self.buffer[len(COPY_SIGNATURE) + 4:header_size])[0]
+        if len(self.buffer) < header_size + extension_size:
+            return False
+        del self.buffer[:header_size + extension_size]
+        self.header_read = True
+        return True
+
+    # Decodificar todas las filas completas del búfer y asignarlas a la matriz
+    def decode(self):
+        if not self.header_read and not self.read_header():
+            return
+        num_rows = len(self.buffer) // COPY_ROW_DTYPE.itemsize
+        if num_rows == 0:
+            return
+        rows = np.frombuffer(self.buffer, dtype=COPY_ROW_DTYPE, count=num_rows)
+        if np.any(rows['num_fields'] != 3) or np.any(rows['len_value'] != 8):
+            raise ValueError("Fila inesperada en la salida binaria de COPY")
+
+        point_rows, points_found = ids_to_positions(self.point_ids, rows['id_point'].astype(np.int64))
+        feature_cols, features_found = ids_to_positions(self.feature_ids, rows['id_feature'].astype(np.int64))
+        valid = points_found & features_found
+        self.data[point_rows[valid], feature_cols[valid]] = rows['value'][valid]
+        self.rows += num_rows
+
+        del rows
+        del self.buffer[:num_rows * COPY_ROW_DTYPE.itemsize]
+
+    # Procesar lo que queda en el búfer y comprobar el terminador
+    def close(self):
+        self.decode()
+        # Tras la última fila solo debe quedar el terminador (-1 como entero de 2 bytes)
+        if bytes(self.buffer) != b'\xff\xff':
+            raise ValueError("La salida binaria de COPY está incompleta")
+        self.buffer = bytearray()
+
+
+# Función para cargar los valores de un índice con COPY binario directamente en la matriz
+def copy_point_values(conn, index, data, point_ids, feature_ids):
+    cur = conn.cursor()
+    query = cur.mogrify("""
+        COPY (
+            SELECT id_point, id_feature, value
+            FROM grafana_ml_model_point_value
+            WHERE index = %s AND value IS NOT NULL
+        ) TO STDOUT (FORMAT binary)
+    """, (index,)).decode()
+    decoder = BinaryCopyDecoder(data, point_ids, feature_ids)
+    cur.copy_expert(query, decoder)
+    decoder.close()
+    cur.close()
+    return decoder.rows
+
+
+# Función principal: carga un índice como matriz densa (puntos x características).
+# Devuelve la matriz, los ids de los puntos (filas) y los ids de las características (columnas).
+# Si ya se cargaron los puntos o las características se pueden pasar para no repetir la consulta.
+# Métodos de carga: 'fetch' (SELECT + fetchall) o 'copy' (COPY binario decodificado en streaming,
+# sin tuplas intermedias; recomendado para índices grandes).
+# Las celdas sin valor quedan a fill_value (NaN para distinguirlas de un 0 real).
+def load_index_matrix(conn, index, dtype=np.float64, points=None, features=None, method='fetch', fill_value=0.0):
+    if points is None:
+        points = load_points(conn, index)
+    if features is None:
+        features = load_features(conn, index)
+    point_ids = np.array([point[0] for point in points], dtype=np.int64)
+    feature_ids = np.array([feature[0] for feature in features], dtype=np.int64)
+
+    if method == 'copy':
+        data = np.full((len(point_ids), len(feature_ids)), fill_value, dtype=dtype)
+        copy_point_values(conn, index, data, point_ids, feature_ids)
+        return data, point_ids, feature_ids
+    if method != 'fetch':
+        raise ValueError(f"Método de carga desconocido: {method}")
+
+    id_points, id_features, values = fetch_point_values(conn, index)
+    data, point_ids, feature_ids = pivot_point_values(id_points, id_features, values,
+                                                      point_ids, feature_ids, dtype=dtype, fill_value=fill_value)
+    return data, point_ids, feature_ids
+
+
+# Generador que recorre un índice por bloques de block_size puntos con un cursor con nombre
+# (del lado del servidor), de modo que la memoria usada no depende del tamaño del índice.
+# Cada bloque es (ids de los puntos, matriz block_size x características) en orden de id de punto.
+# Los puntos sin ningún valor no aparecen en los bloques. Con after_point_id solo se recorren los
+# puntos con id mayor (por ejemplo, los añadidos desde la última actualización incremental).
+def iter_index_blocks(conn, index, block_size=10000, dtype=np.float64, features=None, itersize=None,
+                      after_point_id=None, fill_value=0.0):
+    if features is None:
+        features = load_features(conn, index)
+    feature_ids = np.array([feature[0] for feature in features], dtype=np.int64)
+    num_features = max(len(feature_ids), 1)
+    if itersize is None:
+        itersize = block_size * num_features
+
+    # Los cursores con nombre necesitan una transacción abierta. WITH HOLD permite que el
+    # consumidor haga commit de sus escrituras en la misma conexión mientras recorre los bloques.
+    # Si la conexión ya no estaba en autocommit se usa la transacción del llamante, que es quien
+    # hace commit o rollback (por ejemplo, dentro de DatasetIngest.run_in_transaction).
+    autocommit = conn.autocommit
+    if autocommit:
+        conn.autocommit = False
+    cur = conn.cursor(name=f'grafana_ml_model_blocks_{index}', withhold=True)
+    cur.itersize = itersize
+    try:
+        # El orden coincide con la clave primaria (id_point, id_feature), sin ordenación extra
+        cur.execute("""
+            SELECT id_point, id_feature, value
+            FROM grafana_ml_model_point_value
+            WHERE index = %s AND value IS NOT NULL AND id_point > %s
+            ORDER BY id_point, id_feature
+        """, (index, -1 if after_point_id is None else int(after_point_id)))
+
+        pending = np.empty((0, 3))
+        exhausted = False
+        while not exhausted:
+            rows = cur.fetchmany(itersize)
+            exhausted = len(rows) == 0
+            if rows:
+                pending = np.concatenate([pending, np.array(rows, dtype=np.float64)])
+
+            # Emitir bloques completos; el último punto solo se considera completo
+            # cuando ya ha aparecido el siguiente o se han leído todas las filas
+            while len(pending) > 0:
+                id_points = pending[:, 0].astype(np.int64)
+                starts = np.flatnonzero(np.r_[True, id_points[1:] != id_points[:-1]])
+                if len(starts) <= block_size and not exhausted:
+                    break
+                end = starts[block_size] if len(starts) > block_size else len(pending)
+                block = pending[:end]
+                data, point_ids, _ = pivot_point_values(block[:, 0], block[:, 1], block[:, 2],
+                                                        feature_ids=feature_ids, dtype=dtype,
+                                                        fill_value=fill_value)
+                pending = pending[end:]
+                yield point_ids, data
+        cur.close()
+        if autocommit:
+            conn.commit()
+    except Exception:
+        cur.close()
+        if autocommit:
+            conn.rollback()
+        raise
+    finally:
+        # Si el consumidor abandona el generador antes de terminar también se cierra la transacción
+        if not cur.closed:
+            cur.close()
+            if autocommit:
+                conn.commit()
+        if autocommit:
+            conn.autocommit = autocommit
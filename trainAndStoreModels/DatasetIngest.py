@@ -0,0 +1,110 @@
+import numpy as np
+from BulkWriter import copy_rows, copy_arrays
+
+# Módulo compartido para guardar conjuntos de datos nuevos en la base de datos.
+# Los ids SERIAL de puntos y características se reservan en bloque con nextval, de modo que
+# grafana_ml_model_point y grafana_ml_model_point_value se pueden escribir con COPY sin
+# necesitar un INSERT ... RETURNING por fila. Todo se hace en una única transacción.
+
+
+# Función para reservar count ids consecutivos de la secuencia SERIAL de una tabla
+def reserve_ids(conn, table, count, batch_size=100000):
+    cur = conn.cursor()
+    ids = []
+    for start in range(0, count, batch_size):
+        cur.execute("""
+            SELECT nextval(pg_get_serial_sequence(%s, 'id'))
+            FROM generate_series(1, %s)
+        """, (table, min(batch_size, count - start)))
+        ids.append(np.array([row[0] for row in cur.fetchall()], dtype=np.int64))
+    cur.close()
+    if not ids:
+        return np.empty(0, dtype=np.int64)
+    return np.sort(np.concatenate(ids))
+
+
+# Función para crear el índice en grafana_ml_model_index
+def create_index(conn, name, description, creator):
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO grafana_ml_model_index (name, description, creator)
+        VALUES (%s, %s, %s) RETURNING id
+    """, (name, description, creator))
+    index_id = int(cur.fetchone()[0])
+    cur.close()
+    return index_id
+
+
+# Función para crear las características de un índice. Devuelve sus ids en el mismo orden.
+def create_features(conn, index_id, feature_names):
+    feature_ids = reserve_ids(conn, 'grafana_ml_model_feature', len(feature_names))
+    rows = zip([index_id] * len(feature_names), feature_ids.tolist(), [str(name) for name in feature_names])
+    copy_rows(conn, 'grafana_ml_model_feature', ('index', 'id', 'name'), rows)
+    return feature_ids
+
+
+# Función para guardar un bloque de puntos (filas de X) con sus valores.
+# Devuelve los ids de los puntos insertados. Los valores NaN no se guardan (valor ausente).
+def ingest_points(conn, index_id, X, feature_ids, point_names):
+    X = np.asarray(X, dtype=np.float64)
+    num_points, num_features = X.shape
+    if num_features != len(feature_ids):
+        raise ValueError(f"X tiene {num_features} columnas pero hay {len(feature_ids)} características")
+    if len(point_names) != num_points:
+        raise ValueError(f"X tiene {num_points} filas pero hay {len(point_names)} nombres de puntos")
+    point_ids = reserve_ids(conn, 'grafana_ml_model_point', num_points)
+
+    rows = zip([index_id] * num_points, point_ids.tolist(), [str(name) for name in point_names])
+    copy_rows(conn, 'grafana_ml_model_point', ('index', 'id', 'name'), rows)
+
+    # Valores en formato EAV: (index, id_point, id_feature, value) por cada celda de X
+    id_points = np.repeat(point_ids, num_features)
+    id_features = np.tile(np.asarray(feature_ids, dtype=np.int64), num_points)
+    values = X.ravel()
+    present = ~np.isnan(values)
+    copy_arrays(conn, 'grafana_ml_model_point_value', ('index', 'id_point', 'id_feature', 'value'),
+                [np.full(int(present.sum()), index_id), id_points[present], id_features[present], values[present]],
+                types=['int4', 'int4', 'int4', 'float8'])
+    return point_ids
+
+
+# Función para ejecutar una función de ingesta dentro de una única transacción.
+# Si algo falla no queda ningún dato a medias en la base de datos.
+# Con skip_fk_checks=True se desactivan los disparadores de claves foráneas solo durante la
+# transacción (SET LOCAL session_replication_role, requiere superusuario). Es seguro porque los
+# ids se generan aquí mismo, y la comprobación por fila suele ser el cuello de botella de COPY.
+def run_in_transaction(conn, function, skip_fk_checks=False):
+    # Con una conexión de Pipeline (deferred=True) function se ejecuta dentro de la transacción
+    # del runner, que es quien hace commit o rollback al terminar el análisis
+    if getattr(conn, 'deferred', False):
+        return function()
+    autocommit = conn.autocommit
+    conn.autocommit = False
+    try:
+        if skip_fk_checks:
+            cur = conn.cursor()
+            cur.execute("SET LOCAL session_replication_role = replica")
+            cur.close()
+        result = function()
+        conn.commit()
+        return result
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = autocommit
+
+
+# Función principal: guarda un conjunto de datos completo (matriz X con una columna por
+# característica) como un índice nuevo. Devuelve el id del índice creado.
+def ingest_dataset(conn, name, description, creator, X, feature_names, point_names=None, skip_fk_checks=False):
+    if point_names is None:
+        point_names = [f"point_{i}" for i in range(len(X))]
+
+    def ingest():
+        index_id = create_index(conn, name, description, creator)
+        feature_ids = create_features(conn, index_id, feature_names)
+        ingest_points(conn, index_id, X, feature_ids, point_names)
+        return index_id
+
+    return run_in_transaction(conn, ingest, skip_fk_checks)
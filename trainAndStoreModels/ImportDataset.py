@@ -0,0 +1,158 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+import psycopg2
+from DatasetIngest import create_index, create_features, ingest_points, run_in_transaction
+
+# Importador genérico de ficheros CSV o Parquet como índice nuevo.
+# El fichero se lee por bloques de filas, así que la memoria usada depende del tamaño del bloque
+# y no del fichero. Las columnas numéricas se detectan automáticamente y cada bloque se escribe
+# con COPY usando DatasetIngest, todo dentro de una única transacción.
+#
+# Ejemplo:
+#   python ImportDataset.py datos.csv --name "Sensores" --description "Lecturas 2024" --chunk-size 200000
+
+
+# Función para conectar a la base de datos
+def connect_to_db(dbname, user='postgres', password='postgres', host='localhost', port='5432'):
+    try:
+        conn = psycopg2.connect(
+            dbname=dbname,
+            user=user,
+            password=password,
+            host=host,
+            port=port
+        )
+        conn.autocommit = True
+        return conn
+    except Exception as e:
+        print(f"Ocurrió un error: {e}")
+        return None
+
+
+# Función para deducir el formato a partir de la extensión del fichero
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.parquet', '.pq'):
+        return 'parquet'
+    return 'csv'
+
+
+# Generador de bloques de un CSV. Devuelve (DataFrame, fracción del fichero leída).
+def read_csv_chunks(path, chunk_size, sep=','):
+    size = os.path.getsize(path) or 1
+    with open(path, 'rb') as f:
+        for chunk in pd.read_csv(f, chunksize=chunk_size, sep=sep):
+            yield chunk, min(f.tell() / size, 1.0)
+
+
+# Generador de bloques de un Parquet. Devuelve (DataFrame, fracción de filas leída).
+def read_parquet_chunks(path, chunk_size):
+    import pyarrow.parquet as pq  # Dependencia opcional, solo necesaria para Parquet
+
+    parquet_file = pq.ParquetFile(path)
+    total = parquet_file.metadata.num_rows or 1
+    read = 0
+    for batch in parquet_file.iter_batches(batch_size=chunk_size):
+        read += batch.num_rows
+        yield batch.to_pandas(), read / total
+
+
+# Función para elegir las columnas de características: las indicadas o las numéricas del primer bloque
+def infer_feature_columns(chunk, columns=None, name_column=None):
+    if columns:
+        missing = [column for column in columns if column not in chunk.columns]
+        if missing:
+            raise ValueError(f"Columnas no encontradas en el fichero: {missing}")
+        return list(columns)
+    numeric = chunk.select_dtypes(include=['number', 'bool']).columns
+    return [column for column in numeric if column != name_column]
+
+
+# Función para convertir un bloque en la matriz de valores (NaN para valores no numéricos o vacíos)
+def chunk_to_matrix(chunk, feature_columns):
+    values = chunk[feature_columns].apply(pd.to_numeric, errors='coerce')
+    return values.to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+# Función principal: importa el fichero como un índice nuevo. Devuelve el id del índice.
+def import_dataset(conn, path, name, description='', creator='', file_format=None, chunk_size=100000,
+                   columns=None, name_column=None, sep=',', skip_fk_checks=False, verbose=True):
+    file_format = file_format or detect_format(path)
+    if file_format == 'parquet':
+        chunks = read_parquet_chunks(path, chunk_size)
+    else:
+        chunks = read_csv_chunks(path, chunk_size, sep)
+
+    def ingest():
+        start = time.perf_counter()
+        index_id = None
+        feature_columns = None
+        feature_ids = None
+        num_points = 0
+        num_values = 0
+
+        for chunk, progress in chunks:
+            if index_id is None:
+                # El primer bloque define las características del índice
+                feature_columns = infer_feature_columns(chunk, columns, name_column)
+                if not feature_columns:
+                    raise ValueError("El fichero no tiene columnas numéricas")
+                index_id = create_index(conn, name, description, creator)
+                feature_ids = create_features(conn, index_id, feature_columns)
+
+            X = chunk_to_matrix(chunk, feature_columns)
+            if name_column:
+                point_names = chunk[name_column].astype(str).tolist()
+            else:
+                point_names = [f"point_{i}" for i in range(num_points, num_points + len(X))]
+            ingest_points(conn, index_id, X, feature_ids, point_names)
+
+            num_points += len(X)
+            num_values += int(np.count_nonzero(~np.isnan(X)))
+            if verbose:
+                elapsed = time.perf_counter() - start
+                print(f"{progress:6.1%}  {num_points:>12,} puntos  {num_values:>14,} valores  "
+                      f"{num_points / elapsed:>10,.0f} puntos/s  {num_values / elapsed:>12,.0f} valores/s",
+                      file=sys.stderr)
+
+        if index_id is None:
+            raise ValueError("El fichero está vacío")
+        if verbose:
+            elapsed = time.perf_counter() - start
+            print(f"Índice {index_id}: {num_points:,} puntos, {len(feature_columns)} características, "
+                  f"{num_values:,} valores en {elapsed:.1f} s", file=sys.stderr)
+        return index_id
+
+    return run_in_transaction(conn, ingest, skip_fk_checks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importa un fichero CSV o Parquet como índice nuevo")
+    parser.add_argument('path', help="Fichero CSV o Parquet")
+    parser.add_argument('--name', required=True, help="Nombre del índice")
+    parser.add_argument('--description', default='', help="Descripción del índice")
+    parser.add_argument('--creator', default='', help="Creador del índice")
+    parser.add_argument('--format', choices=['csv', 'parquet'], help="Formato (por defecto según la extensión)")
+    parser.add_argument('--chunk-size', type=int, default=100000, help="Filas por bloque")
+    parser.add_argument('--columns', nargs='+', help="Columnas a importar (por defecto, todas las numéricas)")
+    parser.add_argument('--name-column', help="Columna con el nombre de cada punto")
+    parser.add_argument('--sep', default=',', help="Separador del CSV")
+    parser.add_argument('--skip-fk-checks', action='store_true',
+                        help="No comprobar las claves foráneas fila a fila durante la carga (requiere superusuario)")
+    parser.add_argument('--dbname', default='grafana_ml_model')
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--password', default='postgres')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', default='5432')
+    args = parser.parse_args()
+
+    conn = connect_to_db(args.dbname, args.user, args.password, args.host, args.port)
+    index_id = import_dataset(conn, args.path, args.name, args.description, args.creator, args.format,
+                              args.chunk_size, args.columns, args.name_column, args.sep, args.skip_fk_checks)
+    conn.close()
+
+    print(f"Datos importados correctamente en la base de datos: índice {index_id}")
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from DataLoader import load_index_matrix
+
+# Caché local en disco de las matrices pivotadas de cada índice.
+# Cada entrada es un directorio con la matriz (data.npy), los ids de los puntos y de las
+# características (point_ids.npy, feature_ids.npy) y un meta.json con la huella de los datos.
+# Las lecturas abren la matriz con np.load(mmap_mode='r'), sin copiarla a memoria.
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'GRAFANA_ML_MODEL_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'grafana_ml_model'))
+DEFAULT_MAX_BYTES = int(os.environ.get('GRAFANA_ML_MODEL_CACHE_MAX_BYTES', 4 * 1024 ** 3))
+
+
+# Función para calcular una huella barata de los datos de un índice. Cambia si se insertan,
+# borran o modifican valores, puntos o características.
+def index_fingerprint(conn, index):
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT COUNT(*), COALESCE(MAX(id_point), 0), COALESCE(MAX(id_feature), 0),
+               COALESCE(SUM(hashtext(id_point || ':' || id_feature || ':' || value)::bigint), 0)
+        FROM grafana_ml_model_point_value
+        WHERE index = %s
+    """, (index,))
+    values = cur.fetchone()
+    cur.execute("""
+        SELECT (SELECT COUNT(*) FROM grafana_ml_model_point WHERE index = %s),
+               (SELECT COALESCE(MAX(id), 0) FROM grafana_ml_model_point WHERE index = %s),
+               (SELECT COUNT(*) FROM grafana_ml_model_feature WHERE index = %s),
+               (SELECT COALESCE(MAX(id), 0) FROM grafana_ml_model_feature WHERE index = %s)
+    """, (index, index, index, index))
+    tables = cur.fetchone()
+    cur.close()
+    return hashlib.sha1(repr((values, tables)).encode()).hexdigest()
+
+
+# Función para obtener el directorio de la entrada de un índice (una por base de datos e índice)
+def cache_entry_dir(conn, index, cache_dir):
+    info = conn.info
+    key = hashlib.sha1(f"{info.host}:{info.port}:{info.dbname}:{index}".encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"index_{index}_{key}")
+
+
+# Función para leer el meta.json de una entrada (None si no existe o está incompleta)
+def read_meta(entry_dir):
+    try:
+        with open(os.path.join(entry_dir, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Función para calcular el tamaño en disco de una entrada
+def entry_size(entry_dir):
+    size = 0
+    for name in os.listdir(entry_dir):
+        path = os.path.join(entry_dir, name)
+        if os.path.isfile(path):
+            size += os.path.getsize(path)
+    return size
+
+
+# Función para eliminar las entradas usadas hace más tiempo hasta que el total quepa en max_bytes.
+# La fecha de uso es la de modificación de meta.json, que se actualiza en cada lectura.
+# Los directorios temporales (.tmp_*) son entradas que otro proceso está escribiendo: no se tocan.
+def evict_entries(cache_dir, max_bytes, keep=None):
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry_dir = os.path.join(cache_dir, name)
+        if name.startswith('.tmp_') or not os.path.isdir(entry_dir):
+            continue
+        meta_path = os.path.join(entry_dir, 'meta.json')
+        try:
+            last_used = os.path.getmtime(meta_path) if os.path.exists(meta_path) else 0
+            entries.append((last_used, entry_dir, entry_size(entry_dir)))
+        except FileNotFoundError:
+            continue  # Otro proceso la ha borrado o reemplazado mientras tanto
+
+    total = sum(size for _, _, size in entries)
+    for last_used, entry_dir, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if entry_dir == keep:
+            continue
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total -= size
+
+
+# Función para guardar una matriz en la caché. Se escribe en un directorio temporal y
+# se renombra al final para que una lectura concurrente nunca vea una entrada a medias.
+def store_entry(entry_dir, data, point_ids, feature_ids, meta):
+    cache_dir = os.path.dirname(entry_dir)
+    tmp_dir = tempfile.mkdtemp(prefix='.tmp_', dir=cache_dir)
+    np.save(os.path.join(tmp_dir, 'data.npy'), data)
+    np.save(os.path.join(tmp_dir, 'point_ids.npy'), point_ids)
+    np.save(os.path.join(tmp_dir, 'feature_ids.npy'), feature_ids)
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    shutil.rmtree(entry_dir, ignore_errors=True)  # Invalidar la versión anterior
+    try:
+        os.replace(tmp_dir, entry_dir)
+    except OSError:
+        # Otro proceso ha guardado la entrada entre el borrado y el renombrado: se queda la suya
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+# Función para abrir una entrada sin copiarla: la matriz se devuelve como memmap de solo lectura.
+# Devuelve None si la entrada no existe: store_entry borra la versión anterior antes de renombrar
+# la nueva, y otro proceso puede estar reemplazándola o desalojándola justo ahora.
+def open_entry(entry_dir):
+    try:
+        data = np.load(os.path.join(entry_dir, 'data.npy'), mmap_mode='r')
+        point_ids = np.load(os.path.join(entry_dir, 'point_ids.npy'))
+        feature_ids = np.load(os.path.join(entry_dir, 'feature_ids.npy'))
+        os.utime(os.path.join(entry_dir, 'meta.json'))  # Marcar como usada recientemente (LRU)
+    except FileNotFoundError:
+        return None
+    return data, point_ids, feature_ids
+
+
+# Función principal: igual que load_index_matrix pero sirviendo la matriz desde la caché
+# cuando la huella de los datos no ha cambiado. Si cambió, se recarga y se reemplaza la entrada.
+# Una entrada que desaparece mientras se abre se trata como un fallo de caché.
+def load_index_matrix_cached(conn, index, dtype=np.float64, points=None, features=None, method='fetch',
+                             cache_dir=None, max_bytes=None, fill_value=0.0):
+    cache_dir = cache_dir or DEFAULT_CACHE_DIR
+    max_bytes = DEFAULT_MAX_BYTES if max_bytes is None else max_bytes
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Las matrices con otro valor de relleno (por ejemplo NaN) se guardan en su propia entrada
+    fill = repr(float(fill_value))  # Como texto, para que NaN se pueda comparar
+    entry_dir = cache_entry_dir(conn, index, cache_dir)
+    if fill != repr(0.0):
+        entry_dir += f"_fill_{fill}"
+    fingerprint = index_fingerprint(conn, index)
+    meta = read_meta(entry_dir)
+    if (meta is not None and meta['fingerprint'] == fingerprint and meta['dtype'] == np.dtype(dtype).str
+            and meta.get('fill_value', repr(0.0)) == fill):
+        cached = open_entry(entry_dir)
+        if cached is not None:
+            return cached
+
+    data, point_ids, feature_ids = load_index_matrix(conn, index, dtype=dtype, points=points,
+                                                     features=features, method=method, fill_value=fill_value)
+    meta = {
+        'index': index,
+        'fingerprint': fingerprint,
+        'dtype': np.dtype(dtype).str,
+        'fill_value': fill,
+        'shape': list(data.shape),
+        'created': time.time(),
+    }
+    store_entry(entry_dir, data, point_ids, feature_ids, meta)
+    evict_entries(cache_dir, max_bytes, keep=entry_dir)
+    cached = open_entry(entry_dir)
+    return cached if cached is not None else (data, point_ids, feature_ids)
@@ -0,0 +1,153 @@
+import numpy as np
+from scipy.spatial.distance import pdist, squareform
+from sklearn.cluster import Birch, MiniBatchKMeans
+
+# Agrupamiento jerárquico para muchos puntos a partir de micro-clústeres.
+# linkage de scipy necesita la matriz de distancias condensada O(n²). Aquí los puntos se
+# comprimen primero en m micro-clústeres (MiniBatchKMeans o un árbol CF de BIRCH), cada uno con
+# su centroide y su número de puntos como peso; el enlace se calcula sobre los m centroides
+# teniendo en cuenta los pesos y, al final, la matriz Z se expande a las n hojas originales
+# (los puntos de un mismo micro-clúster se fusionan entre sí a altura 0).
+
+LINKAGE_METHODS = ('single', 'complete', 'average', 'weighted', 'ward')
+
+
+# Función para comprimir los puntos en micro-clústeres. Devuelve la etiqueta de cada punto
+# (de 0 a m-1, sin micro-clústeres vacíos), los centroides y el número de puntos de cada uno.
+def micro_cluster(data, n_micro=1000, method='kmeans', threshold=0.5, random_state=42):
+    if method == 'kmeans':
+        model = MiniBatchKMeans(n_clusters=min(n_micro, len(data)), random_state=random_state, n_init=3)
+    elif method == 'birch':
+        model = Birch(n_clusters=None, threshold=threshold)
+    else:
+        raise ValueError(f"Método de micro-clústeres desconocido: {method}")
+    labels = model.fit_predict(data)
+
+    # Renumerar las etiquetas usadas y calcular centroides y pesos
+    _, labels = np.unique(labels, return_inverse=True)
+    weights = np.bincount(labels)
+    centers = np.stack([np.bincount(labels, weights=data[:, j]) for j in range(data.shape[1])], axis=1)
+    return labels, centers / weights[:, None], weights
+
+
+# Función para actualizar con Lance-Williams las distancias de todos los clústeres al clúster
+# resultante de fusionar x e y (a distancia d).
+def lance_williams(method, dx, dy, d, nx, ny, sizes):
+    if method == 'single':
+        return np.minimum(dx, dy)
+    if method == 'complete':
+        return np.maximum(dx, dy)
+    if method == 'average':
+        return (nx * dx + ny * dy) / (nx + ny)
+    if method == 'weighted':
+        return (dx + dy) / 2
+    # ward
+    total = sizes + nx + ny
+    return np.sqrt(np.maximum(((sizes + nx) * dx ** 2 + (sizes + ny) * dy ** 2 - sizes * d ** 2) / total, 0))
+
+
+# Función para calcular el enlace jerárquico de m centroides con pesos (número de puntos de cada
+# uno) con el algoritmo de la cadena de vecinos más cercanos: O(m²) en tiempo y memoria.
+# Devuelve una matriz Z con el formato de scipy (la última columna es la suma de pesos).
+def weighted_linkage(centers, weights, method='ward', metric='euclidean'):
+    if method not in LINKAGE_METHODS:
+        raise ValueError(f"Método de enlace no admitido con micro-clústeres: {method}")
+    m = len(centers)
+    sizes = np.asarray(weights, dtype=np.float64).copy()
+    D = squareform(pdist(centers, metric='euclidean' if method == 'ward' else metric))
+    if method == 'ward':
+        # Distancia de Ward entre clústeres de tamaños na y nb: sqrt(2 na nb / (na + nb)) * ||ca - cb||
+        D *= np.sqrt(2 * np.outer(sizes, sizes) / np.add.outer(sizes, sizes))
+    np.fill_diagonal(D, np.inf)
+
+    active = np.ones(m, dtype=bool)
+    merges = []
+    chain = []
+    for _ in range(m - 1):
+        if not chain:
+            chain.append(int(np.argmax(active)))
+        # Avanzar por la cadena hasta encontrar dos vecinos más cercanos recíprocos
+        while True:
+            x = chain[-1]
+            y = int(np.argmin(D[x]))
+            if len(chain) > 1 and D[x, chain[-2]] <= D[x, y]:
+                y = chain[-2]
+            if len(chain) > 1 and y == chain[-2]:
+                break
+            chain.append(y)
+        chain.pop()
+        chain.pop()
+
+        # Fusionar x en y: la fila de y pasa a ser la del nuevo clúster y x se desactiva
+        d = D[x, y]
+        nx, ny = sizes[x], sizes[y]
+        row = lance_williams(method, D[x], D[y], d, nx, ny, sizes)
+        active[x] = False
+        sizes[y] = nx + ny
+        row[~active] = np.inf
+        row[y] = np.inf
+        D[y, :] = row
+        D[:, y] = row
+        D[x, :] = np.inf
+        D[:, x] = np.inf
+        merges.append((x, y, d))
+
+    # Ordenar las fusiones por altura y numerar los nodos como scipy (unión de conjuntos)
+    merges.sort(key=lambda merge: merge[2])
+    parent = np.arange(2 * m - 1)
+    node_size = np.concatenate([np.asarray(weights, dtype=np.float64), np.zeros(m - 1)])
+
+    def find(node):
+        root = node
+        while parent[root] != root:
+            root = parent[root]
+        while parent[node] != root:
+            parent[node], node = root, parent[node]
+        return root
+
+    Z = np.empty((m - 1, 4))
+    for r, (x, y, d) in enumerate(merges):
+        a, b = find(x), find(y)
+        node_size[m + r] = node_size[a] + node_size[b]
+        Z[r] = (min(a, b), max(a, b), d, node_size[m + r])
+        parent[a] = parent[b] = m + r
+    return Z
+
+
+# Función para expandir la matriz Z de los micro-clústeres a los n puntos: primero se fusionan a
+# altura 0 los puntos de cada micro-clúster (en cadena) y después se repiten las fusiones de Zm
+# sustituyendo cada micro-clúster por el nodo que agrupa a sus puntos.
+def expand_linkage(labels, Zm):
+    n = len(labels)
+    m = len(Zm) + 1
+    order = np.argsort(labels, kind='stable')
+    sizes = np.bincount(labels, minlength=m)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    offsets = np.concatenate([[0], np.cumsum(sizes - 1)[:-1]])  # Primera fila de cada micro-clúster
+
+    # Fusiones internas: el miembro j >= 1 de cada micro-clúster se une al nodo de los j anteriores
+    group = labels[order]
+    position = np.arange(n) - starts[group]
+    members = position >= 1
+    rows = offsets[group[members]] + position[members] - 1
+    left = np.where(position[members] == 1, order[np.flatnonzero(members) - 1], n + rows - 1)
+    inner = np.column_stack([left, order[members], np.zeros(len(rows)), position[members] + 1])
+    inner = inner[np.argsort(rows)]
+
+    # Nodo que representa a cada micro-clúster (el propio punto si tiene uno solo)
+    micro_node = np.where(sizes == 1, order[starts], n + offsets + sizes - 2)
+    node = np.concatenate([micro_node, n + (n - m) + np.arange(m - 1)])
+    outer = np.column_stack([node[Zm[:, 0].astype(np.int64)], node[Zm[:, 1].astype(np.int64)], Zm[:, 2], Zm[:, 3]])
+    outer[:, :2] = np.sort(outer[:, :2], axis=1)
+    return np.vstack([inner, outer]).astype(np.float64)
+
+
+# Función principal: matriz Z de n hojas calculada a partir de n_micro micro-clústeres
+def micro_cluster_linkage(data, method='ward', metric='euclidean', n_micro=1000, micro_method='kmeans',
+                          threshold=0.5):
+    labels, centers, weights = micro_cluster(data, n_micro, micro_method, threshold)
+    if len(weights) == 1:
+        Zm = np.empty((0, 4))
+    else:
+        Zm = weighted_linkage(centers, weights, method, metric)
+    return expand_linkage(labels, Zm)
@@ -0,0 +1,132 @@
+import numpy as np
+from BulkWriter import copy_arrays
+from DataLoader import iter_index_blocks, presence_mask
+
+# Módulo compartido para guardar estadísticos suficientes de un índice y actualizarlos de forma
+# incremental. Por cada índice y tipo de análisis se guardan el número de puntos n, el último id
+# de punto incluido, la media de cada característica y la matriz de co-momentos centrados
+# C = sum((x - media)(x - media)') (triángulo superior con la diagonal). Al añadir puntos basta
+# con recorrer los nuevos (id_point > last_id_point) y combinarlos con merge_moments, sin volver
+# a leer el histórico.
+
+
+# Función para combinar los estadísticos (n, medias, co-momentos centrados) de dos conjuntos
+# de puntos con la actualización por pares de Chan, numéricamente estable
+def merge_moments(n, mean, comoment, n_block, mean_block, comoment_block):
+    if n == 0:
+        return n_block, mean_block, comoment_block
+    total = n + n_block
+    delta = mean_block - mean
+    mean = mean + delta * (n_block / total)
+    comoment = comoment + comoment_block + np.outer(delta, delta) * (n * n_block / total)
+    return total, mean, comoment
+
+
+# Función para calcular los estadísticos de un bloque de puntos y combinarlos con los acumulados
+def update_moments(n, mean, comoment, block):
+    mean_block = block.mean(axis=0)
+    centered = block - mean_block
+    return merge_moments(n, mean, comoment, len(block), mean_block, centered.T @ centered)
+
+
+# Función para cargar los estadísticos guardados de un índice. Devuelve (n, medias, co-momentos,
+# last_id_point) en el orden de feature_ids, o None si no hay estadísticos o no corresponden a
+# las mismas características (en ese caso hay que recalcularlos desde el principio).
+def load_moments(conn, index, analysis, feature_ids):
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT id, n, last_id_point
+        FROM grafana_ml_model_moments
+        WHERE index = %s AND type = %s
+        ORDER BY id DESC
+        LIMIT 1
+    """, (index, analysis))
+    header = cur.fetchone()
+    if header is None:
+        cur.close()
+        return None
+    id_moments, n, last_id_point = header
+
+    feature_ids = np.asarray(feature_ids, dtype=np.int64)
+    cur.execute("""
+        SELECT id_feature, value
+        FROM grafana_ml_model_moments_mean
+        WHERE id_moments = %s
+        ORDER BY id_feature
+    """, (id_moments,))
+    means = cur.fetchall()
+    cur.execute("""
+        SELECT id_feature1, id_feature2, value
+        FROM grafana_ml_model_moments_comoment
+        WHERE id_moments = %s
+    """, (id_moments,))
+    comoments = np.array(cur.fetchall(), dtype=np.float64).reshape(-1, 3)
+    cur.close()
+
+    if not np.array_equal(np.array([row[0] for row in means], dtype=np.int64), feature_ids):
+        return None
+    mean = np.array([row[1] for row in means], dtype=np.float64)
+    rows = np.searchsorted(feature_ids, comoments[:, 0].astype(np.int64))
+    columns = np.searchsorted(feature_ids, comoments[:, 1].astype(np.int64))
+    comoment = np.zeros((len(feature_ids), len(feature_ids)))
+    comoment[rows, columns] = comoments[:, 2]
+    comoment[columns, rows] = comoments[:, 2]
+    return int(n), mean, comoment, last_id_point
+
+
+# Función para borrar los estadísticos guardados de un índice y tipo de análisis
+def delete_moments(conn, index, analysis):
+    cur = conn.cursor()
+    cur.execute("""
+        DELETE FROM grafana_ml_model_moments_mean
+        WHERE id_moments IN (SELECT id FROM grafana_ml_model_moments WHERE index = %s AND type = %s)
+    """, (index, analysis))
+    cur.execute("""
+        DELETE FROM grafana_ml_model_moments_comoment
+        WHERE id_moments IN (SELECT id FROM grafana_ml_model_moments WHERE index = %s AND type = %s)
+    """, (index, analysis))
+    cur.execute("DELETE FROM grafana_ml_model_moments WHERE index = %s AND type = %s", (index, analysis))
+    cur.close()
+
+
+# Función para guardar los estadísticos de un índice, sustituyendo a los anteriores. No hace
+# commit: se llama dentro de la misma transacción que escribe los resultados calculados con ellos.
+def save_moments(conn, index, analysis, feature_ids, n, mean, comoment, last_id_point):
+    delete_moments(conn, index, analysis)
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO grafana_ml_model_moments (index, type, n, last_id_point)
+        VALUES (%s, %s, %s, %s)
+        RETURNING id
+    """, (index, analysis, int(n), None if last_id_point is None else int(last_id_point)))
+    id_moments = cur.fetchone()[0]
+    cur.close()
+
+    feature_ids = np.asarray(feature_ids, dtype=np.int64)
+    copy_arrays(conn, 'grafana_ml_model_moments_mean', ('id_moments', 'id_feature', 'value'),
+                [np.full(len(feature_ids), id_moments), feature_ids, np.asarray(mean, dtype=np.float64)],
+                types=['int4', 'int4', 'float8'])
+    rows, columns = np.triu_indices(len(feature_ids))
+    copy_arrays(conn, 'grafana_ml_model_moments_comoment', ('id_moments', 'id_feature1', 'id_feature2', 'value'),
+                [np.full(len(rows), id_moments), feature_ids[rows], feature_ids[columns], comoment[rows, columns]],
+                types=['int4', 'int4', 'int4', 'float8'])
+    return id_moments
+
+
+# Función principal: actualiza de forma incremental los estadísticos de un índice para un tipo
+# de análisis. Parte de los guardados (si existen y son de las mismas características) y solo
+# recorre los puntos añadidos después de last_id_point. Solo se usan los puntos completos
+# (listwise). Devuelve (n, medias, co-momentos, last_id_point); no guarda nada.
+# Los valores modificados de puntos ya incluidos no se detectan, ni los puntos que estaban
+# incompletos y se completan después: para eso hay que recalcular desde cero con full_refresh=True.
+def moments_incremental(conn, index, analysis, features, block_size=10000, full_refresh=False):
+    feature_ids = [feature[0] for feature in features]
+    state = None if full_refresh else load_moments(conn, index, analysis, feature_ids)
+    n, mean, comoment, last_id_point = state if state is not None else (0, 0.0, 0.0, None)
+    for point_ids, block in iter_index_blocks(conn, index, block_size=block_size, features=features,
+                                              after_point_id=last_id_point, fill_value=np.nan):
+        last_id_point = int(point_ids[-1])
+        block = block[presence_mask(block).all(axis=1)]
+        if len(block) > 0:
+            n, mean, comoment = update_moments(n, mean, comoment, block)
+    return n, mean, comoment, last_id_point
@@ -0,0 +1,191 @@
+import argparse
+import time
+import numpy as np
+import psycopg2
+import psycopg2.extensions
+from concurrent.futures import ThreadPoolExecutor
+from DataLoader import load_index_matrix, load_points, load_features, presence_mask
+from MatrixCache import load_index_matrix_cached
+from ClusteringKMeans import kmeans_clustering_on_data
+from ClusteringKMedoid import kmedoids_clustering_on_data
+from ClusteringHierarchical import hierarchical_clustering_on_data
+from CorrelationPearson import pearson_correlation_on_data
+from CorrelationSpearman import spearman_correlation_on_data
+from RegressionLinear import linear_regression_on_data
+from RegressionLogistic import logistic_regression_on_data
+
+# Ejecución de varios análisis sobre un mismo índice.
+# El índice se carga una sola vez (con NaN en las celdas sin valor) y la matriz se comparte en
+# modo solo lectura entre los análisis; de ella se derivan las entradas de cada script: la matriz
+# con los huecos a 0 para los agrupamientos, la matriz con NaN para las correlaciones y los puntos
+# completos para las regresiones. Los análisis se ejecutan a la vez en un pool de hilos (NumPy,
+# BLAS y scikit-learn liberan el GIL en los cálculos pesados), cada uno con su propia conexión y
+# escribiendo todos sus resultados en una sola transacción: o se guardan todos o ninguno.
+# Al final se imprime el tiempo de cada etapa.
+
+ANALYSES = ('kmeans', 'kmedoids', 'hierarchical', 'pearson', 'spearman', 'linear', 'logistic')
+
+
+# Conexión cuyo commit no hace nada mientras deferred sea True. Las funciones de escritura de los
+# scripts hacen commit después de cada tabla; con esta conexión esos commits se aplazan y el
+# runner hace un único commit (o rollback) al final de cada análisis.
+class PipelineConnection(psycopg2.extensions.connection):
+    deferred = False
+
+    def commit(self):
+        if not self.deferred:
+            super().commit()
+
+
+# Función para conectar a la base de datos
+def connect_to_db(dbname, user='postgres', password='postgres', host='localhost', port='5432', deferred=False):
+    try:
+        conn = psycopg2.connect(
+            dbname=dbname,
+            user=user,
+            password=password,
+            host=host,
+            port=port,
+            connection_factory=PipelineConnection
+        )
+        conn.autocommit = not deferred
+        conn.deferred = deferred
+        return conn
+    except Exception as e:
+        print(f"Ocurrió un error: {e}")
+        return None
+
+
+# Función para marcar una matriz como de solo lectura (se comparte entre hilos)
+def read_only(data):
+    data.flags.writeable = False
+    return data
+
+
+# Función para cargar el índice una sola vez. Devuelve los puntos, las características (id,
+# nombre) y la matriz de solo lectura con NaN en las celdas sin valor.
+def load_index(conn, index, method='fetch', cache=False):
+    points = load_points(conn, index)
+    features = load_features(conn, index)
+    load_matrix = load_index_matrix_cached if cache else load_index_matrix  # Caché local opcional
+    data, point_ids, feature_ids = load_matrix(conn, index, points=points, features=features, method=method,
+                                               fill_value=np.nan)
+    return points, features, read_only(data)
+
+
+# Función para preparar las entradas de cada análisis a partir de la matriz cargada, igual que
+# los load_data_from_db de cada script. Solo se copia la matriz cuando hace falta: con huecos a
+# 0 para los agrupamientos si hay valores ausentes y con los puntos completos para las regresiones.
+def analysis_inputs(analyses, points, features, data):
+    inputs = {}
+    present = presence_mask(data)
+    if any(analysis in analyses for analysis in ('kmeans', 'kmedoids', 'hierarchical')):
+        filled = read_only(np.where(present, data, 0.0)) if not present.all() else data
+        inputs['kmeans'] = (filled, [feature[1] for feature in features], points)
+        inputs['kmedoids'] = (filled, [(point[0],) for point in points])
+        inputs['hierarchical'] = (filled, [point[0] for point in points])
+    feature_ids_map = {i: int(feature[0]) for i, feature in enumerate(features)}  # Índice de columna -> id
+    inputs['pearson'] = inputs['spearman'] = (data, feature_ids_map)
+    if 'linear' in analyses or 'logistic' in analyses:
+        complete = present.all(axis=1)
+        complete_points = [point for point, keep in zip(points, complete) if keep]
+        inputs['linear'] = inputs['logistic'] = (read_only(data[complete]), features, complete_points)
+    return inputs
+
+
+# Función para ejecutar un análisis con su propia conexión y en una sola transacción.
+# Devuelve el tiempo que ha tardado (cálculo y escritura).
+def run_analysis(analysis, conn_params, index, inputs, options):
+    functions = {
+        'kmeans': kmeans_clustering_on_data,
+        'kmedoids': kmedoids_clustering_on_data,
+        'hierarchical': hierarchical_clustering_on_data,
+        'pearson': pearson_correlation_on_data,
+        'spearman': spearman_correlation_on_data,
+        'linear': linear_regression_on_data,
+        'logistic': logistic_regression_on_data,
+    }
+    start = time.perf_counter()
+    conn = connect_to_db(**conn_params, deferred=True)
+    try:
+        functions[analysis](conn, index, *inputs, **options)
+        conn.deferred = False
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return time.perf_counter() - start
+
+
+# Función para imprimir el resumen de tiempos por etapa
+def print_timings(timings):
+    width = max(len(stage) for stage in timings)
+    print("Tiempos por etapa:")
+    for stage, seconds in timings.items():
+        print(f"  {stage:<{width}}  {seconds:9.3f} s")
+
+
+# Función principal: carga el índice una vez y ejecuta los análisis pedidos (por defecto, todos)
+# en workers hilos. options permite pasar parámetros a cada análisis, por ejemplo
+# {'kmeans': {'k': 4}, 'pearson': {'top_k': 10}}. Si falla algún análisis los demás terminan y
+# guardan sus resultados, y después se relanza el primer error. Devuelve los tiempos por etapa.
+def run_pipeline(index, dbname, user='postgres', password='postgres', host='localhost', port='5432',
+                 analyses=ANALYSES, load_method='fetch', use_cache=False, workers=None, options=None):
+    unknown = [analysis for analysis in analyses if analysis not in ANALYSES]
+    if unknown:
+        raise ValueError(f"Análisis desconocidos: {', '.join(unknown)}")
+    options = options or {}
+    conn_params = dict(dbname=dbname, user=user, password=password, host=host, port=port)
+    timings = {}
+    start = time.perf_counter()
+
+    # Cargar el índice una sola vez
+    conn = connect_to_db(**conn_params)
+    points, features, data = load_index(conn, index, load_method, use_cache)
+    conn.close()
+    inputs = analysis_inputs(analyses, points, features, data)
+    timings['carga'] = time.perf_counter() - start
+
+    # Ejecutar los análisis a la vez
+    with ThreadPoolExecutor(max_workers=workers or len(analyses)) as executor:
+        futures = {analysis: executor.submit(run_analysis, analysis, conn_params, index, inputs[analysis],
+                                             options.get(analysis, {}))
+                   for analysis in analyses}
+    errors = []
+    for analysis, future in futures.items():
+        if future.exception() is not None:
+            errors.append(future.exception())
+            print(f"Error en el análisis '{analysis}': {future.exception()}")
+        else:
+            timings[analysis] = future.result()
+    timings['total'] = time.perf_counter() - start
+
+    print_timings(timings)
+    if errors:
+        raise errors[0]
+    print(f"Resultados de {len(analyses) - len(errors)} análisis insertados en la base de datos: '{dbname}'")
+    return timings
+
+
+# Ejemplo de uso
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Carga un índice una vez y ejecuta sobre él varios análisis")
+    parser.add_argument('index', type=int, help="Índice a analizar")
+    parser.add_argument('--analyses', nargs='+', choices=ANALYSES, default=list(ANALYSES),
+                        help="Análisis a ejecutar (por defecto, todos)")
+    parser.add_argument('--workers', type=int, help="Análisis simultáneos (por defecto, todos)")
+    parser.add_argument('--k', type=int, default=3, help="Número de clústeres de los agrupamientos")
+    parser.add_argument('--load-method', choices=['fetch', 'copy'], default='fetch')
+    parser.add_argument('--use-cache', action='store_true', help="Usar la caché local de la matriz")
+    parser.add_argument('--dbname', default='grafana_ml_model')
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--password', default='postgres')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', default='5432')
+    args = parser.parse_args()
+
+    run_pipeline(args.index, args.dbname, args.user, args.password, args.host, args.port, args.analyses,
+                 args.load_method, args.use_cache, args.workers,
+                 {analysis: {'k': args.k} for analysis in ('kmeans', 'kmedoids', 'hierarchical')})
@@ -1,7 +1,14 @@
 import numpy as np
 import psycopg2
+from DataLoader import load_index_matrix, load_points, load_features, presence_mask
+from MatrixCache import load_index_matrix_cached
+from BulkWriter import write_rows, copy_rows
+from DatasetIngest import run_in_transaction
+from MomentStore import save_moments, moments_incremental
+from RegressionPoints import insert_regression_points, insert_regression_points_streaming
 import statsmodels.api as sm
 from scipy.stats import t  # Para el cálculo del p-valor P>|t|
+from scipy.linalg import cho_factor, cho_solve, LinAlgError
 
 # Función para conectar a la base de datos
 def connect_to_db(dbname, user='postgres', password='postgres', host='localhost', port='5432'):
@@ -20,89 +27,198 @@ def connect_to_db(dbname, user='postgres', password='postgres', host='localhost'
         return None
 
 # Función para cargar los datos de la base de datos
-def load_data_from_db(conn, index):
-    cur = conn.cursor()
+def load_data_from_db(conn, index, method='fetch', cache=False):
+    # Cargar los puntos y las características (id, nombre) ordenados por id
+    points = load_points(conn, index)
+    feature_names = load_features(conn, index)
 
-    # Cargar las características de los puntos
-    cur.execute("""
-        SELECT id, name
-        FROM grafana_ml_model_point
-        WHERE index = %s
-    """, (index,))
-    points = cur.fetchall()  # Los IDs y nombres de los puntos
-
-    # Cargar los valores de las características de los puntos
-    cur.execute("""
-        SELECT id_point, id_feature, value
-        FROM grafana_ml_model_point_value
-        WHERE index = %s
-    """, (index,))
-    values = cur.fetchall()  # Los valores de características (id_point, id_feature, value)
-
-    # Organizar los datos en un formato adecuado
-    num_points = len(points)
-    num_features = len(set([v[1] for v in values]))  # Identificar el número de características
-    data = np.zeros((num_points, num_features))  # Matriz de datos de características
-
-    # Llenar la matriz de datos con los valores
-    for v in values:
-        point_index = next(i for i, point in enumerate(points) if point[0] == v[0])  # Buscar el índice del punto
-        feature_index = v[1] - values[0][1]  # Asegurarse de que el índice de las características sea correcto
-        data[point_index, feature_index] = v[2]  # Asignar el valor al lugar adecuado
-
-    # Cargar los nombres de las características
-    cur.execute("""
-        SELECT id, name
-        FROM grafana_ml_model_feature
-        WHERE index = %s
-    """, (index,))
-    feature_names = cur.fetchall()  # Cargar id y nombre de características
+    # Cargar la matriz de datos (filas en el orden de los puntos, columnas en el de las características)
+    load_matrix = load_index_matrix_cached if cache else load_index_matrix  # Caché local opcional
+    data, point_ids, feature_ids = load_matrix(conn, index, points=points, features=feature_names, method=method,
+                                               fill_value=np.nan)
+
+    # Solo se usan los puntos completos (listwise): los que no tienen valor para alguna
+    # característica o para el objetivo se descartan en lugar de rellenarlos con ceros
+    complete = presence_mask(data).all(axis=1)
+    data = data[complete]
+    points = [point for point, keep in zip(points, complete) if keep]  # Alineados con las filas de data
 
-    cur.close()
     return data, feature_names, points
 
 
-# Función para insertar los resultados de la regresión en la base de datos
-def insert_regression_results(conn, index, feature_names, coefficients, std_errs, p_values, t_values):
-    cur = conn.cursor()
-
+# Función para construir las filas de grafana_ml_model_regression con los resultados de la regresión
+def regression_rows(index, feature_names, coefficients, std_errs, p_values, t_values):
     # Insertar el intercepto (primer coeficiente, correspondiente al término constante) con id_feature NULL
-    cur.execute("""
-        INSERT INTO grafana_ml_model_regression (index, id_feature, coeff, std_err, value, p_value, type)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-    """, (index, None, coefficients[0], std_errs[0], t_values[0], p_values[0], 'linear'))
+    rows = [(index, None, coefficients[0], std_errs[0], t_values[0], p_values[0], 'linear')]
 
     # Insertar los coeficientes y resultados de las características
     for i, (coef, std_err, p_value, t_value) in enumerate(zip(coefficients[1:], std_errs[1:], p_values[1:], t_values[1:])):
         # Obtener el id_feature de la tabla grafana_ml_model_feature
         feature_id = feature_names[i][0]  # El id de la característica
-        # Insertar el resultado de la regresión (coeficiente, desviación estándar, t-valor, p-valor)
-        cur.execute("""
-            INSERT INTO grafana_ml_model_regression (index, id_feature, coeff, std_err, value, p_value, type)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """, (index, feature_id, coef, std_err, t_value, p_value, 'linear'))
+        # Resultado de la regresión (coeficiente, desviación estándar, t-valor, p-valor)
+        rows.append((index, feature_id, coef, std_err, t_value, p_value, 'linear'))
+    return rows
+
 
-    conn.commit()
+# Función para sustituir los resultados de tipo 'linear' del índice por los nuevos. No hace
+# commit: se llama dentro de run_in_transaction junto con el resto de escrituras del ajuste.
+def insert_regression_results(conn, index, feature_names, coefficients, std_errs, p_values, t_values):
+    cur = conn.cursor()
+    cur.execute("DELETE FROM grafana_ml_model_regression WHERE index = %s AND type = 'linear'", (index,))
     cur.close()
+    copy_rows(conn, 'grafana_ml_model_regression',
+              ('index', 'id_feature', 'coeff', 'std_err', 'value', 'p_value', 'type'),
+              regression_rows(index, feature_names, coefficients, std_errs, p_values, t_values))
 
 
-# Función para realizar la regresión lineal y almacenar los resultados
-def linear_regression_to_db(index, dbname, user='postgres', password='postgres', host='localhost', port='5432'):
+# Función para calcular los p-valores P>|t| (dos colas) con los mismos grados de libertad que
+# linear_regression_to_db (número de puntos - 1)
+def regression_p_values(t_values, n):
+    return 2 * (1 - t.cdf(np.abs(t_values), df=n - 1))
+
+
+# Función para obtener la regresión lineal (con intercepto) de la última característica sobre las
+# demás a partir de los estadísticos suficientes de [X, y]: n, medias y co-momentos centrados.
+# Son equivalentes a X'X, X'y, y'y y n, pero sin perder precisión con medias grandes:
+#   beta = Cxx^-1 Cxy, intercepto = media(y) - media(X)' beta, RSS = Cyy - Cxy' beta
+# y la inversa de X'X con la columna de unos da los errores estándar (igual que sm.OLS, que usa
+# la pseudoinversa). El coste es O(p³), independiente del número de puntos.
+def ols_from_moments(n, mean, comoment):
+    inverse = np.linalg.pinv(comoment[:-1, :-1])
+    cross = comoment[:-1, -1]
+    slopes = inverse @ cross
+    intercept = mean[-1] - mean[:-1] @ slopes
+    rss = max(comoment[-1, -1] - cross @ slopes, 0.0)
+    df_resid = n - np.linalg.matrix_rank(comoment[:-1, :-1]) - 1
+    sigma2 = rss / df_resid if df_resid > 0 else np.nan
+
+    coefficients = np.concatenate([[intercept], slopes])
+    variances = np.concatenate([[1.0 / n + mean[:-1] @ inverse @ mean[:-1]], np.diag(inverse)])
+    std_errs = np.sqrt(sigma2 * variances)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_values = coefficients / std_errs
+    return coefficients, std_errs, t_values, regression_p_values(t_values, n)
+
+
+# Función para actualizar la regresión lineal de un índice con sus estadísticos suficientes: se
+# combinan los puntos añadidos desde la última vez y, en una sola transacción, se guardan los
+# estadísticos y se sustituyen las filas de tipo 'linear' del índice por las nuevas.
+# Con point_results=True también se recalculan los resultados por punto, lo que exige recorrer
+# todo el índice una vez más. Devuelve el número de puntos usados.
+def linear_regression_incremental(conn, index, block_size=10000, full_refresh=False, point_results=True,
+                                  sample_size=500):
+    feature_names = load_features(conn, index)
+    feature_ids = [feature[0] for feature in feature_names]
+    n, mean, comoment, last_id_point = moments_incremental(conn, index, 'linear', feature_names, block_size,
+                                                           full_refresh)
+    if n == 0:
+        return 0
+    coefficients, std_errs, t_values, p_values = ols_from_moments(n, mean, comoment)
+
+    def refresh():
+        save_moments(conn, index, 'linear', feature_ids, n, mean, comoment, last_id_point)
+        insert_regression_results(conn, index, feature_names, coefficients, std_errs, p_values, t_values)
+        if point_results:
+            insert_regression_points_streaming(conn, index, 'linear', feature_names, coefficients, n,
+                                               sample_size=sample_size, block_size=block_size)
+
+    run_in_transaction(conn, refresh)
+    return n
+
+
+# Función para invertir la matriz de co-momentos de todas las características con una única
+# factorización de Cholesky (pseudoinversa si es singular, por ejemplo con columnas constantes)
+def comoment_inverse(comoment):
+    try:
+        return cho_solve(cho_factor(comoment), np.eye(len(comoment)))
+    except LinAlgError:
+        return np.linalg.pinv(comoment)
+
+
+# Función para regresar cada característica objetivo sobre todas las demás a partir de una sola
+# inversa P = C^-1 de la matriz de co-momentos centrados C (operador de barrido). Para el
+# objetivo j, con el resto de características R:
+#   beta = -P[R, j] / P[j, j],   RSS = 1 / P[j, j],   inv(C[R, R]) = P[R, R] - P[R, j] P[j, R] / P[j, j]
+# así que cada objetivo cuesta O(F²) en lugar de una factorización nueva. Devuelve, para cada
+# columna objetivo, la lista de columnas explicativas y (coeficientes, errores estándar,
+# t-valores, p-valores) con el intercepto primero, igual que ols_from_moments.
+def linear_sweep(n, mean, comoment, targets=None):
+    inverse = comoment_inverse(comoment)
+    n_features = len(comoment)
+    targets = range(n_features) if targets is None else targets
+    df_resid = n - n_features
+    results = []
+    for target in targets:
+        others = np.delete(np.arange(n_features), target)
+        pivot = inverse[target, target]
+        column = inverse[others, target]
+        slopes = -column / pivot
+        intercept = mean[target] - mean[others] @ slopes
+        sigma2 = (1.0 / pivot) / df_resid if df_resid > 0 else np.nan
+
+        # Diagonal de inv(C[R, R]) y término del intercepto m' inv(C[R, R]) m
+        reduced = np.diag(inverse)[others] - column ** 2 / pivot
+        means = mean[others]
+        intercept_variance = 1.0 / n + means @ inverse[np.ix_(others, others)] @ means - (means @ column) ** 2 / pivot
+
+        coefficients = np.concatenate([[intercept], slopes])
+        std_errs = np.sqrt(sigma2 * np.concatenate([[intercept_variance], reduced]))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t_values = coefficients / std_errs
+        results.append((target, others, (coefficients, std_errs, t_values, regression_p_values(t_values, n))))
+    return results
+
+
+# Función para insertar en bloque los resultados del barrido, con id_target = característica
+# objetivo y type='linear_sweep'
+def insert_sweep_results(conn, index, feature_ids, results):
+    rows = []
+    for target, others, (coefficients, std_errs, t_values, p_values) in results:
+        id_target = feature_ids[target]
+        ids = [None] + [feature_ids[other] for other in others]  # El intercepto con id_feature NULL
+        for id_feature, coef, std_err, t_value, p_value in zip(ids, coefficients, std_errs, t_values, p_values):
+            rows.append((index, id_target, id_feature, coef, std_err, t_value, p_value, 'linear_sweep'))
+
+    write_rows(conn, 'grafana_ml_model_regression',
+               ('index', 'id_target', 'id_feature', 'coeff', 'std_err', 'value', 'p_value', 'type'), rows)
+
+
+# Función para regresar cada característica de targets (ids; por defecto todas) sobre las demás
+# en un único trabajo: se carga el índice una vez, se calculan sus co-momentos y una sola
+# factorización sirve para todos los objetivos
+def linear_sweep_to_db(index, dbname, user='postgres', password='postgres', host='localhost', port='5432', load_method='fetch', use_cache=False,
+                       targets=None):
     # Conectar a la base de datos
     conn = connect_to_db(dbname, user, password, host, port)
-    
-    # Cargar los datos desde la base de la base de datos
-    data, feature_names, points = load_data_from_db(conn, index)
-    
+
+    # Cargar los datos (solo puntos completos) y calcular sus estadísticos
+    data, feature_names, points = load_data_from_db(conn, index, load_method, use_cache)
+    feature_ids = [feature[0] for feature in feature_names]
+    mean = data.mean(axis=0)
+    centered = data - mean
+    columns = None if targets is None else [feature_ids.index(target) for target in targets]
+
+    results = linear_sweep(len(data), mean, centered.T @ centered, columns)
+    insert_sweep_results(conn, index, feature_ids, results)
+
+    # Cerrar la conexión
+    conn.close()
+
+    print(f"Barrido de regresiones lineales ({len(results)} objetivos) insertado en la base de datos: '{dbname}'")
+
+
+# Función para ajustar sm.OLS sobre una matriz ya cargada (la de load_data_from_db: puntos
+# completos, con el objetivo en la última columna) y almacenar los resultados. No modifica data.
+def linear_regression_on_data(conn, index, data, feature_names, points, point_results=True, sample_size=500):
     # Supongamos que la última columna es el objetivo (y) y el resto son las características (X)
     X = data[:, :-1]  # Características (todas excepto la última columna)
     y = data[:, -1]   # Objetivo (última columna)
 
     # Añadir una columna de unos a X para el término independiente (intercepto)
-    X = sm.add_constant(X)
+    X_const = sm.add_constant(X)
 
     # Realizar la regresión lineal usando statsmodels
-    model = sm.OLS(y, X)  # Ordinary Least Squares (Mínimos cuadrados ordinarios)
+    model = sm.OLS(y, X_const)  # Ordinary Least Squares (Mínimos cuadrados ordinarios)
     results = model.fit()
 
     # Extraer los resultados de la regresión
@@ -111,10 +227,42 @@ def linear_regression_to_db(index, dbname, user='postgres', password='postgres',
     # Calcular t-values
     t_values = coefficients / std_errs  # Fórmula: t = coef / std_err
     # Calcular p-values P>|t|
-    p_values = 2 * (1 - t.cdf(np.abs(t_values), df=len(y) - 1))  # Dos colas
+    p_values = regression_p_values(t_values, len(y))  # Dos colas
+
+    # Sustituir los resultados de la regresión y los valores ajustados y residuos de cada punto
+    # en una sola transacción
+    def write_results():
+        insert_regression_results(conn, index, feature_names, coefficients, std_errs, p_values, t_values)
+        if point_results:
+            point_ids = [point[0] for point in points]
+            insert_regression_points(conn, index, 'linear', point_ids, X, y, coefficients, sample_size=sample_size)
+
+    run_in_transaction(conn, write_results)
+
+
+# Función para realizar la regresión lineal y almacenar los resultados
+# Con incremental=True se actualizan los estadísticos suficientes guardados del índice con los
+# puntos nuevos y se sustituyen sus resultados (full_refresh=True los recalcula desde cero); sin
+# él se reajusta sm.OLS sobre la matriz completa, lo que sirve también para verificar.
+# Con point_results=True se guardan también el ajustado y el residuo de cada punto en
+# grafana_ml_model_regression_point, con una muestra de unos sample_size puntos marcada.
+def linear_regression_to_db(index, dbname, user='postgres', password='postgres', host='localhost', port='5432', load_method='fetch', use_cache=False,
+                            incremental=False, full_refresh=False, block_size=10000, point_results=True, sample_size=500):
+    # Conectar a la base de datos
+    conn = connect_to_db(dbname, user, password, host, port)
 
-    # Insertar los resultados de la regresión en la base de datos
-    insert_regression_results(conn, index, feature_names, coefficients, std_errs, p_values, t_values)
+    if incremental:
+        # Combinar los puntos nuevos con los estadísticos guardados y sustituir los resultados
+        n = linear_regression_incremental(conn, index, block_size, full_refresh, point_results, sample_size)
+        conn.close()
+        print(f"Regresión lineal actualizada con {n} puntos en la base de datos: '{dbname}'")
+        return
+    
+    # Cargar los datos desde la base de la base de datos
+    data, feature_names, points = load_data_from_db(conn, index, load_method, use_cache)
+    
+    # Ajustar la regresión y guardar los resultados
+    linear_regression_on_data(conn, index, data, feature_names, points, point_results, sample_size)
 
     # Cerrar la conexión
     conn.close()
@@ -1,6 +1,13 @@
 import numpy as np
 import psycopg2
+from DataLoader import load_index_matrix, load_points, load_features, presence_mask, iter_index_blocks
+from MatrixCache import load_index_matrix_cached
+from BulkWriter import copy_rows
+from DatasetIngest import run_in_transaction
+from RegressionPoints import insert_regression_points, insert_regression_points_streaming
 import statsmodels.api as sm
+from scipy.special import expit
+from scipy.stats import norm  # Para el p-valor P>|z|
 
 # Función para conectar a la base de datos
 def connect_to_db(dbname, user='postgres', password='postgres', host='localhost', port='5432'):
@@ -20,89 +27,157 @@ def connect_to_db(dbname, user='postgres', password='postgres', host='localhost'
 
 
 # Función para cargar los datos de la base de datos
-def load_data_from_db(conn, index):
-    cur = conn.cursor()
-
-    # Cargar las características de los puntos
-    cur.execute("""
-        SELECT id, name
-        FROM grafana_ml_model_point
-        WHERE index = %s
-    """, (index,))
-    points = cur.fetchall()  # Los IDs y nombres de los puntos
-
-    # Cargar los valores de las características de los puntos
-    cur.execute("""
-        SELECT id_point, id_feature, value
-        FROM grafana_ml_model_point_value
-        WHERE index = %s
-    """, (index,))
-    values = cur.fetchall()  # Los valores de características (id_point, id_feature, value)
-
-    # Organizar los datos en un formato adecuado
-    num_points = len(points)
-    num_features = len(set([v[1] for v in values]))  # Identificar el número de características
-    data = np.zeros((num_points, num_features))  # Matriz de datos de características
+def load_data_from_db(conn, index, method='fetch', cache=False):
+    # Cargar los puntos y las características (id, nombre) ordenados por id
+    points = load_points(conn, index)
+    feature_names = load_features(conn, index)
 
-    # Llenar la matriz de datos con los valores
-    for v in values:
-        point_index = next(i for i, point in enumerate(points) if point[0] == v[0])  # Buscar el índice del punto
-        feature_index = v[1] - values[0][1]  # Asegurarse de que el índice de las características sea correcto
-        data[point_index, feature_index] = v[2]  # Asignar el valor al lugar adecuado
+    # Cargar la matriz de datos (filas en el orden de los puntos, columnas en el de las características)
+    load_matrix = load_index_matrix_cached if cache else load_index_matrix  # Caché local opcional
+    data, point_ids, feature_ids = load_matrix(conn, index, points=points, features=feature_names, method=method,
+                                               fill_value=np.nan)
 
-    # Cargar los nombres de las características
-    cur.execute("""
-        SELECT id, name
-        FROM grafana_ml_model_feature
-        WHERE index = %s
-    """, (index,))
-    feature_names = cur.fetchall()  # Cargar id y nombre de características
+    # Solo se usan los puntos completos (listwise): los que no tienen valor para alguna
+    # característica o para el objetivo se descartan en lugar de rellenarlos con ceros
+    complete = presence_mask(data).all(axis=1)
+    data = data[complete]
+    points = [point for point, keep in zip(points, complete) if keep]  # Alineados con las filas de data
 
-    cur.close()
     return data, feature_names, points
 
 
-# Función para insertar los resultados de la regresión logística en la base de datos
+# Función para sustituir los resultados de tipo 'logistic' del índice por los nuevos. No hace
+# commit: se llama dentro de run_in_transaction junto con el resto de escrituras del ajuste.
 def insert_logistic_regression_results(conn, index, feature_names, coefficients, p_values, std_errors):
-    cur = conn.cursor()
-
     # Insertar el intercepto y su estadística z
     z_value_intercept = coefficients[0] / std_errors[0]  # Calcular z-score para el intercepto
-    cur.execute("""
-        INSERT INTO grafana_ml_model_regression (index, id_feature, coeff, p_value, value, std_err, type)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-    """, (index, None, coefficients[0], p_values[0], z_value_intercept, std_errors[0], 'logistic'))
+    rows = [(index, None, coefficients[0], p_values[0], z_value_intercept, std_errors[0], 'logistic')]
 
     # Insertar los resultados de los coeficientes, z-score, p-values y desviación estándar
     for i, (coef, p_value, std_err) in enumerate(zip(coefficients[1:], p_values[1:], std_errors[1:])):
         feature_id = feature_names[i][0]  # El id de la característica
         z_value = coef / std_err  # Calcular el z-score
-        cur.execute("""
-            INSERT INTO grafana_ml_model_regression (index, id_feature, coeff, p_value, value, std_err, type)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """, (index, feature_id, coef, p_value, z_value, std_err, 'logistic'))
+        rows.append((index, feature_id, coef, p_value, z_value, std_err, 'logistic'))
 
-    conn.commit()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM grafana_ml_model_regression WHERE index = %s AND type = 'logistic'", (index,))
     cur.close()
+    copy_rows(conn, 'grafana_ml_model_regression',
+              ('index', 'id_feature', 'coeff', 'p_value', 'value', 'std_err', 'type'), rows)
 
 
-# Función para realizar la regresión logística y almacenar los resultados
-def logistic_regression_to_db(index, dbname, user='postgres', password='postgres', host='localhost', port='5432'):
-    # Conectar a la base de datos
-    conn = connect_to_db(dbname, user, password, host, port)
+# Función para cargar los últimos coeficientes guardados con type='logistic' de un índice, en el
+# orden (intercepto, características de feature_ids). Devuelve None si falta alguno.
+def load_logistic_coefficients(conn, index, feature_ids):
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT DISTINCT ON (id_feature) id_feature, coeff
+        FROM grafana_ml_model_regression
+        WHERE index = %s AND type = 'logistic'
+        ORDER BY id_feature, id DESC
+    """, (index,))
+    stored = dict(cur.fetchall())
+    cur.close()
+    keys = [None] + list(feature_ids)
+    if not all(key in stored and stored[key] is not None for key in keys):
+        return None
+    return np.array([stored[key] for key in keys], dtype=np.float64)
 
-    # Cargar los datos desde la base de la base de datos
-    data, feature_names, points = load_data_from_db(conn, index)
 
+# Generador de bloques (X, y) de un índice leídos de la base de datos en streaming: la última
+# característica es el objetivo y solo se usan los puntos completos (listwise)
+def iter_logistic_blocks(conn, index, features, block_size=10000):
+    for point_ids, block in iter_index_blocks(conn, index, block_size=block_size, features=features,
+                                              fill_value=np.nan):
+        block = block[presence_mask(block).all(axis=1)]
+        if len(block) > 0:
+            yield block[:, :-1], block[:, -1]
+
+
+# Función para acumular, bloque a bloque, el gradiente de la log-verosimilitud, la información
+# de Fisher X'WX (con W = p(1 - p)) y la log-verosimilitud en los coeficientes beta
+# (el primero es el intercepto). La memoria usada es la de un bloque más la matriz p x p.
+def logistic_pass(blocks, beta):
+    gradient = np.zeros(len(beta))
+    fisher = np.zeros((len(beta), len(beta)))
+    log_likelihood = 0.0
+    n = 0
+    for X, y in blocks:
+        X = np.column_stack([np.ones(len(X)), X])
+        eta = X @ beta
+        probabilities = expit(eta)
+        weights = probabilities * (1.0 - probabilities)
+        gradient += X.T @ (y - probabilities)
+        fisher += X.T @ (X * weights[:, None])
+        log_likelihood += float(y @ eta - np.logaddexp(0.0, eta).sum())
+        n += len(X)
+    return gradient, fisher, log_likelihood, n
+
+
+# Función para ajustar la regresión logística con IRLS (Newton-Raphson) por bloques.
+# blocks es una función sin argumentos que devuelve un iterable nuevo de bloques (X, y) en cada
+# pasada. start son los coeficientes iniciales (por ejemplo, los guardados de la ejecución
+# anterior); si se acercan a la solución bastan una o dos pasadas, y si su log-verosimilitud es
+# peor que la de partir de cero se descartan. Cada paso de Newton se divide a la mitad (hasta
+# max_halvings veces) mientras empeore la log-verosimilitud. Si un paso no es finito o no se
+# converge en max_iter iteraciones (por ejemplo, con datos separables) se lanza ValueError en
+# lugar de devolver coeficientes sin sentido.
+# Devuelve los coeficientes, sus errores estándar (raíz de la diagonal de la inversa de la
+# información de Fisher final), el número de iteraciones y el número de puntos.
+def logistic_irls(blocks, n_params, start=None, max_iter=35, tol=1e-8, max_halvings=30):
+    beta = np.zeros(n_params)
+    gradient, fisher, log_likelihood, n = logistic_pass(blocks(), beta)
+    if n == 0:
+        raise ValueError("El índice no tiene puntos completos para la regresión logística")
+    if start is not None:
+        start = np.asarray(start, dtype=np.float64)
+        state = logistic_pass(blocks(), start)
+        if np.isfinite(state[2]) and state[2] >= log_likelihood:
+            beta = start.copy()
+            gradient, fisher, log_likelihood, n = state
+
+    iteration = 0
+    converged = False
+    while not converged:
+        if iteration == max_iter:
+            raise ValueError(f"La regresión logística no converge en {max_iter} iteraciones IRLS "
+                             "(¿datos separables?)")
+        iteration += 1
+        step = np.linalg.pinv(fisher) @ gradient
+        if not np.all(np.isfinite(step)):
+            raise ValueError("Paso de IRLS no finito en la regresión logística")
+        converged = np.max(np.abs(step)) < tol
+
+        # Dividir el paso a la mitad mientras empeore la log-verosimilitud (con un margen para
+        # el redondeo cerca del óptimo)
+        for _ in range(max_halvings + 1):
+            state = logistic_pass(blocks(), beta + step)
+            if np.isfinite(state[2]) and state[2] >= log_likelihood - 1e-10 * (1.0 + abs(log_likelihood)):
+                break
+            step = step / 2
+        else:
+            raise ValueError("La log-verosimilitud no mejora en ninguna fracción del paso de IRLS")
+        beta = beta + step
+        gradient, fisher, log_likelihood, n = state
+
+    # Errores estándar con la información de Fisher en los coeficientes finales
+    std_errors = np.sqrt(np.diag(np.linalg.pinv(fisher)))
+    return beta, std_errors, iteration, n
+
+
+# Función para ajustar sm.Logit sobre una matriz ya cargada (la de load_data_from_db: puntos
+# completos, con el objetivo binario en la última columna) y almacenar los resultados. No
+# modifica data.
+def logistic_regression_on_data(conn, index, data, feature_names, points, point_results=True, sample_size=500):
     # Dividir los datos en características y objetivo
     X = data[:, :-1]  # Características
     y = data[:, -1]   # Variable objetivo
 
     # Añadir columna de unos para el término independiente
-    X = sm.add_constant(X)
+    X_const = sm.add_constant(X)
 
     # Crear y ajustar el modelo de regresión logística
-    model = sm.Logit(y, X)  # Modelo de regresión logística
+    model = sm.Logit(y, X_const)  # Modelo de regresión logística
     results = model.fit()
 
     # Extraer los resultados: coeficientes, p-values, desviación estándar
@@ -110,8 +185,65 @@ def logistic_regression_to_db(index, dbname, user='postgres', password='postgres
     p_values = results.pvalues  # P-values
     std_errors = results.bse  # Desviaciones estándar (errores estándar) de los coeficientes
 
-    # Insertar los resultados en la base de datos
-    insert_logistic_regression_results(conn, index, feature_names, coefficients, p_values, std_errors)
+    # Sustituir los resultados y la probabilidad predicha y el residuo de cada punto en una sola
+    # transacción
+    def write_results():
+        insert_logistic_regression_results(conn, index, feature_names, coefficients, p_values, std_errors)
+        if point_results:
+            point_ids = [point[0] for point in points]
+            insert_regression_points(conn, index, 'logistic', point_ids, X, y, coefficients, logistic=True,
+                                     sample_size=sample_size)
+
+    run_in_transaction(conn, write_results)
+
+
+# Función para realizar la regresión logística y almacenar los resultados
+# Con mode='irls' el modelo se ajusta con IRLS por bloques leídos en streaming de la base de datos
+# (memoria acotada, para índices grandes), partiendo de los coeficientes ya guardados del índice
+# si warm_start=True; si IRLS no converge se lanza ValueError y no se guarda nada.
+# Con mode='newton' (por defecto) se ajusta sm.Logit sobre la matriz completa.
+# Con point_results=True se guardan también la probabilidad predicha y el residuo de cada punto
+# en grafana_ml_model_regression_point, con una muestra de unos sample_size puntos marcada.
+def logistic_regression_to_db(index, dbname, user='postgres', password='postgres', host='localhost', port='5432', load_method='fetch', use_cache=False,
+                              mode='newton', block_size=10000, warm_start=True, max_iter=35, tol=1e-8,
+                              point_results=True, sample_size=500):
+    # Conectar a la base de datos
+    conn = connect_to_db(dbname, user, password, host, port)
+
+    if mode == 'irls':
+        feature_names = load_features(conn, index)
+        feature_ids = [feature[0] for feature in feature_names[:-1]]  # La última es el objetivo
+        start = load_logistic_coefficients(conn, index, feature_ids) if warm_start else None
+        try:
+            coefficients, std_errors, iterations, n = logistic_irls(
+                lambda: iter_logistic_blocks(conn, index, feature_names, block_size),
+                len(feature_ids) + 1, start, max_iter, tol)
+        except ValueError:
+            # Sin convergencia no se guarda nada (ni sirve de arranque para la siguiente ejecución)
+            conn.close()
+            raise
+
+        # Estadístico z y p-valores P>|z| a partir de la información de Fisher final
+        p_values = 2 * norm.sf(np.abs(coefficients / std_errors))
+        def write_results():
+            insert_logistic_regression_results(conn, index, feature_names, coefficients, p_values, std_errors)
+            if point_results:
+                insert_regression_points_streaming(conn, index, 'logistic', feature_names, coefficients, n,
+                                                   logistic=True, sample_size=sample_size, block_size=block_size)
+
+        run_in_transaction(conn, write_results)
+        conn.close()
+        print(f"Resultados de la regresión logística ({iterations} iteraciones IRLS, {n} puntos) "
+              f"insertados en la base de datos: '{dbname}'")
+        return
+    if mode != 'newton':
+        raise ValueError(f"Modo de regresión logística desconocido: {mode}")
+
+    # Cargar los datos desde la base de la base de datos
+    data, feature_names, points = load_data_from_db(conn, index, load_method, use_cache)
+
+    # Ajustar la regresión y guardar los resultados
+    logistic_regression_on_data(conn, index, data, feature_names, points, point_results, sample_size)
 
     # Cerrar la conexión
     conn.close()
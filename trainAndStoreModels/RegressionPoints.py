@@ -0,0 +1,67 @@
+import numpy as np
+from scipy.special import expit
+from BulkWriter import copy_arrays
+from DataLoader import iter_index_blocks, presence_mask
+
+# Resultados por punto de las regresiones (grafana_ml_model_regression_point).
+# Para cada punto usado en el ajuste se guardan el objetivo, el valor ajustado (en la regresión
+# logística, la probabilidad predicha) y el residuo (objetivo - ajustado), calculados de una vez
+# para todos los puntos con un producto matriz-vector. is_sample marca una muestra aleatoria de
+# unos sample_size puntos para que los paneles puedan pintar una serie reducida sin LIMIT.
+
+POINT_COLUMNS = ('index', 'type', 'id_point', 'target', 'fitted', 'residual', 'is_sample')
+
+
+# Función para calcular los valores ajustados y los residuos de un bloque de puntos con los
+# coeficientes (intercepto primero). Con logistic=True el ajustado es la probabilidad predicha.
+def fitted_values(X, y, coefficients, logistic=False):
+    fitted = X @ coefficients[1:] + coefficients[0]
+    if logistic:
+        fitted = expit(fitted)
+    return fitted, y - fitted
+
+
+# Función para borrar los resultados por punto anteriores de un índice y tipo de regresión
+def delete_regression_points(conn, index, regression_type):
+    cur = conn.cursor()
+    cur.execute("DELETE FROM grafana_ml_model_regression_point WHERE index = %s AND type = %s",
+                (index, regression_type))
+    cur.close()
+
+
+# Función para escribir los resultados de un bloque de puntos con COPY binario. La muestra es de
+# Bernoulli con probabilidad sample_fraction (el generador rng se comparte entre bloques).
+def copy_regression_points(conn, index, regression_type, point_ids, X, y, coefficients, logistic, rng,
+                           sample_fraction):
+    fitted, residuals = fitted_values(X, y, coefficients, logistic)
+    is_sample = rng.random(len(point_ids)) < sample_fraction
+    copy_arrays(conn, 'grafana_ml_model_regression_point', POINT_COLUMNS,
+                [np.full(len(point_ids), index), np.full(len(point_ids), regression_type), point_ids,
+                 y, fitted, residuals, is_sample],
+                types=['int4', 'text', 'int4', 'float8', 'float8', 'float8', 'bool'])
+
+
+# Función principal: sustituye los resultados por punto de un índice y tipo de regresión a partir
+# de la matriz ya cargada (point_ids alineados con las filas de X e y). No hace commit.
+def insert_regression_points(conn, index, regression_type, point_ids, X, y, coefficients, logistic=False,
+                             sample_size=500, seed=42):
+    delete_regression_points(conn, index, regression_type)
+    sample_fraction = min(1.0, sample_size / max(len(point_ids), 1))
+    copy_regression_points(conn, index, regression_type, np.asarray(point_ids), X, y, np.asarray(coefficients),
+                           logistic, np.random.default_rng(seed), sample_fraction)
+
+
+# Función para sustituir los resultados por punto recorriendo el índice por bloques (memoria
+# acotada). La última característica es el objetivo y solo se usan los puntos completos; n es el
+# número de puntos completos del índice (para calcular la fracción de la muestra).
+def insert_regression_points_streaming(conn, index, regression_type, features, coefficients, n, logistic=False,
+                                       sample_size=500, seed=42, block_size=10000):
+    delete_regression_points(conn, index, regression_type)
+    sample_fraction = min(1.0, sample_size / max(n, 1))
+    rng = np.random.default_rng(seed)
+    for point_ids, block in iter_index_blocks(conn, index, block_size=block_size, features=features,
+                                              fill_value=np.nan):
+        complete = presence_mask(block).all(axis=1)
+        if complete.any():
+            copy_regression_points(conn, index, regression_type, point_ids[complete], block[complete, :-1],
+                                   block[complete, -1], np.asarray(coefficients), logistic, rng, sample_fraction)
@@ -1,4 +1,6 @@
 import psycopg2
+import numpy as np
+from DatasetIngest import ingest_dataset
 from sklearn.datasets import load_breast_cancer
 
 # Conectar a la base de datos de PostgreSQL
@@ -10,9 +12,6 @@ conn = psycopg2.connect(
     port="5432"       
 )
 
-# Crear un cursor
-cur = conn.cursor()
-
 # Cargar el dataset de cáncer de mama
 cancer = load_breast_cancer()
 X = cancer.data
@@ -24,62 +23,14 @@ db_name = "Breast Cancer"
 description = "Dataset de cáncer de mama"
 creator = "scikit-learn"
 
-# Insertar los datos en la tabla grafana_ml_model_index
-cur.execute("""
-    INSERT INTO grafana_ml_model_index (name, description, creator) 
-    VALUES (%s, %s, %s) RETURNING id
-""", (db_name, description, creator))
-
-# Obtener el ID de la fila insertada y convertirlo a int
-index_id = int(cur.fetchone()[0])
-
-# Insertar los nombres de las características en la tabla grafana_ml_model_feature
-# Guardamos los IDs generados de las características
-feature_ids = []
-for feature in feature_names:
-    cur.execute("""
-        INSERT INTO grafana_ml_model_feature (index, name) 
-        VALUES (%s, %s) RETURNING id
-    """, (int(index_id), feature))  # Convertir index_id a int
-    feature_ids.append(int(cur.fetchone()[0]))  # Convertir a int y guardar el ID
-
-# Insertar la característica "target" en la tabla grafana_ml_model_feature
-cur.execute("""
-    INSERT INTO grafana_ml_model_feature (index, name) 
-    VALUES (%s, %s) RETURNING id
-""", (int(index_id), "target"))  # Insertamos "target" como una nueva característica
-target_feature_id = int(cur.fetchone()[0])  # Convertir a int el ID de la característica "target"
-
-# Insertar los puntos (instancias) en la tabla grafana_ml_model_point
-# Guardamos los IDs generados de los puntos
-point_ids = []
-for i in range(X.shape[0]):
-    cur.execute("""
-        INSERT INTO grafana_ml_model_point (index, name) 
-        VALUES (%s, %s) RETURNING id
-    """, (int(index_id), f"point_{i}"))  # Convertir index_id a int
-    point_ids.append(int(cur.fetchone()[0]))  # Convertir a int el ID de cada punto insertado
-
-# Insertar los valores en la tabla grafana_ml_model_point_value
-for i in range(X.shape[0]):
-    # Insertar los valores de las características X originales
-    for j in range(X.shape[1]):
-        cur.execute("""
-            INSERT INTO grafana_ml_model_point_value (index, id_point, id_feature, value) 
-            VALUES (%s, %s, %s, %s)
-        """, (int(index_id), int(point_ids[i]), int(feature_ids[j]), float(X[i, j])))  # Conversión a int/float según sea necesario
-    
-    # Insertar el valor de la característica "target" para cada punto
-    cur.execute("""
-        INSERT INTO grafana_ml_model_point_value (index, id_point, id_feature, value) 
-        VALUES (%s, %s, %s, %s)
-    """, (int(index_id), int(point_ids[i]), int(target_feature_id), float(y[i])))  # Conversión a int/float
+# Añadir el objetivo como una característica más ("target")
+X_with_target = np.column_stack([X, y])
+feature_names_with_target = list(feature_names) + ["target"]
 
-# Confirmar los cambios en la base de datos
-conn.commit()
+# Guardar el índice, las características, los puntos y sus valores en una sola transacción
+index_id = ingest_dataset(conn, db_name, description, creator, X_with_target, feature_names_with_target)
 
-# Cerrar el cursor y la conexión
-cur.close()
+# Cerrar la conexión
 conn.close()
 
 print("Datos insertados correctamente en la base de datos.")
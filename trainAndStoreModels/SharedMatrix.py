@@ -0,0 +1,73 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from threadpoolctl import threadpool_limits
+
+# Módulo compartido para repartir trabajo sobre una misma matriz entre varios procesos.
+# La matriz se copia una sola vez a memoria compartida (multiprocessing.shared_memory) y cada
+# proceso del pool la abre sin copiarla, como array de solo lectura. En cada proceso se limitan
+# los hilos de BLAS/OpenMP con threadpoolctl para no tener más hilos que núcleos.
+# Los procesos se crean con 'forkserver' y no con fork: el pool se puede abrir desde los hilos de
+# Pipeline, y un fork desde un proceso con varios hilos puede heredar cerrojos tomados (BLAS,
+# conexiones, logging) y bloquearse. Como con 'spawn', el script que lo use debe tener su código
+# de arranque bajo if __name__ == "__main__".
+
+# Matriz compartida del proceso actual (la abre init_worker al arrancar cada proceso del pool)
+worker_shm = None
+worker_matrix = None
+
+
+# Función para copiar una matriz a memoria compartida. Devuelve el bloque y su descriptor
+# (nombre, forma y dtype), que es lo único que hay que pasar a los procesos.
+def share_matrix(data):
+    data = np.ascontiguousarray(data)
+    shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+    shared = np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf)
+    shared[...] = data
+    return shm, (shm.name, data.shape, data.dtype.str)
+
+
+# Función para abrir una matriz compartida a partir de su descriptor (de solo lectura)
+def attach_matrix(descriptor):
+    name, shape, dtype = descriptor
+    shm = shared_memory.SharedMemory(name=name)
+    matrix = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    matrix.flags.writeable = False
+    return shm, matrix
+
+
+# Inicializador de cada proceso del pool: limita los hilos y abre la matriz compartida
+def init_worker(descriptor, threads=1):
+    global worker_shm, worker_matrix
+    threadpool_limits(limits=threads)
+    worker_shm, worker_matrix = attach_matrix(descriptor)
+
+
+# Función para obtener la matriz compartida desde una tarea que se ejecuta en el pool
+def get_worker_matrix():
+    return worker_matrix
+
+
+# Función para ejecutar function(task) para cada tarea en un pool de processes procesos (por
+# defecto, uno por núcleo) que comparten la matriz data. Cada proceso usa threads hilos de
+# BLAS/OpenMP. Es un generador: devuelve los resultados en el orden de las tareas a medida que
+# terminan, para poder consumirlos (por ejemplo, escribirlos en la base de datos) sin esperar a
+# todos. La memoria compartida se libera al agotar o cerrar el generador.
+def imap_shared(data, function, tasks, processes=None, threads=1):
+    tasks = list(tasks)
+    processes = min(processes or os.cpu_count() or 1, max(len(tasks), 1))
+    shm, descriptor = share_matrix(data)
+    try:
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('forkserver'),
+                                 initializer=init_worker, initargs=(descriptor, threads)) as executor:
+            yield from executor.map(function, tasks)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+# Función principal: como imap_shared, pero devuelve la lista completa de resultados
+def map_shared(data, function, tasks, processes=None, threads=1):
+    return list(imap_shared(data, function, tasks, processes, threads))